@@ -0,0 +1,112 @@
+"""
+File: billing_run.py
+
+Scopo: eseguire la fatturazione di fine mese per tutti gli utenti in parallelo.
+
+Ogni riga della tabella di input e' un dict con esattamente i parametri keyword di
+`cost_monthly_user_debug`. La tabella viene divisa in blocchi (chunk) distribuiti su un
+pool di processi; ogni processo usa la versione silenziosa `cost_monthly_user_breakdown`
+(nessuna print), e i risultati vengono restituiti nello stesso ordine delle righe
+di input, indipendentemente dal numero di processi.
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from app.compute_total_monthly_cost import cost_monthly_user_breakdown
+
+
+def _bill_chunk(rows: list) -> list:
+    """Calcola il breakdown mensile di un blocco di utenti (eseguito nei worker)."""
+    return [cost_monthly_user_breakdown(**row) for row in rows]
+
+
+def run_monthly_billing(
+    user_params: list,
+    processes: int = None,
+    chunk_size: int = None
+) -> list:
+    """
+    Calcola il costo mensile (chat / ingestion / storage / totale) di ogni utente,
+    distribuendo il lavoro su un pool di processi.
+
+    Parametri:
+    -----------
+    user_params : list di dict
+        Una riga per utente, con i parametri keyword di `cost_monthly_user_debug`.
+    processes : int
+        Numero di processi del pool (default: numero di core). Con processes=1
+        il calcolo avviene nel processo corrente, senza pool.
+    chunk_size : int
+        Numero di utenti per blocco inviato a un worker. Di default la tabella
+        viene divisa in ~4 blocchi per processo, per bilanciare il carico
+        ammortizzando il costo di serializzazione.
+
+    Ritorna:
+    -----------
+    list di CostBreakdown
+        Per ogni utente (stesso ordine di `user_params`) il `CostBreakdown` con le
+        voci chat / ingestion / storage e il totale (`.total`), in dollari.
+    """
+    rows = list(user_params)
+    if not rows:
+        return []
+
+    if processes is None:
+        processes = os.cpu_count() or 1
+    processes = max(1, min(processes, len(rows)))
+
+    if processes == 1:
+        return _bill_chunk(rows)
+
+    if chunk_size is None:
+        chunk_size = max(1, -(-len(rows) // (processes * 4)))
+    chunks = [rows[i:i + chunk_size] for i in range(0, len(rows), chunk_size)]
+
+    results = []
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        # executor.map preserva l'ordine dei blocchi => ordinamento deterministico
+        for chunk_result in pool.map(_bill_chunk, chunks):
+            results.extend(chunk_result)
+    return results
+
+
+if __name__ == "__main__":
+    import random
+    import time
+
+    # Parametri di base (gli stessi dell'esempio in compute_total_monthly_cost.py)
+    base_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    # Tabella sintetica di utenti con uso variabile
+    rng = random.Random(0)
+    table = []
+    for _ in range(100_000):
+        row = dict(base_params)
+        row["n_chat"] = rng.randint(0, 30)
+        row["n_doc"] = rng.randint(0, 50)
+        row["n_img"] = rng.randint(0, 20)
+        row["n_vid"] = rng.randint(0, 5)
+        table.append(row)
+
+    for n_proc in sorted({1, os.cpu_count() or 1}):
+        t0 = time.perf_counter()
+        breakdowns = run_monthly_billing(table, processes=n_proc)
+        elapsed = time.perf_counter() - t0
+        total = sum(b.total for b in breakdowns)
+        print(f"processi={n_proc}: {len(breakdowns)} utenti in {elapsed:.2f}s "
+              f"-> totale fatturato={total:.2f} $")
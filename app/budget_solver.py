@@ -0,0 +1,233 @@
+"""
+File: budget_solver.py
+
+Scopo: risolvere il problema "inverso" del costo mensile: dato un budget (es. 2 $/mese),
+       trovare il valore massimo di uno o piu' parametri di `cost_monthly_user_debug`
+       che mantiene l'utente sotto il budget. Esempi:
+       - quale fraction_4o massima resta sotto 2 $/mese?
+       - quanti documenti (n_doc) puo' caricare un utente del piano gratuito?
+
+Strategia:
+- parametri rispetto ai quali il costo e' affine (fraction_4o, n_chat, gb_stored_user, ...):
+  forma chiusa con due valutazioni del motore silenzioso;
+- parametri a gradini (conteggi arrotondati per bucket, es. n_doc con fraction_hires,
+  fraction_hires, fraction_4o_imgvid, ...): bisezione vettorizzata, valutando a ogni passo
+  un'intera griglia di candidati con una sola chiamata a `cost_monthly_user_batch`.
+
+In entrambi i casi si assume che il costo sia non decrescente nel parametro risolto.
+"""
+
+import math
+
+import numpy as np
+
+from app.compute_total_monthly_cost import (
+    cost_monthly_user,
+    cost_monthly_user_batch
+)
+
+
+# Parametri rispetto ai quali il costo mensile e' esattamente affine
+AFFINE_PARAMS = {
+    "n_chat",
+    "n_msg_per_chat",
+    "user_tokens_per_msg",
+    "out_tokens_per_msg",
+    "n_kbox_per_msg",
+    "chunk_size_retrieval",
+    "fraction_4o",
+    "gb_stored_user",
+    "max_pairs",
+    "avg_tokens_per_message"
+}
+
+# Parametri che devono assumere valori interi
+INTEGER_PARAMS = {
+    "n_chat",
+    "n_msg_per_chat",
+    "n_doc",
+    "n_img",
+    "n_vid",
+    "pages_per_doc",
+    "max_pairs"
+}
+
+# Candidati valutati per ogni passo della bisezione vettorizzata
+BISECTION_GRID = 64
+
+
+def _is_affine(name: str, params: dict) -> bool:
+    if name not in AFFINE_PARAMS:
+        return False
+    # Con history crescente il costo non e' piu' affine in max_pairs / n_msg_per_chat
+    if params.get("growing_history") and name in ("max_pairs", "n_msg_per_chat"):
+        return False
+    # Con il prompt caching (attivo solo con history crescente) anche avg_tokens_per_message
+    # entra in modo non affine (soglia minima del prefisso in cache)
+    if (params.get("growing_history") and params.get("cached_input_ratio") is not None
+            and name == "avg_tokens_per_message"):
+        return False
+    return True
+
+
+def _solve_affine(params, name, budget, low, high, integer):
+    cost_low = cost_monthly_user(**dict(params, **{name: low}))
+    if cost_low > budget:
+        return None
+    cost_high = cost_monthly_user(**dict(params, **{name: high}))
+    if cost_high <= budget:
+        return high
+    x = low + (budget - cost_low) * (high - low) / (cost_high - cost_low)
+    if integer:
+        x = math.floor(x)
+        # Protezione dagli errori di arrotondamento al bordo
+        if cost_monthly_user(**dict(params, **{name: x})) > budget:
+            x -= 1
+    return min(max(x, low), high)
+
+
+def _solve_bisection(params, name, budget, low, high, integer, tolerance):
+    def costs(values):
+        return cost_monthly_user_batch(**dict(params, **{name: values})).total
+
+    if costs(np.array([low]))[0] > budget:
+        return None
+    if costs(np.array([high]))[0] <= budget:
+        return high
+
+    # Invariante: cost(low) <= budget < cost(high)
+    while True:
+        if integer:
+            if high - low <= 1:
+                return int(low)
+            n = min(BISECTION_GRID, int(high - low) - 1)
+            grid = np.unique(np.linspace(low, high, n + 2)[1:-1].round()).astype(np.int64)
+        else:
+            if high - low <= tolerance:
+                return low
+            grid = np.linspace(low, high, BISECTION_GRID + 2)[1:-1]
+        within = costs(grid) <= budget
+        # Ultimo candidato sotto budget e primo sopra (costo non decrescente)
+        n_within = int(np.argmin(within)) if not within.all() else len(grid)
+        if n_within > 0:
+            low = grid[n_within - 1]
+        if n_within < len(grid):
+            high = grid[n_within]
+
+
+def solve_budget(
+    params: dict,
+    name: str,
+    budget: float,
+    low: float = 0.0,
+    high: float = None,
+    tolerance: float = 1e-9
+):
+    """
+    Trova il valore massimo del parametro `name` in [low, high] per cui il costo mensile
+    (`cost_monthly_user`) non supera `budget`.
+
+    Parametri:
+    -----------
+    params : dict
+        Parametri keyword di `cost_monthly_user_debug` (il valore di `name` viene ignorato).
+    name : str
+        Parametro da risolvere (es. "fraction_4o", "n_doc", "max_pairs").
+    budget : float
+        Costo mensile massimo, in dollari.
+    low, high : float
+        Intervallo di ricerca. Per le frazioni `high` vale 1.0 di default;
+        per gli altri parametri e' obbligatorio.
+    tolerance : float
+        Precisione per i parametri continui risolti per bisezione.
+
+    Ritorna:
+    -----------
+    float o int o None
+        Il valore massimo ammesso (int per i parametri interi), oppure None se
+        nemmeno `low` rientra nel budget.
+    """
+    if high is None:
+        if not name.startswith("fraction"):
+            raise ValueError(f"Specificare 'high' per il parametro {name!r}")
+        high = 1.0
+    integer = name in INTEGER_PARAMS
+    if integer:
+        low, high = int(math.ceil(low)), int(math.floor(high))
+
+    if _is_affine(name, params):
+        return _solve_affine(params, name, budget, low, high, integer)
+    return _solve_bisection(params, name, budget, low, high, integer, tolerance)
+
+
+def solve_budget_scale(
+    params: dict,
+    names,
+    budget: float,
+    high: float = 1e6,
+    tolerance: float = 1e-9
+) -> float:
+    """
+    Trova il fattore di scala massimo s >= 0 tale che, moltiplicando per s tutti i
+    parametri in `names` (es. n_doc, n_img, n_vid), il costo mensile resti entro `budget`.
+    I parametri interi vengono arrotondati per difetto dopo la scalatura.
+
+    Ritorna:
+    -----------
+    float o None
+        Il fattore massimo, oppure None se anche s = 0 supera il budget.
+    """
+    names = list(names)
+    base = {n: params[n] for n in names}
+
+    def costs(scales):
+        scaled = dict(params)
+        for n in names:
+            values = scales * base[n]
+            scaled[n] = np.floor(values) if n in INTEGER_PARAMS else values
+        return cost_monthly_user_batch(**scaled).total
+
+    low = 0.0
+    if costs(np.array([low]))[0] > budget:
+        return None
+    if costs(np.array([high]))[0] <= budget:
+        return high
+    while high - low > tolerance * max(1.0, low):
+        grid = np.linspace(low, high, BISECTION_GRID + 2)[1:-1]
+        within = costs(grid) <= budget
+        n_within = int(np.argmin(within)) if not within.all() else len(grid)
+        if n_within > 0:
+            low = grid[n_within - 1]
+        if n_within < len(grid):
+            high = grid[n_within]
+    return float(low)
+
+
+if __name__ == "__main__":
+    import time
+
+    example_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    for name, budget, high in (("fraction_4o", 2.0, None), ("n_doc", 3.0, 100_000),
+                               ("fraction_hires", 2.6, None), ("max_pairs", 2.0, 1000)):
+        t0 = time.perf_counter()
+        value = solve_budget(example_params, name, budget, high=high)
+        elapsed = (time.perf_counter() - t0) * 1e6
+        print(f"budget={budget} $ -> {name} massimo = {value} ({elapsed:.0f} us)")
+
+    scale = solve_budget_scale(example_params, ["n_doc", "n_img", "n_vid"], 5.0)
+    print(f"budget=5.0 $ -> ingestion scalabile di un fattore {scale:.3f}")
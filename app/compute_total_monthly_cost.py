@@ -13,17 +13,45 @@ NOVITÀ:
   e (1 - fraction_4o_imgvid) che usa GPT-4o Mini per la caption.
 - Possibile definire frazione doc in pipeline Hi-Res (fraction_hires), e la parte restante
   è pipeline Fast. In base a ciò, un tot di doc usa c_page=0.01, e un tot usa c_page=0.001.
+- `cost_monthly_user(...)`: stessi parametri e stesso risultato di `cost_monthly_user_debug`,
+  ma senza print; ogni bucket di ingestion e' calcolato una sola volta (O(1) in n_doc/n_img/n_vid).
+  `cost_monthly_user_breakdown(...)` ritorna un `CostBreakdown` con tutte le voci separate.
+- I prezzi possono essere presi dal catalogo versionato di `price_catalog.py`
+  (vedi `monthly_price_kwargs`).
+- `cost_monthly_user_batch(...)`: stessi parametri, accetta array NumPy (una riga per
+  utente/campione) e ritorna un `CostBreakdown` di array.
+- Prompt caching opzionale (cached_input_ratio, cache_hit_rate): con growing_history=True
+  il prefisso di history riusato tra i turni di una chat e' fatturato al prezzo ridotto,
+  in forma chiusa (con la finestra fissa che scorre non c'e' prefisso riusato).
 
 NOTA: questo script produce in output una serie di "print" di debug
       per evidenziare come viene composto il costo finale.
 """
 
+import numpy as np
+
 # Importiamo le funzioni dal "primo script" (chat usage)
-# Nomi di moduli/funzioni puramente dimostrativi:
+# Nomi di moduli/funzioni puramente dimostrativi.
+# calculate_history_tokens, build_history_text, cost_of_message, tokens_for_resolution e
+# cost_upload_* non sono piu' usate qui (si usano le versioni in cache), ma restano importate
+# perche' i chiamanti esistenti le importano da questo modulo.
 from app.send_message import (
+    average_history_pairs,
+    average_history_pairs_batch,
+    average_cached_history_tokens,
+    average_cached_history_tokens_batch,
     calculate_history_tokens,
     build_history_text,
     cost_of_message,
+    cost_of_message_batch,
+)
+
+from app.cost_breakdown import CostBreakdown
+from app.price_catalog import (
+    cached_cost_of_message,
+    cached_cost_upload_pdf,
+    cached_cost_upload_image,
+    cached_cost_upload_video
 )
 
 # Importiamo le funzioni dal "secondo script" (ingestion, file kbox):
@@ -31,7 +59,10 @@ from app.upload_file_in_kbox import (
     tokens_for_resolution,
     cost_upload_pdf,
     cost_upload_image,
-    cost_upload_video
+    cost_upload_video,
+    cost_upload_pdf_batch,
+    cost_upload_image_batch,
+    cost_upload_video_batch
 )
 
 
@@ -102,7 +133,16 @@ def cost_monthly_user_debug(
 
     # Parametri storage
     gb_stored_user: float,   # GB memorizzati dall'utente
-    c_gb_month: float        # costo per GB/mese (es. 0.25)
+    c_gb_month: float,       # costo per GB/mese (es. 0.25)
+
+    # Parametri history della chat
+    max_pairs: int = 25,                # finestra massima di history (coppie utente+AI)
+    avg_tokens_per_message: int = 100,  # token medi per messaggio nella history
+    growing_history: bool = False,      # True => history che cresce da vuota fino a max_pairs
+
+    # Prompt caching del provider (prefisso di history riusato tra i turni)
+    cached_input_ratio: float = None,   # prezzo token di input in cache / p_in (es. 0.5); None => nessuna cache
+    cache_hit_rate: float = 1.0         # frazione dei turni in cui la cache e' ancora valida
 ) -> float:
     """
     Calcola il costo mensile di un utente, con debug di tutte le voci (chat, ingestion, storage).
@@ -110,12 +150,27 @@ def cost_monthly_user_debug(
     - Chat: frazione fraction_4o di messaggi su GPT-4o, il resto su GPT-4o Mini
     - Documenti: frazione fraction_hires (0.01 $/page), e (1 - fraction_hires) su 0.001 $/page
     - Immagini/Video: frazione fraction_4o_imgvid su GPT-4o, resto su GPT-4o Mini
+    - History: di default sempre piena (max_pairs coppie); con growing_history=True
+      ogni chat parte vuota e la history cresce fino a max_pairs (vedi `cost_of_chat`)
+    - Prompt caching: con cached_input_ratio (es. 0.5) e growing_history=True i token del
+      prefisso di history riusato dal turno precedente costano cached_input_ratio * p_in;
+      il numero medio di token in cache per messaggio e' in forma chiusa su n_msg_per_chat
+      (vedi `average_cached_history_tokens`). Con la finestra fissa di max_pairs coppie la
+      history scorre a ogni turno, il prefisso cambia e non c'e' riuso (nessuno sconto).
+
+    Il calcolo e' delegato a `cost_monthly_user_breakdown`; qui si stampano i parametri
+    e la resa di debug del `CostBreakdown` risultante.
 
     Ritorna un float in dollari.
     """
+    params = dict(locals())
+
     print("=== DEBUG COST MONTHLY USER (MIX GPT-4o/Mini su Chat e su Immagini/Video) ===")
     print("PARAMETRI CHAT / FRAZIONE GPT-4o:")
     print(f"  n_chat = {n_chat}, n_msg_per_chat = {n_msg_per_chat}, fraction_4o (chat) = {fraction_4o}")
+    print(f"  max_pairs = {max_pairs}, avg_tokens_per_message = {avg_tokens_per_message}, "
+          f"growing_history = {growing_history}")
+    print(f"  cached_input_ratio = {cached_input_ratio}, cache_hit_rate = {cache_hit_rate}")
     print(f"  => GPT-4o: p_in_4o={p_in_4o}, p_out_4o={p_out_4o}")
     print(f"  => GPT-4o Mini: p_in_mini={p_in_mini}, p_out_mini={p_out_mini}")
     print()
@@ -138,180 +193,376 @@ def cost_monthly_user_debug(
     print(f"  gb_stored_user={gb_stored_user} GB, c_gb_month={c_gb_month}")
     print("=========================================================\n")
 
-    #
-    # 1) Calcolo COSTO CHAT: mescoliamo fraction_4o con GPT-4o e (1 - fraction_4o) con GPT-4o Mini
-    #
-    from math import ceil
+    breakdown = cost_monthly_user_breakdown(**params)
+    print(breakdown.format_debug() + "\n")
 
-    total_msgs = n_chat * n_msg_per_chat
+    return breakdown.total
 
-    print("=== DEBUG: COSTO CHAT ===")
-    # 1a) calcoliamo costo di un messaggio GPT-4o puro
-    cost_one_message_4o = cost_of_message(
-        max_pairs=25,
-        avg_tokens_per_message=100,  # fissi ipotetici
-        user_tokens=user_tokens_per_msg,
-        n_kbox=n_kbox_per_msg,
-        r_per_kbox=r_per_kbox,
-        chunk_size=chunk_size_retrieval,
-        out_tokens=out_tokens_per_msg,
-        p_in=p_in_4o,
-        p_out=p_out_4o,
-        c_retrieval=c_retrieval,
-        c_store=c_store
-    )
-    # 1b) calcoliamo costo di un messaggio GPT-4o Mini puro
-    cost_one_message_mini = cost_of_message(
-        max_pairs=25,
-        avg_tokens_per_message=100,  # ipotetici
+
+def cost_monthly_user_breakdown(
+    # Parametri generali per la chat
+    n_chat: int,            # Numero medio di chat create al mese
+    n_msg_per_chat: int,    # Numero di messaggi per chat
+    user_tokens_per_msg: float,  # Token input medi dell'utente
+    n_kbox_per_msg: float,       # KBox consultate in media
+    r_per_kbox: float,           # Risultati per KBox
+    chunk_size_retrieval: float, # Token chunk di retrieval
+    out_tokens_per_msg: float,   # Token output medi (risposta)
+    fraction_4o: float,          # Frazione di messaggi GPT-4o vs. (1 - fraction_4o) su GPT-4o Mini
+
+    # Costi GPT-4o per chat
+    p_in_4o: float,             # costo input GPT-4o (es. 0.005)
+    p_out_4o: float,            # costo output GPT-4o (es. 0.015)
+    # Costi GPT-4o Mini per chat
+    p_in_mini: float,           # costo input GPT-4o Mini (es. 0.00015)
+    p_out_mini: float,          # costo output GPT-4o Mini (es. 0.00060)
+
+    # Costi retrieval e store per un messaggio
+    c_retrieval: float,         # costo retrieval fisso (embedding query + ricerche)
+    c_store: float,             # costo store fisso per messaggio
+
+    # Parametri ingestion
+    n_doc: int,                 # documenti caricati al mese
+    n_img: int,                 # immagini caricate al mese
+    n_vid: int,                 # video caricati al mese
+
+    # FRAZIONE di doc che usa pipeline hi-res vs fast
+    fraction_hires: float,      # es. 0.6 => 60% doc usano hi-res, 40% doc usano fast
+    # costi "hi-res" e "fast"
+    c_page_hires: float,       # 0.01
+    c_page_fast: float,        # 0.001
+
+    t_total_doc: float,        # token totali medi per doc
+    barT_chunk_doc: float,
+    c_embed_doc: float,
+    c_db_chunk_doc: float,
+    pages_per_doc: int,
+
+    # FRAZIONE di immagini/video che usa GPT-4o vs GPT-4o Mini:
+    fraction_4o_imgvid: float,  # es. 0.3 => 30% di img/video caption con GPT-4o, 70% con mini
+    # costi GPT-4o (immagini/video):
+    p_in_4o_imgvid: float,      # es. 0.005
+    p_out_4o_imgvid: float,     # es. 0.015
+    # costi GPT-4o Mini (immagini/video):
+    p_in_mini_imgvid: float,    # es. 0.00015
+    p_out_mini_imgvid: float,   # es. 0.00060
+
+    # param immagine
+    img_width: int,
+    img_height: int,
+    t_descr_img: float,
+    c_embed_img: float,
+    c_db_chunk_img: float,
+
+    # param video
+    dur_sec_vid: float,
+    sampling_sec_vid: float,
+    vid_width: int,
+    vid_height: int,
+    t_descr_vid_frame: float,
+    c_embed_vid: float,
+    c_db_chunk_vid: float,
+    t_descr_vid_total: float,  # token totali di tutte le caption fuse
+
+    # Parametri storage
+    gb_stored_user: float,   # GB memorizzati dall'utente
+    c_gb_month: float,       # costo per GB/mese (es. 0.25)
+
+    # Parametri history della chat
+    max_pairs: int = 25,                # finestra massima di history (coppie utente+AI)
+    avg_tokens_per_message: int = 100,  # token medi per messaggio nella history
+    growing_history: bool = False,      # True => history che cresce da vuota fino a max_pairs
+
+    # Prompt caching del provider (prefisso di history riusato tra i turni)
+    cached_input_ratio: float = None,   # prezzo token di input in cache / p_in (es. 0.5); None => nessuna cache
+    cache_hit_rate: float = 1.0         # frazione dei turni in cui la cache e' ancora valida
+) -> CostBreakdown:
+    """
+    Versione "silenziosa" di `cost_monthly_user_debug`: stessi parametri e stesso
+    risultato (in dollari), ma senza alcuna print di debug, suddiviso per voce.
+
+    Ogni bucket di ingestion (doc hi-res/fast, immagini GPT-4o/Mini, video GPT-4o/Mini)
+    viene calcolato una sola volta e moltiplicato per il numero di elementi, per cui
+    il tempo di calcolo e' O(1) rispetto a n_doc, n_img e n_vid. I costi unitari passano
+    per la cache LRU di `app.price_catalog`, condivisa tra utenti con gli stessi parametri.
+
+    Ritorna un `CostBreakdown` con tutte le voci (chat GPT-4o/Mini, doc Hi-Res/Fast,
+    img e video GPT-4o/Mini, storage) in dollari; il totale e' `.total`.
+    """
+    # 1) Chat: con history crescente il costo di una chat e' affine nel numero di
+    #    coppie, quindi equivale a messaggi con il numero medio di coppie (forma chiusa)
+    if growing_history:
+        history_pairs = average_history_pairs(n_msg_per_chat, max_pairs)
+    else:
+        history_pairs = max_pairs
+    history_kwargs = dict(
+        max_pairs=history_pairs,
+        avg_tokens_per_message=avg_tokens_per_message,
         user_tokens=user_tokens_per_msg,
         n_kbox=n_kbox_per_msg,
         r_per_kbox=r_per_kbox,
         chunk_size=chunk_size_retrieval,
         out_tokens=out_tokens_per_msg,
-        p_in=p_in_mini,
-        p_out=p_out_mini,
         c_retrieval=c_retrieval,
         c_store=c_store
     )
-    fraction_mini = 1.0 - fraction_4o
-    cost_one_message_mixed = fraction_4o*cost_one_message_4o + fraction_mini*cost_one_message_mini
-    cost_chat_month = total_msgs * cost_one_message_mixed
-
-    print(f"   cost_one_message_4o   = {cost_one_message_4o:.6f}  (GPT-4o puro)")
-    print(f"   cost_one_message_mini = {cost_one_message_mini:.6f}  (GPT-4o Mini puro)")
-    print(f"   fraction_4o = {fraction_4o}, fraction_mini = {fraction_mini}")
-    print(f"   => cost_one_message_mixed = {cost_one_message_mixed:.6f}")
-    print(f"   total_msgs = {total_msgs}, => cost_chat_month = {cost_chat_month:.6f}\n")
-
-    #
-    # 2) Costo ingestion
-    #
-    cost_ingestion = 0.0
-    print("=== DEBUG: COSTO INGESTION (DOC, IMG, VID) ===")
-
-    # 2a) Documenti
-    print(f" -> Caricamento di {n_doc} doc totali.")
+    total_msgs = n_chat * n_msg_per_chat
+    cost_one_message_4o = cached_cost_of_message(
+        p_in=p_in_4o, p_out=p_out_4o, breakdown="chat_4o", **history_kwargs)
+    cost_one_message_mini = cached_cost_of_message(
+        p_in=p_in_mini, p_out=p_out_mini, breakdown="chat_mini", **history_kwargs)
+    result = (total_msgs * fraction_4o) * cost_one_message_4o \
+        + (total_msgs * (1.0 - fraction_4o)) * cost_one_message_mini
+    if cached_input_ratio is not None and growing_history:
+        # Sconto sui token di history riletti dalla cache: (1 - ratio) * p_in per token
+        # (con la finestra fissa la history scorre a ogni turno: nessun prefisso riusato)
+        cached_tokens = average_cached_history_tokens(n_msg_per_chat, max_pairs, avg_tokens_per_message)
+        discount = (1.0 - cached_input_ratio) * cache_hit_rate * cached_tokens / 1000.0
+        result += CostBreakdown(
+            chat_4o=-(total_msgs * fraction_4o) * discount * p_in_4o,
+            chat_mini=-(total_msgs * (1.0 - fraction_4o)) * discount * p_in_mini
+        )
+
+    # 2) Ingestion: un costo unitario per bucket, moltiplicato per il conteggio
     n_doc_hires = int(round(n_doc * fraction_hires))
-    n_doc_fast  = n_doc - n_doc_hires
-    print(f"    fraction_hires = {fraction_hires} => n_doc_hires={n_doc_hires}, n_doc_fast={n_doc_fast}")
+    n_doc_fast = n_doc - n_doc_hires
+    n_img_gpt4o = int(round(n_img * fraction_4o_imgvid))
+    n_img_mini = n_img - n_img_gpt4o
+    n_vid_gpt4o = int(round(n_vid * fraction_4o_imgvid))
+    n_vid_mini = n_vid - n_vid_gpt4o
+
+    doc_kwargs = dict(
+        n_pages=pages_per_doc,
+        t_total=t_total_doc,
+        barT_chunk=barT_chunk_doc,
+        c_embed=c_embed_doc,
+        c_db_chunk=c_db_chunk_doc
+    )
+    img_kwargs = dict(
+        width=img_width,
+        height=img_height,
+        t_descr=t_descr_img,
+        c_embed=c_embed_img,
+        c_db_chunk=c_db_chunk_img
+    )
+    vid_kwargs = dict(
+        duration_sec=dur_sec_vid,
+        sampling_sec=sampling_sec_vid,
+        width=vid_width,
+        height=vid_height,
+        t_descr=t_descr_vid_frame,
+        c_embed=c_embed_vid,
+        c_db_chunk=c_db_chunk_vid,
+        t_descr_total=t_descr_vid_total
+    )
 
-    # Carichiamo doc hires
-    for i in range(n_doc_hires):
-        cost_doc = cost_upload_pdf(
-            n_pages=pages_per_doc,
-            c_page=c_page_hires,   # 0.01
-            t_total=t_total_doc,
-            barT_chunk=barT_chunk_doc,
-            c_embed=c_embed_doc,
-            c_db_chunk=c_db_chunk_doc
-        )
-        cost_ingestion += cost_doc
-        print(f"    doc hires #{i+1}: cost_doc = {cost_doc:.6f} $")
+    if n_doc_hires:
+        result += n_doc_hires * cached_cost_upload_pdf(
+            c_page=c_page_hires, breakdown="doc_hires", **doc_kwargs)
+    if n_doc_fast:
+        result += n_doc_fast * cached_cost_upload_pdf(
+            c_page=c_page_fast, breakdown="doc_fast", **doc_kwargs)
+    if n_img_gpt4o:
+        result += n_img_gpt4o * cached_cost_upload_image(
+            p_in=p_in_4o_imgvid, p_out=p_out_4o_imgvid, breakdown="img_4o", **img_kwargs)
+    if n_img_mini:
+        result += n_img_mini * cached_cost_upload_image(
+            p_in=p_in_mini_imgvid, p_out=p_out_mini_imgvid, breakdown="img_mini", **img_kwargs)
+    if n_vid_gpt4o:
+        result += n_vid_gpt4o * cached_cost_upload_video(
+            p_in=p_in_4o_imgvid, p_out=p_out_4o_imgvid, breakdown="vid_4o", **vid_kwargs)
+    if n_vid_mini:
+        result += n_vid_mini * cached_cost_upload_video(
+            p_in=p_in_mini_imgvid, p_out=p_out_mini_imgvid, breakdown="vid_mini", **vid_kwargs)
+
+    # 3) Storage
+    return result + CostBreakdown(storage=gb_stored_user * c_gb_month)
+
+
+def cost_monthly_user(**params) -> float:
+    """
+    Versione "silenziosa" di `cost_monthly_user_debug`: accetta gli stessi
+    parametri (keyword) e ritorna il costo mensile totale in dollari, senza print.
+    Vedi `cost_monthly_user_breakdown` per il dettaglio delle singole voci.
+    """
+    return cost_monthly_user_breakdown(**params).total
+
+
+def cost_monthly_user_batch(
+    # Parametri generali per la chat
+    n_chat,            # Numero medio di chat create al mese
+    n_msg_per_chat,    # Numero di messaggi per chat
+    user_tokens_per_msg,  # Token input medi dell'utente
+    n_kbox_per_msg,       # KBox consultate in media
+    r_per_kbox,           # Risultati per KBox
+    chunk_size_retrieval, # Token chunk di retrieval
+    out_tokens_per_msg,   # Token output medi (risposta)
+    fraction_4o,          # Frazione di messaggi GPT-4o vs. (1 - fraction_4o) su GPT-4o Mini
 
-    # Carichiamo doc fast
-    for j in range(n_doc_fast):
-        cost_doc = cost_upload_pdf(
+    # Costi GPT-4o per chat
+    p_in_4o,             # costo input GPT-4o (es. 0.005)
+    p_out_4o,            # costo output GPT-4o (es. 0.015)
+    # Costi GPT-4o Mini per chat
+    p_in_mini,           # costo input GPT-4o Mini (es. 0.00015)
+    p_out_mini,          # costo output GPT-4o Mini (es. 0.00060)
+
+    # Costi retrieval e store per un messaggio
+    c_retrieval,         # costo retrieval fisso (embedding query + ricerche)
+    c_store,             # costo store fisso per messaggio
+
+    # Parametri ingestion
+    n_doc,                 # documenti caricati al mese
+    n_img,                 # immagini caricate al mese
+    n_vid,                 # video caricati al mese
+
+    # FRAZIONE di doc che usa pipeline hi-res vs fast
+    fraction_hires,      # es. 0.6 => 60% doc usano hi-res, 40% doc usano fast
+    # costi "hi-res" e "fast"
+    c_page_hires,       # 0.01
+    c_page_fast,        # 0.001
+
+    t_total_doc,        # token totali medi per doc
+    barT_chunk_doc,
+    c_embed_doc,
+    c_db_chunk_doc,
+    pages_per_doc,
+
+    # FRAZIONE di immagini/video che usa GPT-4o vs GPT-4o Mini:
+    fraction_4o_imgvid,  # es. 0.3 => 30% di img/video caption con GPT-4o, 70% con mini
+    # costi GPT-4o (immagini/video):
+    p_in_4o_imgvid,      # es. 0.005
+    p_out_4o_imgvid,     # es. 0.015
+    # costi GPT-4o Mini (immagini/video):
+    p_in_mini_imgvid,    # es. 0.00015
+    p_out_mini_imgvid,   # es. 0.00060
+
+    # param immagine
+    img_width,
+    img_height,
+    t_descr_img,
+    c_embed_img,
+    c_db_chunk_img,
+
+    # param video
+    dur_sec_vid,
+    sampling_sec_vid,
+    vid_width,
+    vid_height,
+    t_descr_vid_frame,
+    c_embed_vid,
+    c_db_chunk_vid,
+    t_descr_vid_total,  # token totali di tutte le caption fuse
+
+    # Parametri storage
+    gb_stored_user,   # GB memorizzati dall'utente
+    c_gb_month,       # costo per GB/mese (es. 0.25)
+
+    # Parametri history della chat
+    max_pairs=25,                # finestra massima di history (coppie utente+AI)
+    avg_tokens_per_message=100,  # token medi per messaggio nella history
+    growing_history=False,      # True => history che cresce da vuota fino a max_pairs
+    cached_input_ratio=None,    # prezzo token di input in cache / p_in; None => nessuna cache
+    cache_hit_rate=1.0          # frazione dei turni in cui la cache e' ancora valida
+) -> CostBreakdown:
+    """
+    Versione vettorizzata (NumPy) di `cost_monthly_user_breakdown`: ogni parametro
+    puo' essere uno scalare oppure un array (broadcastabile), ad esempio una colonna
+    per utente o per campione Monte Carlo.
+
+    Gli arrotondamenti dei conteggi per bucket (int(round(...))) sono replicati con
+    `np.rint` (stesso arrotondamento "half to even" di `round`); i bucket con
+    conteggio nullo valgono 0, come nella versione scalare.
+
+    Ritorna un `CostBreakdown` i cui campi sono array float64.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # 1) Chat
+        n_msg_per_chat = np.asarray(n_msg_per_chat, dtype=np.float64)
+        if growing_history:
+            history_pairs = average_history_pairs_batch(n_msg_per_chat, max_pairs)
+        else:
+            history_pairs = max_pairs
+        history_kwargs = dict(
+            max_pairs=history_pairs,
+            avg_tokens_per_message=avg_tokens_per_message,
+            user_tokens=user_tokens_per_msg,
+            n_kbox=n_kbox_per_msg,
+            r_per_kbox=r_per_kbox,
+            chunk_size=chunk_size_retrieval,
+            out_tokens=out_tokens_per_msg,
+            c_retrieval=c_retrieval,
+            c_store=c_store
+        )
+        total_msgs = np.multiply(n_chat, n_msg_per_chat, dtype=np.float64)
+        chat_4o = (total_msgs * fraction_4o) * cost_of_message_batch(
+            p_in=p_in_4o, p_out=p_out_4o, **history_kwargs)
+        chat_mini = (total_msgs * (1.0 - np.asarray(fraction_4o, dtype=np.float64))) * cost_of_message_batch(
+            p_in=p_in_mini, p_out=p_out_mini, **history_kwargs)
+        if cached_input_ratio is not None and growing_history:
+            cached_tokens = average_cached_history_tokens_batch(
+                n_msg_per_chat, max_pairs, avg_tokens_per_message)
+            discount = (1.0 - np.asarray(cached_input_ratio, dtype=np.float64)) \
+                * cache_hit_rate * cached_tokens / 1000.0
+            chat_4o = chat_4o - (total_msgs * fraction_4o) * discount * p_in_4o
+            chat_mini = chat_mini - (total_msgs * (1.0 - np.asarray(fraction_4o, dtype=np.float64))) \
+                * discount * p_in_mini
+
+        # 2) Ingestion
+        n_doc = np.asarray(n_doc, dtype=np.float64)
+        n_img = np.asarray(n_img, dtype=np.float64)
+        n_vid = np.asarray(n_vid, dtype=np.float64)
+        n_doc_hires = np.rint(n_doc * fraction_hires)
+        n_doc_fast = n_doc - n_doc_hires
+        n_img_gpt4o = np.rint(n_img * fraction_4o_imgvid)
+        n_img_mini = n_img - n_img_gpt4o
+        n_vid_gpt4o = np.rint(n_vid * fraction_4o_imgvid)
+        n_vid_mini = n_vid - n_vid_gpt4o
+
+        doc_kwargs = dict(
             n_pages=pages_per_doc,
-            c_page=c_page_fast,  # 0.001
             t_total=t_total_doc,
             barT_chunk=barT_chunk_doc,
             c_embed=c_embed_doc,
             c_db_chunk=c_db_chunk_doc
         )
-        cost_ingestion += cost_doc
-        print(f"    doc fast #{j+1}: cost_doc = {cost_doc:.6f} $")
-
-    # 2b) Immagini
-    print(f"\n -> Caricamento di {n_img} immagini.")
-    n_img_gpt4o = int(round(n_img * fraction_4o_imgvid))
-    n_img_mini  = n_img - n_img_gpt4o
-    print(f"    fraction_4o_imgvid={fraction_4o_imgvid} => n_img_gpt4o={n_img_gpt4o}, n_img_mini={n_img_mini}")
-
-    for i in range(n_img_gpt4o):
-        cost_img = cost_upload_image(
-            width=img_width,
-            height=img_height,
-            t_descr=t_descr_img,
-            p_in=p_in_4o_imgvid,
-            p_out=p_out_4o_imgvid,
-            c_embed=c_embed_img,
-            c_db_chunk=c_db_chunk_img
-        )
-        cost_ingestion += cost_img
-        print(f"    img GPT-4o #{i+1}: cost_img = {cost_img:.6f} $")
-
-    for j in range(n_img_mini):
-        cost_img = cost_upload_image(
+        img_kwargs = dict(
             width=img_width,
             height=img_height,
             t_descr=t_descr_img,
-            p_in=p_in_mini_imgvid,
-            p_out=p_out_mini_imgvid,
             c_embed=c_embed_img,
             c_db_chunk=c_db_chunk_img
         )
-        cost_ingestion += cost_img
-        print(f"    img GPT-4o Mini #{j+1}: cost_img = {cost_img:.6f} $")
-
-    # 2c) Video
-    print(f"\n -> Caricamento di {n_vid} video.")
-    n_vid_gpt4o = int(round(n_vid * fraction_4o_imgvid))
-    n_vid_mini  = n_vid - n_vid_gpt4o
-    print(f"    fraction_4o_imgvid={fraction_4o_imgvid} => n_vid_gpt4o={n_vid_gpt4o}, n_vid_mini={n_vid_mini}")
-
-    for i in range(n_vid_gpt4o):
-        cost_vid = cost_upload_video(
+        vid_kwargs = dict(
             duration_sec=dur_sec_vid,
             sampling_sec=sampling_sec_vid,
             width=vid_width,
             height=vid_height,
             t_descr=t_descr_vid_frame,
-            p_in=p_in_4o_imgvid,
-            p_out=p_out_4o_imgvid,
             c_embed=c_embed_vid,
             c_db_chunk=c_db_chunk_vid,
             t_descr_total=t_descr_vid_total
         )
-        cost_ingestion += cost_vid
-        print(f"    video GPT-4o #{i+1}: cost_vid = {cost_vid:.6f} $")
 
-    for j in range(n_vid_mini):
-        cost_vid = cost_upload_video(
-            duration_sec=dur_sec_vid,
-            sampling_sec=sampling_sec_vid,
-            width=vid_width,
-            height=vid_height,
-            t_descr=t_descr_vid_frame,
-            p_in=p_in_mini_imgvid,
-            p_out=p_out_mini_imgvid,
-            c_embed=c_embed_vid,
-            c_db_chunk=c_db_chunk_vid,
-            t_descr_total=t_descr_vid_total
-        )
-        cost_ingestion += cost_vid
-        print(f"    video GPT-4o Mini #{j+1}: cost_vid = {cost_vid:.6f} $")
-
-    print(f"\n => cost_ingestion (totale) = {cost_ingestion:.6f} $\n")
-
-    #
-    # 3) Costo storage mensile
-    #
-    cost_storage = gb_stored_user * c_gb_month
-    print("=== DEBUG: COST STORAGE ===")
-    print(f"  gb_stored_user={gb_stored_user:.2f} GB, c_gb_month={c_gb_month:.3f} $/GB/mese")
-    print(f"  => cost_storage = {cost_storage:.6f} $\n")
-
-    # Somma finale
-    cost_month_user = cost_chat_month + cost_ingestion + cost_storage
-    print("=== RISULTATO FINALE ===")
-    print(f"  Costo Chat:      {cost_chat_month:.6f} $")
-    print(f"  Costo Ingestion: {cost_ingestion:.6f} $")
-    print(f"  Costo Storage:   {cost_storage:.6f} $")
-    print("---------------------------------")
-    print(f" ==> COSTO TOTALE MENSILE UTENTE = {cost_month_user:.6f} $\n")
-
-    return cost_month_user
+        def bucket(count, unit_cost):
+            return np.where(count > 0, count * unit_cost, 0.0)
+
+        doc_hires = bucket(n_doc_hires, cost_upload_pdf_batch(c_page=c_page_hires, **doc_kwargs))
+        doc_fast = bucket(n_doc_fast, cost_upload_pdf_batch(c_page=c_page_fast, **doc_kwargs))
+        img_4o = bucket(n_img_gpt4o, cost_upload_image_batch(
+            p_in=p_in_4o_imgvid, p_out=p_out_4o_imgvid, **img_kwargs))
+        img_mini = bucket(n_img_mini, cost_upload_image_batch(
+            p_in=p_in_mini_imgvid, p_out=p_out_mini_imgvid, **img_kwargs))
+        vid_4o = bucket(n_vid_gpt4o, cost_upload_video_batch(
+            p_in=p_in_4o_imgvid, p_out=p_out_4o_imgvid, **vid_kwargs))
+        vid_mini = bucket(n_vid_mini, cost_upload_video_batch(
+            p_in=p_in_mini_imgvid, p_out=p_out_mini_imgvid, **vid_kwargs))
+
+        # 3) Storage
+        storage = np.multiply(gb_stored_user, c_gb_month, dtype=np.float64)
+
+    return CostBreakdown(*np.broadcast_arrays(
+        chat_4o, chat_mini, doc_hires, doc_fast, img_4o, img_mini, vid_4o, vid_mini, storage
+    ))
 
 
 if __name__ == "__main__":
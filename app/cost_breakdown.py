@@ -0,0 +1,99 @@
+"""
+File: cost_breakdown.py
+
+Scopo: definire `CostBreakdown`, il risultato strutturato (NamedTuple, quindi senza
+       __dict__ per istanza) con tutte le voci di costo di un utente/mese:
+       chat (GPT-4o / Mini), documenti (Hi-Res / Fast), immagini e video
+       (GPT-4o / Mini) e storage.
+
+Le funzioni di costo (cost_of_message, cost_upload_*) ritornano un CostBreakdown
+quando ricevono `breakdown="<nome voce>"`, con il costo assegnato a quella voce.
+I CostBreakdown si possono sommare tra loro e moltiplicare per uno scalare
+(es. costo unitario x numero di documenti).
+
+La resa testuale di debug e' costruita solo su richiesta, tramite `format_debug()`.
+"""
+
+from typing import NamedTuple
+
+
+class CostBreakdown(NamedTuple):
+    """
+    Voci di costo (in dollari). Tutte le voci valgono 0.0 se non specificate.
+    """
+    chat_4o: float = 0.0
+    chat_mini: float = 0.0
+    doc_hires: float = 0.0
+    doc_fast: float = 0.0
+    img_4o: float = 0.0
+    img_mini: float = 0.0
+    vid_4o: float = 0.0
+    vid_mini: float = 0.0
+    storage: float = 0.0
+
+    # NumPy non deve trattare il CostBreakdown come una sequenza: cosi' np.float64(k) * cb
+    # (conteggi e frazioni come scalari NumPy) delega a __rmul__ invece di dare un ndarray
+    __array_ufunc__ = None
+
+    # ---- sub-totali ----
+    @property
+    def chat(self) -> float:
+        return self.chat_4o + self.chat_mini
+
+    @property
+    def doc(self) -> float:
+        return self.doc_hires + self.doc_fast
+
+    @property
+    def img(self) -> float:
+        return self.img_4o + self.img_mini
+
+    @property
+    def vid(self) -> float:
+        return self.vid_4o + self.vid_mini
+
+    @property
+    def ingestion(self) -> float:
+        return self.doc + self.img + self.vid
+
+    @property
+    def total(self) -> float:
+        return self.chat + self.ingestion + self.storage
+
+    # ---- aritmetica voce per voce (sostituisce concatenazione/ripetizione di tuple) ----
+    def __add__(self, other):
+        if not isinstance(other, CostBreakdown):
+            return NotImplemented
+        return CostBreakdown(*(a + b for a, b in zip(self, other)))
+
+    def __radd__(self, other):
+        # permette sum([...]) che parte da 0
+        if other == 0:
+            return self
+        return NotImplemented
+
+    def __mul__(self, k):
+        if isinstance(k, tuple):
+            return NotImplemented
+        return CostBreakdown(*(a * k for a in self))
+
+    __rmul__ = __mul__
+
+    def __float__(self) -> float:
+        return float(self.total)
+
+    def format_debug(self) -> str:
+        """
+        Costruisce (solo quando chiamata) la resa testuale di debug di tutte le voci.
+        """
+        return "\n".join([
+            "=== RISULTATO FINALE ===",
+            f"  Costo Chat:      {self.chat:.6f} $  (GPT-4o={self.chat_4o:.6f}, Mini={self.chat_mini:.6f})",
+            f"  Costo Ingestion: {self.ingestion:.6f} $",
+            f"     doc:   {self.doc:.6f} $  (Hi-Res={self.doc_hires:.6f}, Fast={self.doc_fast:.6f})",
+            f"     img:   {self.img:.6f} $  (GPT-4o={self.img_4o:.6f}, Mini={self.img_mini:.6f})",
+            f"     video: {self.vid:.6f} $  (GPT-4o={self.vid_4o:.6f}, Mini={self.vid_mini:.6f})",
+            f"  Costo Storage:   {self.storage:.6f} $",
+            "---------------------------------",
+            f" ==> COSTO TOTALE MENSILE UTENTE = {self.total:.6f} $",
+        ])
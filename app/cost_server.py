@@ -0,0 +1,374 @@
+"""
+File: cost_server.py
+
+Scopo: servizio HTTP (asyncio, solo libreria standard + NumPy) per stimare il costo di
+       un'azione prima che avvenga ("quanto costa questo upload?"), attorno a
+       cost_of_message, cost_upload_pdf, cost_upload_image e cost_upload_video.
+
+Endpoint:
+- POST /estimate/message | /estimate/pdf | /estimate/image | /estimate/video
+  corpo JSON con i parametri keyword della funzione scalare corrispondente,
+  risposta {"cost": <dollari>};
+- GET /stats: latenza p50/p99 (ms) e throughput (richieste/s) misurati dal server.
+
+Micro-batching: le richieste concorrenti verso lo stesso endpoint vengono accodate e,
+entro una finestra di `batch_window` secondi (o fino a `max_batch` richieste), valutate
+con una sola chiamata al kernel vettorizzato `*_batch`.
+
+Uso (dalla root del repository):
+    python -m app.cost_server serve --port 8080
+    python -m app.cost_server loadtest --requests 20000 --concurrency 64
+
+`loadtest` avvia il server nello stesso processo (nessun servizio esterno) e genera
+il carico con client HTTP keep-alive concorrenti.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import time
+from collections import deque
+
+import numpy as np
+
+from app.send_message import cost_of_message_batch
+from app.upload_file_in_kbox import (
+    cost_upload_pdf_batch,
+    cost_upload_image_batch,
+    cost_upload_video_batch
+)
+
+
+# endpoint -> (kernel vettorizzato, parametri richiesti)
+ENDPOINTS = {
+    "message": (cost_of_message_batch, (
+        "max_pairs", "avg_tokens_per_message", "user_tokens", "n_kbox", "r_per_kbox",
+        "chunk_size", "out_tokens", "p_in", "p_out", "c_retrieval", "c_store")),
+    "pdf": (cost_upload_pdf_batch, (
+        "n_pages", "c_page", "t_total", "barT_chunk", "c_embed", "c_db_chunk")),
+    "image": (cost_upload_image_batch, (
+        "width", "height", "t_descr", "p_in", "p_out", "c_embed", "c_db_chunk")),
+    "video": (cost_upload_video_batch, (
+        "duration_sec", "sampling_sec", "width", "height", "t_descr", "p_in", "p_out",
+        "c_embed", "c_db_chunk", "t_descr_total"))
+}
+
+DEFAULT_BATCH_WINDOW = 0.002  # secondi
+DEFAULT_MAX_BATCH = 4096
+LATENCY_WINDOW = 100_000      # ultime latenze conservate per le statistiche
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            500: "Internal Server Error"}
+
+
+def _is_finite_number(value) -> bool:
+    """True per int/float finiti rappresentabili in float64 (esclusi bool, NaN, inf)."""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        return math.isfinite(value)
+    except OverflowError:  # intero JSON oltre il range di float64
+        return False
+
+
+class CostEstimationServer:
+    """
+    Server HTTP di stima dei costi con micro-batching per endpoint.
+
+    Parametri:
+    -----------
+    batch_window : float
+        Attesa massima (secondi) dopo la prima richiesta di un batch.
+    max_batch : int
+        Numero massimo di richieste valutate in un'unica chiamata vettorizzata.
+    """
+
+    def __init__(self, batch_window: float = DEFAULT_BATCH_WINDOW, max_batch: int = DEFAULT_MAX_BATCH):
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self._queues = {}
+        self._workers = []
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._n_requests = 0
+        self._n_batches = 0
+        self._started = None
+        self._server = None
+
+    # ------------------------------------------------------------------
+    # Ciclo di vita
+    # ------------------------------------------------------------------
+    async def start(self, host: str = "127.0.0.1", port: int = 8080):
+        self._queues = {name: asyncio.Queue() for name in ENDPOINTS}
+        self._workers = [asyncio.create_task(self._batch_worker(name)) for name in ENDPOINTS]
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        self._started = time.perf_counter()
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def stop(self) -> None:
+        self._server.close()
+        await self._server.wait_closed()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    # ------------------------------------------------------------------
+    # Micro-batching
+    # ------------------------------------------------------------------
+    async def _batch_worker(self, name: str) -> None:
+        kernel, param_names = ENDPOINTS[name]
+        queue = self._queues[name]
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.max_batch:
+                if queue.empty():
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+                else:
+                    batch.append(queue.get_nowait())
+
+            try:
+                columns = {p: np.array([params[p] for params, _ in batch], dtype=np.float64)
+                           for p in param_names}
+                costs = np.broadcast_to(kernel(**columns), (len(batch),)).tolist()
+            except Exception as exc:  # errore del kernel: lo riceve ogni richiesta del batch
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                continue
+            self._n_batches += 1
+            for (_, future), cost in zip(batch, costs):
+                if not future.done():
+                    future.set_result(cost)
+
+    async def estimate(self, name: str, params: dict) -> float:
+        """Accoda una stima e ne attende il risultato (valutato nel prossimo batch)."""
+        future = asyncio.get_running_loop().create_future()
+        await self._queues[name].put((params, future))
+        return await future
+
+    # ------------------------------------------------------------------
+    # HTTP
+    # ------------------------------------------------------------------
+    def stats(self) -> dict:
+        """Latenza p50/p99 (ms) sulle ultime richieste e throughput dall'avvio."""
+        elapsed = time.perf_counter() - self._started if self._started else 0.0
+        result = {
+            "requests": self._n_requests,
+            "batches": self._n_batches,
+            "avg_batch_size": self._n_requests / self._n_batches if self._n_batches else 0.0,
+            "throughput_rps": self._n_requests / elapsed if elapsed > 0 else 0.0
+        }
+        if self._latencies:
+            p50, p99 = np.percentile(np.fromiter(self._latencies, dtype=np.float64), (50, 99))
+            result["latency_ms"] = {"p50": p50 * 1e3, "p99": p99 * 1e3}
+        return result
+
+    async def _route(self, method: str, path: str, body: bytes):
+        if path == "/stats":
+            return 200, self.stats()
+        if not path.startswith("/estimate/"):
+            return 404, {"error": f"Percorso sconosciuto: {path}"}
+        name = path[len("/estimate/"):]
+        if name not in ENDPOINTS:
+            return 404, {"error": f"Endpoint sconosciuto: {name}"}
+        if method != "POST":
+            return 405, {"error": "Usare POST"}
+        try:
+            params = json.loads(body)
+        except ValueError:
+            return 400, {"error": "Corpo JSON non valido"}
+        if not isinstance(params, dict):
+            return 400, {"error": "Il corpo deve essere un oggetto JSON"}
+        required = ENDPOINTS[name][1]
+        missing = [p for p in required if p not in params]
+        unknown = [p for p in params if p not in required]
+        if missing or unknown:
+            return 400, {"error": "Parametri non validi", "missing": missing, "unknown": unknown}
+        if not all(_is_finite_number(params[p]) for p in required):
+            return 400, {"error": "Tutti i parametri devono essere numeri finiti"}
+        try:
+            cost = await self.estimate(name, params)
+        except Exception as exc:
+            return 500, {"error": f"Errore nel calcolo della stima: {exc}"}
+        if not math.isfinite(cost):
+            return 400, {"error": "La stima non e' un numero finito (parametri non validi?)"}
+        return 200, {"cost": cost}
+
+    async def _handle_connection(self, reader, writer) -> None:
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                t0 = time.perf_counter()
+                try:
+                    method, path, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                try:
+                    content_length = int(headers.get("content-length", 0))
+                    if content_length < 0:
+                        raise ValueError(content_length)
+                except ValueError:
+                    # Senza una lunghezza valida il corpo non si puo' delimitare: si chiude
+                    status, payload = 400, {"error": "Content-Length non valido"}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(content_length)
+                    status, payload = await self._route(method, path, body)
+                try:
+                    data = json.dumps(payload, allow_nan=False).encode("utf-8")
+                except ValueError:
+                    status = 500
+                    data = json.dumps({"error": "Risposta con valori non finiti"}).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} {_REASONS[status]}\r\n"
+                    f"Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1")
+                    + data
+                )
+                await writer.drain()
+                if path != "/stats":
+                    self._n_requests += 1
+                    self._latencies.append(time.perf_counter() - t0)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+# ----------------------------------------------------------------------
+# Generatore di carico locale
+# ----------------------------------------------------------------------
+EXAMPLE_REQUESTS = {
+    "message": dict(max_pairs=25, avg_tokens_per_message=100, user_tokens=50, n_kbox=1.5,
+                    r_per_kbox=5, chunk_size=300, out_tokens=300, p_in=0.005, p_out=0.015,
+                    c_retrieval=1e-5, c_store=1e-5),
+    "pdf": dict(n_pages=10, c_page=0.01, t_total=5000, barT_chunk=500, c_embed=0.00002,
+                c_db_chunk=7.5e-6),
+    "image": dict(width=1024, height=1024, t_descr=100, p_in=0.005, p_out=0.015,
+                  c_embed=0.00002, c_db_chunk=7.5e-6),
+    "video": dict(duration_sec=120, sampling_sec=10, width=512, height=512, t_descr=50,
+                  p_in=0.005, p_out=0.015, c_embed=0.00002, c_db_chunk=7.5e-6, t_descr_total=600)
+}
+
+
+async def _http_request(reader, writer, method: str, path: str, payload=None):
+    body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+                 .encode("latin-1") + body)
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        if key.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+async def run_load(host: str, port: int, n_requests: int = 20000, concurrency: int = 64,
+                   seed: int = 0) -> dict:
+    """
+    Invia `n_requests` stime (endpoint e parametri casuali) con `concurrency` connessioni
+    keep-alive, e ritorna latenze lato client (ms), throughput e statistiche del server.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(EXAMPLE_REQUESTS)
+    plan = rng.integers(0, len(names), n_requests)
+    latencies = np.empty(n_requests, dtype=np.float64)
+    next_index = iter(range(n_requests))
+
+    async def client():
+        reader, writer = await asyncio.open_connection(host, port)
+        try:
+            for i in next_index:
+                name = names[plan[i]]
+                payload = dict(EXAMPLE_REQUESTS[name])
+                t0 = time.perf_counter()
+                status, _ = await _http_request(reader, writer, "POST", f"/estimate/{name}", payload)
+                latencies[i] = time.perf_counter() - t0
+                if status != 200:
+                    raise RuntimeError(f"Risposta HTTP {status} per /estimate/{name}")
+        finally:
+            writer.close()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - t0
+
+    reader, writer = await asyncio.open_connection(host, port)
+    _, server_stats = await _http_request(reader, writer, "GET", "/stats")
+    writer.close()
+
+    p50, p99 = np.percentile(latencies, (50, 99)) * 1e3
+    return {
+        "requests": n_requests,
+        "concurrency": concurrency,
+        "throughput_rps": n_requests / elapsed,
+        "client_latency_ms": {"p50": p50, "p99": p99},
+        "server": server_stats
+    }
+
+
+async def _serve(args) -> None:
+    server = CostEstimationServer(batch_window=args.batch_window, max_batch=args.max_batch)
+    host, port = await server.start(args.host, args.port)
+    print(f"Server di stima costi in ascolto su http://{host}:{port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+
+async def _loadtest(args) -> None:
+    server = CostEstimationServer(batch_window=args.batch_window, max_batch=args.max_batch)
+    host, port = await server.start(args.host, 0)
+    try:
+        report = await run_load(host, port, args.requests, args.concurrency)
+    finally:
+        await server.stop()
+    print(json.dumps(report, indent=2))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Servizio HTTP di stima dei costi")
+    parser.add_argument("command", choices=("serve", "loadtest"))
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--batch-window", type=float, default=DEFAULT_BATCH_WINDOW)
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_serve(args) if args.command == "serve" else _loadtest(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+File: cost_store.py
+
+Scopo: archivio su disco dei risultati di fatturazione, un record per utente/mese con
+       tutte le voci di `CostBreakdown` (chat / doc / img / vid / storage), per poter
+       interrogare i risultati dopo un billing run (es. top spender per costo di ingestion)
+       invece di leggerli dallo stdout di `cost_monthly_user_debug`.
+
+Formato (una cartella):
+- meta.json       : versione e dtype delle colonne;
+- <colonna>.bin   : valori grezzi a larghezza fissa (int64 / int32 / float64), uno per record;
+- user_index_<AAAAMM>.bin : indice diretto utente -> record per ogni mese (int64, -1 se
+  l'utente non ha record in quel mese), piu' index.json con i record gia' indicizzati.
+
+Proprieta':
+- append-only: i nuovi record vengono accodati ai file delle colonne;
+- colonnare e memory-mapped: ogni colonna e' un `np.memmap` in sola lettura, quindi le
+  aggregazioni lavorano su viste NumPy senza copie e la tabella puo' essere molto piu'
+  grande della RAM (il sistema operativo carica solo le pagine lette);
+- accesso O(1) per indice di record (offset = indice * larghezza della colonna) e per
+  (utente, mese) tramite l'indice diretto (`lookup`); gli id utente sono indici >= 0 e,
+  se la stessa coppia viene accodata piu' volte, vale l'ultimo record.
+
+Se un accodamento viene interrotto a meta', all'apertura le colonne vengono troncate
+al numero di record completi e l'indice viene completato con i record non ancora
+indicizzati (lo stesso vale per archivi creati prima dell'indice; in sola lettura
+l'indice non viene aggiornato).
+"""
+
+import json
+import os
+
+import numpy as np
+
+from app.cost_breakdown import CostBreakdown
+
+
+STORE_FORMAT_VERSION = 1
+
+# (nome colonna, dtype) nell'ordine del record
+STORE_COLUMNS = (
+    ("user_id", np.dtype("<i8")),
+    ("month", np.dtype("<i4")),  # es. 202407
+) + tuple((name, np.dtype("<f8")) for name in CostBreakdown._fields)
+
+# Record letti per blocco nelle aggregazioni (limita la memoria dei temporanei)
+DEFAULT_CHUNK_ROWS = 1 << 20
+
+
+class CostResultStore:
+    """
+    Archivio colonnare append-only dei CostBreakdown per utente/mese.
+
+    Parametri:
+    -----------
+    path : str
+        Cartella dell'archivio (creata se non esiste, salvo readonly=True).
+    readonly : bool
+        Se True l'archivio non viene creato ne' modificato.
+    """
+    __slots__ = ("path", "readonly", "_length", "_maps", "_index_maps")
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        self._maps = None
+        self._index_maps = {}
+
+        meta_path = os.path.join(path, "meta.json")
+        meta = {"version": STORE_FORMAT_VERSION,
+                "columns": [[name, dtype.str] for name, dtype in STORE_COLUMNS]}
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                if json.load(f) != meta:
+                    raise ValueError(f"Formato dell'archivio non compatibile: {path}")
+        elif readonly:
+            raise FileNotFoundError(meta_path)
+        else:
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f)
+
+        lengths = []
+        for name, dtype in STORE_COLUMNS:
+            file_path = self._column_path(name)
+            size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+            lengths.append(size // dtype.itemsize)
+        self._length = min(lengths)
+
+        if not readonly:
+            # Scarta eventuali record parziali di un accodamento interrotto
+            for name, dtype in STORE_COLUMNS:
+                with open(self._column_path(name), "ab") as f:
+                    f.truncate(self._length * dtype.itemsize)
+            # Completa l'indice utente -> record con i record non ancora indicizzati
+            indexed = self._indexed_rows()
+            for start in range(indexed, self._length, DEFAULT_CHUNK_ROWS):
+                stop = min(start + DEFAULT_CHUNK_ROWS, self._length)
+                columns = self._columns()
+                self._update_index(columns["user_id"][start:stop], columns["month"][start:stop],
+                                   np.arange(start, stop, dtype=np.int64))
+            if indexed != self._length:
+                self._write_indexed_rows(self._length)
+
+    def _column_path(self, name: str) -> str:
+        return os.path.join(self.path, f"{name}.bin")
+
+    def _index_path(self, month: int) -> str:
+        return os.path.join(self.path, f"user_index_{int(month)}.bin")
+
+    def _indexed_rows(self) -> int:
+        index_meta = os.path.join(self.path, "index.json")
+        if not os.path.exists(index_meta):
+            return 0
+        with open(index_meta, "r", encoding="utf-8") as f:
+            return min(json.load(f)["rows"], self._length)
+
+    def _write_indexed_rows(self, rows: int) -> None:
+        with open(os.path.join(self.path, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({"rows": rows}, f)
+
+    def _update_index(self, user_ids, months, positions) -> None:
+        """Registra i record `positions` nell'indice diretto di ciascun mese."""
+        user_ids = np.asarray(user_ids, dtype=np.int64)
+        months = np.asarray(months, dtype=np.int64)
+        for month in np.unique(months).tolist():
+            in_month = months == month
+            # A parita' di utente vale l'ultimo record: prima occorrenza nell'ordine inverso
+            users, last = np.unique(user_ids[in_month][::-1], return_index=True)
+            rows = positions[in_month][::-1][last]
+
+            index_path = self._index_path(month)
+            size = os.path.getsize(index_path) // 8 if os.path.exists(index_path) else 0
+            needed = int(users[-1]) + 1
+            if needed > size:
+                with open(index_path, "ab") as f:
+                    f.write(np.full(needed - size, -1, dtype="<i8").tobytes())
+            index = np.memmap(index_path, dtype="<i8", mode="r+", shape=(max(size, needed),))
+            index[users] = rows
+            index.flush()
+            del index
+            self._index_maps.pop(month, None)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self) -> None:
+        """Rilascia le mappe in memoria (le viste gia' restituite restano valide)."""
+        self._maps = None
+        self._index_maps = {}
+
+    # ------------------------------------------------------------------
+    # Scrittura
+    # ------------------------------------------------------------------
+    def append(self, user_ids, months, breakdowns) -> None:
+        """
+        Accoda uno o piu' record.
+
+        Parametri:
+        -----------
+        user_ids : int o array-like di int
+            Indici utente (>= 0), usati anche come posizione nell'indice diretto.
+        months : int o array-like di int
+            Mese di fatturazione nel formato AAAAMM (es. 202407).
+        breakdowns : CostBreakdown o list di CostBreakdown
+            Un CostBreakdown di scalari o di array (es. `cost_monthly_user_batch`),
+            oppure la lista ritornata da `run_monthly_billing`.
+        """
+        if self.readonly:
+            raise PermissionError(f"Archivio aperto in sola lettura: {self.path}")
+        if isinstance(breakdowns, CostBreakdown):
+            values = [np.asarray(v, dtype=np.float64) for v in breakdowns]
+        else:
+            matrix = np.asarray(breakdowns, dtype=np.float64).reshape(-1, len(CostBreakdown._fields))
+            values = list(matrix.T)
+        columns = np.broadcast_arrays(np.asarray(user_ids), np.asarray(months), *values)
+        n = columns[0].size
+        if n == 0:
+            return
+        if np.any(columns[0] < 0):
+            raise ValueError("Gli id utente devono essere indici >= 0")
+
+        for (name, dtype), column in zip(STORE_COLUMNS, columns):
+            with open(self._column_path(name), "ab") as f:
+                f.write(np.ascontiguousarray(column.reshape(-1), dtype=dtype).tobytes())
+        self._update_index(columns[0].reshape(-1), columns[1].reshape(-1),
+                           np.arange(self._length, self._length + n, dtype=np.int64))
+        self._length += n
+        self._write_indexed_rows(self._length)
+        self._maps = None
+
+    # ------------------------------------------------------------------
+    # Lettura
+    # ------------------------------------------------------------------
+    def _columns(self) -> dict:
+        if self._maps is None:
+            if self._length == 0:
+                self._maps = {name: np.empty(0, dtype=dtype) for name, dtype in STORE_COLUMNS}
+            else:
+                self._maps = {
+                    name: np.memmap(self._column_path(name), dtype=dtype, mode="r",
+                                    shape=(self._length,))
+                    for name, dtype in STORE_COLUMNS
+                }
+        return self._maps
+
+    def column(self, name: str) -> np.ndarray:
+        """Vista (senza copia, in sola lettura) di una colonna, es. "doc_hires" o "user_id"."""
+        return self._columns()[name]
+
+    def breakdown(self, start: int = 0, stop: int = None) -> CostBreakdown:
+        """
+        CostBreakdown di viste sulle colonne per i record [start, stop): le proprieta'
+        (chat, doc, ingestion, total, ...) si calcolano come operazioni NumPy.
+        """
+        columns = self._columns()
+        return CostBreakdown(*(columns[name][start:stop] for name in CostBreakdown._fields))
+
+    def __getitem__(self, index: int):
+        """Record `index` in O(1): (user_id, month, CostBreakdown di float)."""
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError(index)
+        columns = self._columns()
+        return (int(columns["user_id"][index]), int(columns["month"][index]),
+                CostBreakdown(*(float(columns[name][index]) for name in CostBreakdown._fields)))
+
+    def position(self, user_id: int, month: int) -> int:
+        """Indice del record (ultimo accodato) dell'utente nel mese, in O(1); KeyError se assente."""
+        index = self._index_maps.get(month)
+        if index is None:
+            index_path = self._index_path(month)
+            if not os.path.exists(index_path):
+                raise KeyError((user_id, month))
+            index = self._index_maps[month] = np.memmap(index_path, dtype="<i8", mode="r")
+        if not 0 <= user_id < index.shape[0]:
+            raise KeyError((user_id, month))
+        row = int(index[user_id])
+        if not 0 <= row < self._length:
+            raise KeyError((user_id, month))
+        return row
+
+    def lookup(self, user_id: int, month: int) -> CostBreakdown:
+        """CostBreakdown dell'utente nel mese, in O(1) tramite l'indice diretto."""
+        return self[self.position(user_id, month)][2]
+
+    def iter_chunks(self, chunk_rows: int = DEFAULT_CHUNK_ROWS):
+        """Genera (start, CostBreakdown di viste) su blocchi consecutivi di record."""
+        for start in range(0, self._length, chunk_rows):
+            yield start, self.breakdown(start, min(start + chunk_rows, self._length))
+
+    def component_total(self, component: str = "total", chunk_rows: int = DEFAULT_CHUNK_ROWS) -> float:
+        """Somma di una voce o sub-totale (es. "ingestion") su tutti i record, a blocchi."""
+        return float(sum(np.sum(getattr(chunk, component))
+                         for _, chunk in self.iter_chunks(chunk_rows)))
+
+    def top_k(self, component: str = "total", k: int = 10, chunk_rows: int = DEFAULT_CHUNK_ROWS) -> list:
+        """
+        I `k` record con la voce `component` piu' alta (es. "ingestion", "doc_hires").
+
+        Ritorna:
+        -----------
+        list di tuple (indice, user_id, month, valore), in ordine decrescente di valore
+        (vuota se k <= 0).
+        """
+        if k <= 0:
+            return []
+        best_index = np.empty(0, dtype=np.int64)
+        best_value = np.empty(0, dtype=np.float64)
+        for start, chunk in self.iter_chunks(chunk_rows):
+            values = np.asarray(getattr(chunk, component), dtype=np.float64)
+            if values.size > k:
+                keep = np.argpartition(values, values.size - k)[-k:]
+            else:
+                keep = np.arange(values.size)
+            best_index = np.concatenate([best_index, keep + start])
+            best_value = np.concatenate([best_value, values[keep]])
+            if best_value.size > k:
+                keep = np.argpartition(best_value, best_value.size - k)[-k:]
+                best_index, best_value = best_index[keep], best_value[keep]
+
+        order = np.argsort(-best_value, kind="stable")
+        user_ids = self.column("user_id")
+        months = self.column("month")
+        return [(int(i), int(user_ids[i]), int(months[i]), float(v))
+                for i, v in zip(best_index[order], best_value[order])]
+
+
+if __name__ == "__main__":
+    import shutil
+    import tempfile
+    import time
+
+    from app.compute_total_monthly_cost import cost_monthly_user_batch
+
+    base_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    rng = np.random.default_rng(0)
+    n_users = 1_000_000
+    store_dir = tempfile.mkdtemp(prefix="cost_store_")
+    try:
+        with CostResultStore(store_dir) as store:
+            t0 = time.perf_counter()
+            for month in (202406, 202407):
+                params = dict(base_params, n_chat=rng.integers(0, 30, n_users),
+                              n_doc=rng.integers(0, 50, n_users), n_vid=rng.integers(0, 5, n_users))
+                store.append(np.arange(n_users), month, cost_monthly_user_batch(**params))
+            print(f"{len(store)} record scritti in {time.perf_counter() - t0:.2f}s")
+
+        store = CostResultStore(store_dir, readonly=True)
+        t0 = time.perf_counter()
+        top = store.top_k("ingestion", k=5)
+        print(f"Top 5 per ingestion ({time.perf_counter() - t0:.3f}s):")
+        for index, user_id, month, value in top:
+            print(f"  record={index} user={user_id} mese={month} ingestion={value:.4f} $")
+        print(f"Record 1234567: {store[1234567]}")
+        t0 = time.perf_counter()
+        users = rng.integers(0, n_users, 100_000).tolist()
+        for user in users:
+            store.lookup(user, 202407)
+        print(f"100000 lookup per (utente, mese) in {time.perf_counter() - t0:.3f}s; "
+              f"utente 234567 a 202407: totale {store.lookup(234567, 202407).total:.4f} $")
+        print(f"Costo totale di tutti i record = {store.component_total():.2f} $")
+    finally:
+        shutil.rmtree(store_dir)
@@ -0,0 +1,253 @@
+"""
+File: ingestion_queue.py
+
+Scopo: simulatore a eventi discreti della flotta di worker di ingestion (pipeline PDF
+       Hi-Res/Fast, caption di immagini e video), per dimensionare il numero di worker.
+
+Modello (coda FIFO unica servita da `n_workers` worker identici, M/G/c):
+- arrivi di Poisson per voce di ingestion, con tasso = upload al mese per utente
+  (n_doc/n_img/n_vid ripartiti come in `cost_monthly_user_breakdown`) * n_users /
+  secondi in un mese, eventualmente modulato da un profilo orario giornaliero;
+- tempi di servizio per voce (default: `latency_model.upload_timings`), con una
+  distribuzione Gamma di coefficiente di variazione `service_cv` (0 = deterministico,
+  1 = esponenziale);
+- costo all'ora = worker * costo orario del worker + costo di ingestion dei job arrivati
+  (costi unitari di `cost_upload_pdf/image/video`).
+
+Gli arrivi sono generati a blocchi di un'ora con NumPy (numero di arrivi Poisson, istanti
+uniformi ordinati, voce e tempo di servizio estratti in blocco). La coda si simula con un
+heap degli istanti in cui ogni worker si libera (n_workers elementi): per ogni job in ordine
+di arrivo l'inizio e' max(arrivo, primo worker libero), O(log n_workers) per job, per cui un
+mese di arrivi per un milione di utenti (~11M job) richiede pochi secondi.
+"""
+
+import heapq
+from typing import NamedTuple
+
+import numpy as np
+
+from app.latency_model import (
+    SECONDS_PER_MONTH,
+    SPEED_CATALOG,
+    monthly_upload_counts,
+    upload_timings
+)
+
+
+# Voci di ingestion simulate (campi di CostBreakdown)
+JOB_TYPES = ("doc_hires", "doc_fast", "img_4o", "img_mini", "vid_4o", "vid_mini")
+
+
+class QueueSimulation(NamedTuple):
+    """
+    n_jobs           : job arrivati nell'orizzonte simulato
+    wait_percentiles : {percentile: attesa in coda in secondi} su tutti i job
+    wait_by_type     : {voce: {percentile: attesa in secondi}}
+    mean_wait_sec    : attesa media in coda
+    utilization      : frazione del tempo-worker occupata (0..1)
+    cost_per_hour    : costo medio all'ora (worker + ingestion dei job)
+    worker_cost_per_hour    : quota del costo orario dovuta ai worker
+    ingestion_cost_per_hour : quota del costo orario dovuta ai job (LLM, pipeline, DB)
+    """
+    n_jobs: int
+    wait_percentiles: dict
+    wait_by_type: dict
+    mean_wait_sec: float
+    utilization: float
+    cost_per_hour: float
+    worker_cost_per_hour: float
+    ingestion_cost_per_hour: float
+
+
+def _generate_hour(rng, start_sec, rates_per_sec, service_sec, service_cv):
+    """
+    Arrivi di un'ora a partire da `start_sec`: (istanti ordinati, voce, tempo di servizio).
+    """
+    total_rate = rates_per_sec.sum()
+    n = rng.poisson(total_rate * 3600.0)
+    arrivals = start_sec + np.sort(rng.random(n)) * 3600.0
+    types = rng.choice(len(rates_per_sec), size=n, p=rates_per_sec / total_rate)
+    mean_service = service_sec[types]
+    if service_cv > 0:
+        shape = 1.0 / (service_cv * service_cv)
+        service = rng.gamma(shape, mean_service / shape)
+    else:
+        service = mean_service
+    return arrivals, types, service
+
+
+def _serve_fifo(free_at: list, arrivals, service) -> np.ndarray:
+    """
+    Serve in ordine FIFO i job di un blocco, aggiornando in place l'heap `free_at` degli
+    istanti in cui i worker si liberano. Ritorna l'attesa in coda di ciascun job.
+    """
+    waits = np.empty(len(arrivals), dtype=np.float64)
+    heapreplace = heapq.heapreplace
+    for i, (arrival, duration) in enumerate(zip(arrivals.tolist(), service.tolist())):
+        start = free_at[0]
+        if start < arrival:
+            start = arrival
+        heapreplace(free_at, start + duration)
+        waits[i] = start - arrival
+    return waits
+
+
+def simulate_ingestion_queue(
+    n_users: int,
+    n_workers: int,
+    params: dict,
+    hours: float = 720,
+    service_sec: dict = None,
+    service_cv: float = 1.0,
+    worker_cost_per_hour: float = 0.0,
+    hourly_profile=None,
+    percentiles=(50, 90, 99),
+    seed: int = 0,
+    speeds: dict = SPEED_CATALOG,
+    **timing_kwargs
+) -> QueueSimulation:
+    """
+    Simula la coda di ingestion per `hours` ore.
+
+    Parametri:
+    -----------
+    n_users : int
+        Numero di utenti.
+    n_workers : int
+        Numero di worker di ingestion (ognuno elabora un job alla volta).
+    params : dict
+        Parametri di `cost_monthly_user_breakdown` (conteggi mensili, frazioni, prezzi).
+    hours : float
+        Orizzonte simulato in ore (default 720 = un mese di 30 giorni).
+    service_sec : dict
+        {voce: tempo medio di servizio in secondi}; default i tempi di
+        `latency_model.upload_timings`.
+    service_cv : float
+        Coefficiente di variazione dei tempi di servizio (0 deterministico, 1 esponenziale).
+    worker_cost_per_hour : float
+        Costo orario di un worker, in dollari.
+    hourly_profile : sequenza di 24 float
+        Moltiplicatori del tasso di arrivo per ora del giorno, non negativi e con media
+        positiva (normalizzati a media 1); default tasso costante.
+    percentiles : tuple
+        Percentili dell'attesa in coda da riportare.
+    seed : int
+        Seme del generatore casuale.
+    speeds, **timing_kwargs :
+        Tabella delle velocita' e parametri di `upload_timings` (modelli, pipeline,
+        frame_concurrency).
+
+    Ritorna:
+    -----------
+    QueueSimulation
+    """
+    if n_workers < 1:
+        raise ValueError("n_workers deve essere almeno 1")
+    if not hours > 0:
+        raise ValueError("hours deve essere positivo")
+    if hourly_profile is None:
+        profile = np.ones(24)
+    else:
+        profile = np.asarray(hourly_profile, dtype=np.float64)
+        if profile.shape != (24,):
+            raise ValueError("hourly_profile deve avere 24 valori, uno per ora del giorno")
+        if not (np.all(np.isfinite(profile)) and np.all(profile >= 0) and profile.mean() > 0):
+            raise ValueError("hourly_profile deve contenere valori finiti non negativi "
+                             "con media positiva")
+        profile = profile / profile.mean()
+
+    timings = upload_timings(params, speeds=speeds, **timing_kwargs)
+    if service_sec is None:
+        service_sec = {name: timing.processing_sec for name, timing in timings.items()}
+    monthly = monthly_upload_counts(params)
+
+    service = np.array([service_sec[name] for name in JOB_TYPES], dtype=np.float64)
+    unit_cost = np.array([timings[name].cost for name in JOB_TYPES], dtype=np.float64)
+    base_rates = np.array([monthly[name] for name in JOB_TYPES], dtype=np.float64) \
+        * n_users / SECONDS_PER_MONTH
+
+    rng = np.random.default_rng(seed)
+    free_at = [0.0] * n_workers
+    wait_blocks, type_blocks = [], []
+    busy_sec = 0.0
+    ingestion_cost = 0.0
+
+    n_hours = int(np.ceil(hours))
+    for hour in range(n_hours):
+        rates = base_rates * profile[hour % 24]
+        if rates.sum() <= 0:
+            continue
+        arrivals, types, durations = _generate_hour(rng, hour * 3600.0, rates, service, service_cv)
+        if hour == n_hours - 1 and hours < n_hours:
+            # Ultima ora parziale
+            keep = arrivals < hours * 3600.0
+            arrivals, types, durations = arrivals[keep], types[keep], durations[keep]
+        wait_blocks.append(_serve_fifo(free_at, arrivals, durations))
+        type_blocks.append(types.astype(np.int8))
+        busy_sec += durations.sum()
+        ingestion_cost += unit_cost[types].sum()
+
+    waits = np.concatenate(wait_blocks) if wait_blocks else np.empty(0)
+    types = np.concatenate(type_blocks) if type_blocks else np.empty(0, dtype=np.int8)
+
+    def wait_stats(values):
+        if values.size == 0:
+            return {p: 0.0 for p in percentiles}
+        return dict(zip(percentiles, np.percentile(values, percentiles).tolist()))
+
+    # Il lavoro oltre l'orizzonte (coda residua) allunga il tempo-worker disponibile
+    horizon_sec = max(hours * 3600.0, max(free_at))
+    worker_cost = n_workers * worker_cost_per_hour
+    ingestion_per_hour = ingestion_cost / hours
+    return QueueSimulation(
+        n_jobs=int(waits.size),
+        wait_percentiles=wait_stats(waits),
+        wait_by_type={name: wait_stats(waits[types == k]) for k, name in enumerate(JOB_TYPES)},
+        mean_wait_sec=float(waits.mean()) if waits.size else 0.0,
+        utilization=busy_sec / (n_workers * horizon_sec),
+        cost_per_hour=worker_cost + ingestion_per_hour,
+        worker_cost_per_hour=worker_cost,
+        ingestion_cost_per_hour=ingestion_per_hour
+    )
+
+
+if __name__ == "__main__":
+    import time
+
+    example_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+    # Traffico concentrato nelle ore lavorative (picco ~3x la media)
+    office_hours = [0.2] * 8 + [2.5] * 10 + [0.6] * 6
+
+    # Dimensionamento su un giorno: 1M utenti, pool di worker diversi
+    print(f"{'worker':>6} | {'p50 s':>7} | {'p90 s':>7} | {'p99 s':>8} | {'utilizz.':>8} | {'$/ora':>8}")
+    for n_workers in (70, 76, 80, 90):
+        sim = simulate_ingestion_queue(1_000_000, n_workers, example_params, hours=24,
+                                       worker_cost_per_hour=0.10, hourly_profile=office_hours)
+        w = sim.wait_percentiles
+        print(f"{n_workers:>6} | {w[50]:>7.2f} | {w[90]:>7.2f} | {w[99]:>8.2f} | "
+              f"{sim.utilization:>8.1%} | {sim.cost_per_hour:>8.2f}")
+
+    # Un mese intero di arrivi per 1M utenti
+    t0 = time.perf_counter()
+    sim = simulate_ingestion_queue(1_000_000, 80, example_params, worker_cost_per_hour=0.10,
+                                   hourly_profile=office_hours)
+    elapsed = time.perf_counter() - t0
+    print(f"\nMese, 1M utenti, 80 worker: {sim.n_jobs:,} job in {elapsed:.1f} s; "
+          f"attesa p99={sim.wait_percentiles[99]:.2f} s, utilizzo={sim.utilization:.1%}, "
+          f"costo={sim.cost_per_hour:.2f} $/ora")
+    for name, w in sim.wait_by_type.items():
+        print(f"  {name:<9}: p50={w[50]:.2f} s, p99={w[99]:.2f} s")
@@ -0,0 +1,467 @@
+"""
+File: latency_model.py
+
+Scopo: stimare, nella stessa chiamata del costo, i tempi di risposta della chat, i tempi di
+       elaborazione degli upload e la concorrenza necessaria per sostenere N utenti.
+
+Tabella delle velocita' (`SPEED_CATALOG`, stessi nomi di modelli/pipeline del catalogo
+prezzi di `price_catalog.py`):
+- modelli: latenza fissa della richiesta (ttft_ms), velocita' di prefill
+  (prefill_tokens_per_sec) e di generazione (tokens_per_sec);
+- pipeline Unstructured: pagine al secondo (Hi-Res molto piu' lenta di Fast);
+- embedding (token al secondo) e scrittura di un chunk su DB (ms).
+
+Per messaggio:
+    TTFT       = ttft_ms + T_in / prefill_tokens_per_sec
+    generazione = out_tokens / tokens_per_sec
+    latenza    = retrieval + TTFT + generazione   (lo store avviene dopo la risposta)
+
+Per upload:
+    PDF    = pagine / pages_per_sec + embedding + scritture DB
+    immagine = TTFT(T_img) + t_descr / tokens_per_sec + embedding + DB
+    video  = ceil(frame / frame_concurrency) * tempo di un frame + embedding + DB
+
+Concorrenza (legge di Little): richieste in corso = tasso di arrivo di picco * tempo di
+servizio, con il tasso medio = eventi al mese * utenti / secondi in un mese, moltiplicato
+per `peak_factor`.
+"""
+
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+from app.compute_total_monthly_cost import cost_monthly_user_breakdown
+from app.cost_breakdown import CostBreakdown
+from app.send_message import average_history_pairs, calculate_history_tokens, cost_of_message
+from app.upload_file_in_kbox import (
+    image_tokens,
+    cost_upload_pdf,
+    cost_upload_image,
+    cost_upload_video
+)
+
+
+# Secondi in un mese di 30 giorni
+SECONDS_PER_MONTH = 30 * 24 * 3600
+
+# Velocita' indicative per modello/pipeline (stessi nomi di PRICE_CATALOGS)
+SPEED_CATALOG = {
+    "models": {
+        "GPT-4o":     {"ttft_ms": 450.0, "prefill_tokens_per_sec": 6000.0, "tokens_per_sec": 80.0},
+        "GPT-4oMini": {"ttft_ms": 300.0, "prefill_tokens_per_sec": 12000.0, "tokens_per_sec": 120.0}
+    },
+    "pipelines": {
+        "HiRes": {"pages_per_sec": 0.5},
+        "Fast": {"pages_per_sec": 20.0}
+    },
+    "embed_tokens_per_sec": 50000.0,
+    "db_write_ms_per_chunk": 5.0,
+    "retrieval_ms": 120.0
+}
+
+
+class MessageTiming(NamedTuple):
+    """
+    cost          : costo del messaggio (in dollari, o `CostBreakdown`)
+    t_in          : token di input del prompt
+    ttft_ms       : tempo al primo token (retrieval escluso)
+    generation_ms : tempo di generazione dei token di output
+    latency_ms    : latenza complessiva percepita (retrieval + TTFT + generazione)
+    """
+    cost: float
+    t_in: float
+    ttft_ms: float
+    generation_ms: float
+    latency_ms: float
+
+
+class UploadTiming(NamedTuple):
+    """
+    cost           : costo dell'upload (in dollari, o `CostBreakdown`)
+    processing_sec : tempo di elaborazione dell'upload, in secondi
+    """
+    cost: float
+    processing_sec: float
+
+
+class CapacityEstimate(NamedTuple):
+    """
+    cost                  : `CostBreakdown` mensile per utente
+    latency_4o_ms         : latenza di un messaggio su GPT-4o
+    latency_mini_ms       : latenza di un messaggio su GPT-4o Mini
+    message_latency_ms    : latenza media pesata sul routing (fraction_4o)
+    upload_sec            : dict {voce di CostBreakdown: secondi di elaborazione di un upload}
+    messages_per_sec      : messaggi al secondo di picco per n_users
+    chat_concurrency      : richieste LLM di chat contemporanee necessarie al picco
+    ingestion_concurrency : worker di ingestion occupati contemporaneamente al picco
+    """
+    cost: CostBreakdown
+    latency_4o_ms: float
+    latency_mini_ms: float
+    message_latency_ms: float
+    upload_sec: dict
+    messages_per_sec: float
+    chat_concurrency: float
+    ingestion_concurrency: float
+
+
+def ttft_ms(t_in: float, model: str, speeds: dict = SPEED_CATALOG) -> float:
+    """
+    Tempo al primo token (in ms) di una richiesta con `t_in` token di input.
+    """
+    s = speeds["models"][model]
+    return s["ttft_ms"] + 1000.0 * t_in / s["prefill_tokens_per_sec"]
+
+
+def generation_ms(out_tokens: float, model: str, speeds: dict = SPEED_CATALOG) -> float:
+    """
+    Tempo (in ms) per generare `out_tokens` token di output.
+    """
+    return 1000.0 * out_tokens / speeds["models"][model]["tokens_per_sec"]
+
+
+def message_cost_and_latency(
+    model: str,
+    max_pairs: int,
+    avg_tokens_per_message: int,
+    user_tokens: float,
+    n_kbox: float,
+    r_per_kbox: float,
+    chunk_size: float,
+    out_tokens: float,
+    p_in: float,
+    p_out: float,
+    c_retrieval: float,
+    c_store: float,
+    history_tokens: float = None,
+    breakdown: str = None,
+    retrieval_tokens: float = None,
+    retrieval_ms: float = None,
+    speeds: dict = SPEED_CATALOG
+) -> MessageTiming:
+    """
+    Costo e latenza di un singolo messaggio.
+
+    Parametri:
+    -----------
+    model : str
+        Nome del modello in `speeds["models"]` (es. "GPT-4o").
+    max_pairs, ..., retrieval_tokens :
+        Come in `cost_of_message`.
+    retrieval_ms : float
+        Latenza dello stadio di retrieval (es. `retrieval_model.RetrievalStage.latency_ms`);
+        default `speeds["retrieval_ms"]`, 0 se il messaggio non interroga KBox.
+    speeds : dict
+        Tabella delle velocita' (default `SPEED_CATALOG`).
+
+    Ritorna:
+    -----------
+    MessageTiming
+    """
+    if history_tokens is None:
+        history_tokens = calculate_history_tokens(max_pairs, avg_tokens_per_message)
+    if retrieval_tokens is None:
+        retrieval_tokens = n_kbox * r_per_kbox * chunk_size
+    if retrieval_ms is None:
+        retrieval_ms = speeds["retrieval_ms"] if n_kbox > 0 else 0.0
+
+    cost = cost_of_message(max_pairs, avg_tokens_per_message, user_tokens, n_kbox, r_per_kbox,
+                           chunk_size, out_tokens, p_in, p_out, c_retrieval, c_store,
+                           history_tokens=history_tokens, breakdown=breakdown,
+                           retrieval_tokens=retrieval_tokens)
+
+    t_in = history_tokens + user_tokens + retrieval_tokens
+    first_token = ttft_ms(t_in, model, speeds)
+    generation = generation_ms(out_tokens, model, speeds)
+    return MessageTiming(
+        cost=cost,
+        t_in=t_in,
+        ttft_ms=first_token,
+        generation_ms=generation,
+        latency_ms=retrieval_ms + first_token + generation
+    )
+
+
+def _indexing_sec(t_embed: float, n_chunk: float, speeds: dict) -> float:
+    # Embedding dei token + scrittura dei chunk su DB
+    return t_embed / speeds["embed_tokens_per_sec"] + n_chunk * speeds["db_write_ms_per_chunk"] / 1000.0
+
+
+def pdf_cost_and_time(
+    pipeline: str,
+    n_pages: int,
+    c_page: float,
+    t_total: float,
+    barT_chunk: float,
+    c_embed: float,
+    c_db_chunk: float,
+    breakdown: str = None,
+    speeds: dict = SPEED_CATALOG
+) -> UploadTiming:
+    """
+    Costo e tempo di elaborazione di un PDF (parametri come `cost_upload_pdf`, con il nome
+    della pipeline in `speeds["pipelines"]`, es. "HiRes" o "Fast").
+    """
+    n_chunk = math.ceil(t_total / barT_chunk)
+    processing_sec = (n_pages / speeds["pipelines"][pipeline]["pages_per_sec"]
+                      + _indexing_sec(n_chunk * barT_chunk, n_chunk, speeds))
+    cost = cost_upload_pdf(n_pages, c_page, t_total, barT_chunk, c_embed, c_db_chunk,
+                           breakdown=breakdown)
+    return UploadTiming(cost=cost, processing_sec=processing_sec)
+
+
+def image_cost_and_time(
+    model: str,
+    width: int,
+    height: int,
+    t_descr: float,
+    p_in: float,
+    p_out: float,
+    c_embed: float,
+    c_db_chunk: float,
+    breakdown: str = None,
+    token_model: str = "linear",
+    detail: str = "high",
+    speeds: dict = SPEED_CATALOG
+) -> UploadTiming:
+    """
+    Costo e tempo di elaborazione di un'immagine (parametri come `cost_upload_image`, con il
+    modello di caption in `speeds["models"]`).
+    """
+    t_img = image_tokens(width, height, token_model, detail)
+    caption_sec = (ttft_ms(t_img, model, speeds) + generation_ms(t_descr, model, speeds)) / 1000.0
+    cost = cost_upload_image(width, height, t_descr, p_in, p_out, c_embed, c_db_chunk,
+                             breakdown=breakdown, token_model=token_model, detail=detail)
+    return UploadTiming(cost=cost, processing_sec=caption_sec + _indexing_sec(t_descr, 1, speeds))
+
+
+def video_cost_and_time(
+    model: str,
+    duration_sec: float,
+    sampling_sec: float,
+    width: int,
+    height: int,
+    t_descr: float,
+    p_in: float,
+    p_out: float,
+    c_embed: float,
+    c_db_chunk: float,
+    t_descr_total: float,
+    breakdown: str = None,
+    token_model: str = "linear",
+    detail: str = "high",
+    frame_concurrency: int = 1,
+    speeds: dict = SPEED_CATALOG
+) -> UploadTiming:
+    """
+    Costo e tempo di elaborazione di un video (parametri come `cost_upload_video`, con il
+    modello di caption in `speeds["models"]`).
+
+    `frame_concurrency` e' il numero di caption di frame eseguite in parallelo per video.
+    """
+    n_frame = math.ceil(duration_sec / sampling_sec)
+    t_img = image_tokens(width, height, token_model, detail)
+    frame_sec = (ttft_ms(t_img, model, speeds) + generation_ms(t_descr, model, speeds)) / 1000.0
+    processing_sec = (math.ceil(n_frame / frame_concurrency) * frame_sec
+                      + _indexing_sec(t_descr_total, 1, speeds))
+    cost = cost_upload_video(duration_sec, sampling_sec, width, height, t_descr, p_in, p_out,
+                             c_embed, c_db_chunk, t_descr_total, breakdown=breakdown,
+                             token_model=token_model, detail=detail)
+    return UploadTiming(cost=cost, processing_sec=processing_sec)
+
+
+def upload_timings(
+    params: dict,
+    imgvid_model_4o: str = "GPT-4o",
+    imgvid_model_mini: str = "GPT-4oMini",
+    pipeline_hires: str = "HiRes",
+    pipeline_fast: str = "Fast",
+    frame_concurrency: int = 1,
+    speeds: dict = SPEED_CATALOG
+) -> dict:
+    """
+    Costo e tempo di elaborazione di un upload per ogni voce di ingestion.
+
+    Parametri:
+    -----------
+    params : dict
+        Parametri di `cost_monthly_user_breakdown`.
+    imgvid_model_4o, ..., speeds :
+        Come in `cost_and_capacity`.
+
+    Ritorna:
+    -----------
+    dict
+        {voce di CostBreakdown ("doc_hires", ..., "vid_mini"): UploadTiming}
+    """
+    doc_kwargs = dict(n_pages=params["pages_per_doc"], t_total=params["t_total_doc"],
+                      barT_chunk=params["barT_chunk_doc"], c_embed=params["c_embed_doc"],
+                      c_db_chunk=params["c_db_chunk_doc"], speeds=speeds)
+    img_kwargs = dict(width=params["img_width"], height=params["img_height"],
+                      t_descr=params["t_descr_img"], c_embed=params["c_embed_img"],
+                      c_db_chunk=params["c_db_chunk_img"], speeds=speeds)
+    vid_kwargs = dict(duration_sec=params["dur_sec_vid"], sampling_sec=params["sampling_sec_vid"],
+                      width=params["vid_width"], height=params["vid_height"],
+                      t_descr=params["t_descr_vid_frame"], c_embed=params["c_embed_vid"],
+                      c_db_chunk=params["c_db_chunk_vid"], t_descr_total=params["t_descr_vid_total"],
+                      frame_concurrency=frame_concurrency, speeds=speeds)
+    return {
+        "doc_hires": pdf_cost_and_time(pipeline_hires, c_page=params["c_page_hires"],
+                                       **doc_kwargs),
+        "doc_fast": pdf_cost_and_time(pipeline_fast, c_page=params["c_page_fast"],
+                                      **doc_kwargs),
+        "img_4o": image_cost_and_time(imgvid_model_4o, p_in=params["p_in_4o_imgvid"],
+                                      p_out=params["p_out_4o_imgvid"], **img_kwargs),
+        "img_mini": image_cost_and_time(imgvid_model_mini, p_in=params["p_in_mini_imgvid"],
+                                        p_out=params["p_out_mini_imgvid"], **img_kwargs),
+        "vid_4o": video_cost_and_time(imgvid_model_4o, p_in=params["p_in_4o_imgvid"],
+                                      p_out=params["p_out_4o_imgvid"], **vid_kwargs),
+        "vid_mini": video_cost_and_time(imgvid_model_mini, p_in=params["p_in_mini_imgvid"],
+                                        p_out=params["p_out_mini_imgvid"], **vid_kwargs)
+    }
+
+
+def monthly_upload_counts(params: dict) -> dict:
+    """
+    Upload medi al mese per utente, per voce di ingestion (frazioni non arrotondate).
+    """
+    n_doc_hires = params["n_doc"] * params["fraction_hires"]
+    n_img_4o = params["n_img"] * params["fraction_4o_imgvid"]
+    n_vid_4o = params["n_vid"] * params["fraction_4o_imgvid"]
+    return {
+        "doc_hires": n_doc_hires,
+        "doc_fast": params["n_doc"] - n_doc_hires,
+        "img_4o": n_img_4o,
+        "img_mini": params["n_img"] - n_img_4o,
+        "vid_4o": n_vid_4o,
+        "vid_mini": params["n_vid"] - n_vid_4o
+    }
+
+
+def cost_and_capacity(
+    n_users,
+    peak_factor: float = 3.0,
+    chat_model_4o: str = "GPT-4o",
+    chat_model_mini: str = "GPT-4oMini",
+    imgvid_model_4o: str = "GPT-4o",
+    imgvid_model_mini: str = "GPT-4oMini",
+    pipeline_hires: str = "HiRes",
+    pipeline_fast: str = "Fast",
+    frame_concurrency: int = 1,
+    speeds: dict = SPEED_CATALOG,
+    **params
+) -> CapacityEstimate:
+    """
+    Costo mensile per utente, latenze per messaggio, tempi di elaborazione per upload e
+    concorrenza necessaria per sostenere `n_users` utenti, in un'unica chiamata.
+
+    Parametri:
+    -----------
+    n_users : int o array
+        Numero di utenti (anche un array di dimensionamenti alternativi).
+    peak_factor : float
+        Rapporto tra il tasso di picco e il tasso medio mensile (es. 3.0).
+    chat_model_4o, ..., pipeline_fast : str
+        Nomi in `speeds` dei modelli/pipeline corrispondenti ai prezzi in **params.
+    frame_concurrency : int
+        Caption di frame eseguite in parallelo per video.
+    speeds : dict
+        Tabella delle velocita' (default `SPEED_CATALOG`).
+    **params :
+        Parametri di `cost_monthly_user_breakdown` (stessi nomi dei parametri di utilizzo e prezzo).
+
+    Ritorna:
+    -----------
+    CapacityEstimate
+        `chat_concurrency` e `ingestion_concurrency` sono arrotondate all'intero superiore
+        (scalari o array, come `n_users`).
+    """
+    cost = cost_monthly_user_breakdown(**params)
+
+    # 1) Chat: stessa history media del modello di costo (T_in e' affine nelle coppie)
+    max_pairs = params.get("max_pairs", 25)
+    if params.get("growing_history", False):
+        history_pairs = average_history_pairs(params["n_msg_per_chat"], max_pairs)
+    else:
+        history_pairs = max_pairs
+    message_kwargs = dict(
+        max_pairs=history_pairs,
+        avg_tokens_per_message=params.get("avg_tokens_per_message", 100),
+        user_tokens=params["user_tokens_per_msg"],
+        n_kbox=params["n_kbox_per_msg"],
+        r_per_kbox=params["r_per_kbox"],
+        chunk_size=params["chunk_size_retrieval"],
+        out_tokens=params["out_tokens_per_msg"],
+        c_retrieval=params["c_retrieval"],
+        c_store=params["c_store"],
+        speeds=speeds
+    )
+    msg_4o = message_cost_and_latency(chat_model_4o, p_in=params["p_in_4o"],
+                                      p_out=params["p_out_4o"], **message_kwargs)
+    msg_mini = message_cost_and_latency(chat_model_mini, p_in=params["p_in_mini"],
+                                        p_out=params["p_out_mini"], **message_kwargs)
+    fraction_4o = params["fraction_4o"]
+    message_latency_ms = fraction_4o * msg_4o.latency_ms + (1.0 - fraction_4o) * msg_mini.latency_ms
+
+    # 2) Upload: tempo di elaborazione per voce
+    upload_sec = {name: timing.processing_sec for name, timing in upload_timings(
+        params, imgvid_model_4o, imgvid_model_mini, pipeline_hires, pipeline_fast,
+        frame_concurrency, speeds).items()}
+
+    # 3) Concorrenza al picco (legge di Little): tasso di arrivo * tempo di servizio
+    n_users = np.asarray(n_users, dtype=np.float64)
+    peak_per_sec = n_users * peak_factor / SECONDS_PER_MONTH
+
+    messages_per_sec = peak_per_sec * (params["n_chat"] * params["n_msg_per_chat"])
+    chat_busy = messages_per_sec * (fraction_4o * (msg_4o.ttft_ms + msg_4o.generation_ms)
+                                    + (1.0 - fraction_4o) * (msg_mini.ttft_ms + msg_mini.generation_ms)) / 1000.0
+
+    monthly_uploads = monthly_upload_counts(params)
+    ingestion_busy = peak_per_sec * sum(monthly_uploads[k] * upload_sec[k] for k in upload_sec)
+
+    def as_output(x):
+        return float(x) if np.ndim(x) == 0 else x
+
+    return CapacityEstimate(
+        cost=cost,
+        latency_4o_ms=msg_4o.latency_ms,
+        latency_mini_ms=msg_mini.latency_ms,
+        message_latency_ms=message_latency_ms,
+        upload_sec=upload_sec,
+        messages_per_sec=as_output(messages_per_sec),
+        chat_concurrency=as_output(np.ceil(chat_busy)),
+        ingestion_concurrency=as_output(np.ceil(ingestion_busy))
+    )
+
+
+if __name__ == "__main__":
+    example_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    estimate = cost_and_capacity(100_000, **example_params)
+    print(f"Costo mensile per utente: {estimate.cost.total:.6f} $")
+    print(f"Latenza messaggio: GPT-4o {estimate.latency_4o_ms:.0f} ms, "
+          f"GPT-4o Mini {estimate.latency_mini_ms:.0f} ms, media {estimate.message_latency_ms:.0f} ms")
+    for name, seconds in estimate.upload_sec.items():
+        print(f"  {name:<9}: {seconds:8.2f} s per upload")
+
+    print(f"\n{'utenti':>10} | {'msg/s picco':>11} | {'conc. chat':>10} | {'worker ingestion':>16}")
+    users = np.array([1_000, 10_000, 100_000, 1_000_000])
+    sizing = cost_and_capacity(users, **example_params)
+    for i, n in enumerate(users):
+        print(f"{n:>10} | {sizing.messages_per_sec[i]:>11.2f} | {sizing.chat_concurrency[i]:>10.0f} | "
+              f"{sizing.ingestion_concurrency[i]:>16.0f}")
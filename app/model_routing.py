@@ -0,0 +1,295 @@
+"""
+File: model_routing.py
+
+Scopo: generalizzare il costo di chat e caption da due modelli (fraction_4o contro
+       1 - fraction_4o, con otto prezzi separati) a N modelli con una tabella di routing.
+
+`ModelRouting` contiene:
+- i prezzi dei modelli come vettori p_in[N], p_out[N] (stesso formato di `models`
+  del catalogo di `price_catalog.py`);
+- il routing: frazioni fisse per modello (anche una riga per tenant), oppure regole
+  a soglie sui token di input T_in (es. prompt corti su un modello economico, prompt
+  lunghi su un modello con contesto ampio).
+
+Il costo si valuta come prodotto scalare frazioni . prezzi per ogni tenant, tutto in
+NumPy: aggiungere modelli non aggiunge cicli Python ne' parametri alle funzioni.
+
+Per le caption di immagini/video i conteggi per modello sono arrotondati sulle frazioni
+cumulate (round(n * F_k) - round(n * F_{k-1})), che con due modelli coincide con la
+regola int(round(n * fraction_4o_imgvid)) di `cost_monthly_user_debug`.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from app.send_message import average_history_pairs_batch, average_cached_history_tokens_batch
+from app.upload_file_in_kbox import cost_upload_pdf_batch, image_tokens_batch
+from app.price_catalog import get_price_catalog
+
+
+# Tolleranza sulla somma delle frazioni di routing
+_FRACTION_TOLERANCE = 1e-9
+
+
+class ModelRouting:
+    """
+    Tabella di routing su N modelli.
+
+    Parametri:
+    -----------
+    models : dict
+        {nome: {"p_in": ..., "p_out": ...}} con prezzi in $/1k token.
+    fractions : dict
+        {nome: frazione} (scalari o array, es. una frazione per tenant); i modelli
+        assenti hanno frazione 0. Alternativo a `rules`.
+    rules : list di tuple (max_t_in, {nome: frazione})
+        Regole in ordine di soglia crescente: si applica la prima regola con
+        T_in <= max_t_in; l'ultima regola puo' avere max_t_in=None (nessun limite),
+        altrimenti un T_in oltre l'ultima soglia solleva ValueError.
+    """
+    __slots__ = ("names", "p_in", "p_out", "bounds", "table")
+
+    def __init__(self, models: dict, fractions: dict = None, rules: list = None):
+        if (fractions is None) == (rules is None):
+            raise ValueError("Specificare esattamente uno tra 'fractions' e 'rules'")
+        self.names = tuple(models)
+        self.p_in = np.array([models[m]["p_in"] for m in self.names], dtype=np.float64)
+        self.p_out = np.array([models[m]["p_out"] for m in self.names], dtype=np.float64)
+
+        if fractions is not None:
+            self.bounds = None
+            self.table = self._fraction_row(fractions)
+        else:
+            bounds = [np.inf if max_t_in is None else max_t_in for max_t_in, _ in rules]
+            if any(b2 <= b1 for b1, b2 in zip(bounds, bounds[1:])):
+                raise ValueError("Le soglie delle regole devono essere crescenti")
+            self.bounds = np.array(bounds, dtype=np.float64)
+            self.table = np.stack([self._fraction_row(row) for _, row in rules])
+
+    def _fraction_row(self, fractions: dict) -> np.ndarray:
+        unknown = set(fractions) - set(self.names)
+        if unknown:
+            raise KeyError(f"Modelli non presenti nella tabella: {sorted(unknown)}")
+        columns = np.broadcast_arrays(*(np.asarray(fractions.get(m, 0.0), dtype=np.float64)
+                                        for m in self.names))
+        row = np.stack(columns, axis=-1)
+        if np.any((row < -_FRACTION_TOLERANCE) | (row > 1.0 + _FRACTION_TOLERANCE)):
+            raise ValueError(f"Le frazioni di routing devono essere comprese tra 0 e 1: {fractions}")
+        if np.any(np.abs(row.sum(axis=-1) - 1.0) > _FRACTION_TOLERANCE):
+            raise ValueError(f"Le frazioni di routing devono sommare a 1: {fractions}")
+        return row
+
+    @classmethod
+    def from_catalog(cls, fractions: dict = None, rules: list = None, version: str = None):
+        """Tabella con i prezzi di tutti i modelli del catalogo `version`."""
+        return cls(get_price_catalog(version).models, fractions=fractions, rules=rules)
+
+    def fractions_for(self, t_in) -> np.ndarray:
+        """
+        Frazioni di routing per i token di input `t_in` (scalare o array).
+
+        Ritorna:
+        -----------
+        np.ndarray di shape t_in.shape + (N,) (broadcast con eventuali frazioni per tenant).
+        """
+        t_in = np.asarray(t_in, dtype=np.float64)
+        if self.bounds is None:
+            table = self.table
+            return np.broadcast_to(table, np.broadcast_shapes(t_in.shape, table.shape[:-1]) + table.shape[-1:])
+        index = np.searchsorted(self.bounds, t_in, side="left")
+        beyond = index == len(self.bounds)
+        if np.any(beyond & ~np.isnan(t_in)):
+            raise ValueError(f"T_in oltre la soglia dell'ultima regola ({self.bounds[-1]:g}): "
+                             f"max T_in = {np.nanmax(t_in):g}; usare max_t_in=None nell'ultima regola")
+        return self.table[np.minimum(index, len(self.bounds) - 1)]
+
+    def prices(self, t_in):
+        """Prezzi medi (p_in, p_out) pesati dal routing: prodotto scalare per tenant."""
+        fractions = self.fractions_for(t_in)
+        return fractions @ self.p_in, fractions @ self.p_out
+
+
+def _split_counts(n, fractions) -> np.ndarray:
+    """Conteggi interi per modello, arrotondati sulle frazioni cumulate (shape (..., N))."""
+    n = np.asarray(n, dtype=np.float64)[..., None]
+    cumulative = np.rint(n * np.cumsum(fractions, axis=-1))
+    cumulative[..., -1] = n[..., 0]
+    return np.diff(cumulative, axis=-1, prepend=0.0)
+
+
+class RoutedCost(NamedTuple):
+    """
+    Costi mensili (array, uno per tenant) con il dettaglio per modello
+    (ultima dimensione = modelli della tabella di routing, nell'ordine di `names`).
+    In `chat_by_model` i costi fissi c_retrieval + c_store sono ripartiti come i
+    messaggi, per cui chat_by_model.sum(-1) == chat.
+    """
+    chat: np.ndarray
+    doc: np.ndarray
+    img: np.ndarray
+    vid: np.ndarray
+    storage: np.ndarray
+    chat_by_model: np.ndarray
+    img_by_model: np.ndarray
+    vid_by_model: np.ndarray
+
+    @property
+    def total(self) -> np.ndarray:
+        return self.chat + self.doc + self.img + self.vid + self.storage
+
+
+def cost_monthly_user_routed(
+    chat_routing: ModelRouting,
+    caption_routing: ModelRouting,
+    token_model: str = "linear",
+    **params
+) -> RoutedCost:
+    """
+    Costo mensile (vettorizzato) con routing su N modelli per chat e caption.
+
+    Parametri:
+    -----------
+    chat_routing : ModelRouting
+        Routing dei messaggi di chat (regole su T_in = history + utente + retrieval).
+    caption_routing : ModelRouting
+        Routing delle caption di immagini e frame video (regole su T_in = token immagine).
+    token_model : str
+        Modello dei token immagine ("linear" o "tiled"), vedi `image_tokens_batch`.
+    **params :
+        Parametri keyword di `cost_monthly_user_debug` (scalari o array per tenant).
+        I parametri specifici dei due modelli (fraction_4o, p_in_4o, ..., p_out_mini_imgvid)
+        non sono usati: prezzi e frazioni vengono dalle tabelle di routing.
+
+    Ritorna:
+    -----------
+    RoutedCost
+    """
+    p = params
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # 1) Chat: T_in medio per messaggio, costo = messaggi * (frazioni . costo per modello)
+        n_msg_per_chat = np.asarray(p["n_msg_per_chat"], dtype=np.float64)
+        max_pairs = p.get("max_pairs", 25)
+        if p.get("growing_history", False):
+            history_pairs = average_history_pairs_batch(n_msg_per_chat, max_pairs)
+        else:
+            history_pairs = max_pairs
+        t_in = (2.0 * np.asarray(history_pairs, dtype=np.float64) * p.get("avg_tokens_per_message", 100)
+                + p["user_tokens_per_msg"]
+                + np.multiply(np.multiply(p["n_kbox_per_msg"], p["r_per_kbox"]),
+                              p["chunk_size_retrieval"], dtype=np.float64))
+        t_out = np.asarray(p["out_tokens_per_msg"], dtype=np.float64)
+        total_msgs = np.multiply(p["n_chat"], n_msg_per_chat, dtype=np.float64)
+
+        chat_fractions = chat_routing.fractions_for(t_in)
+        per_model_msg = ((t_in / 1000.0)[..., None] * chat_routing.p_in
+                         + (t_out / 1000.0)[..., None] * chat_routing.p_out)
+        if p.get("cached_input_ratio") is not None and p.get("growing_history", False):
+            cached_tokens = average_cached_history_tokens_batch(
+                n_msg_per_chat, max_pairs, p.get("avg_tokens_per_message", 100))
+            discount = (1.0 - np.asarray(p["cached_input_ratio"], dtype=np.float64)) \
+                * p.get("cache_hit_rate", 1.0) * cached_tokens / 1000.0
+            per_model_msg = per_model_msg - discount[..., None] * chat_routing.p_in
+        # Costi fissi di retrieval/store ripartiti sui modelli come i messaggi
+        fixed_msg = np.asarray(np.add(p["c_retrieval"], p["c_store"]), dtype=np.float64)
+        chat_by_model = (total_msgs[..., None] * chat_fractions) * (per_model_msg + fixed_msg[..., None])
+        chat = total_msgs * (np.einsum("...k,...k->...", chat_fractions, per_model_msg)
+                             + p["c_retrieval"] + p["c_store"])
+
+        # 2a) Documenti (come cost_monthly_user_batch)
+        n_doc = np.asarray(p["n_doc"], dtype=np.float64)
+        n_doc_hires = np.rint(n_doc * p["fraction_hires"])
+        doc_kwargs = dict(n_pages=p["pages_per_doc"], t_total=p["t_total_doc"],
+                          barT_chunk=p["barT_chunk_doc"], c_embed=p["c_embed_doc"],
+                          c_db_chunk=p["c_db_chunk_doc"])
+        doc = (np.where(n_doc_hires > 0, n_doc_hires * cost_upload_pdf_batch(
+                   c_page=p["c_page_hires"], **doc_kwargs), 0.0)
+               + np.where(n_doc - n_doc_hires > 0, (n_doc - n_doc_hires) * cost_upload_pdf_batch(
+                   c_page=p["c_page_fast"], **doc_kwargs), 0.0))
+
+        # 2b) Immagini: conteggi per modello . costo LLM per modello
+        t_img = image_tokens_batch(p["img_width"], p["img_height"], token_model)
+        t_descr_img = np.asarray(p["t_descr_img"], dtype=np.float64)
+        img_counts = _split_counts(p["n_img"], caption_routing.fractions_for(t_img))
+        img_llm = ((t_img / 1000.0)[..., None] * caption_routing.p_in
+                   + (t_descr_img / 1000.0)[..., None] * caption_routing.p_out)
+        img_tail = (t_descr_img / 1000.0) * p["c_embed_img"] + p["c_db_chunk_img"]
+        img_by_model = img_counts * (img_llm + img_tail[..., None])
+        img = img_by_model.sum(axis=-1)
+
+        # 2c) Video: stesso schema, costo LLM per frame x numero di frame
+        n_frame = np.ceil(np.divide(p["dur_sec_vid"], p["sampling_sec_vid"], dtype=np.float64))
+        t_vid = image_tokens_batch(p["vid_width"], p["vid_height"], token_model)
+        t_descr_frame = np.asarray(p["t_descr_vid_frame"], dtype=np.float64)
+        vid_counts = _split_counts(p["n_vid"], caption_routing.fractions_for(t_vid))
+        vid_llm = n_frame[..., None] * ((t_vid / 1000.0)[..., None] * caption_routing.p_in
+                                        + (t_descr_frame / 1000.0)[..., None] * caption_routing.p_out)
+        vid_tail = (np.asarray(p["t_descr_vid_total"], dtype=np.float64) / 1000.0) * p["c_embed_vid"] \
+            + p["c_db_chunk_vid"]
+        vid_by_model = vid_counts * (vid_llm + vid_tail[..., None])
+        vid = vid_by_model.sum(axis=-1)
+
+        # 3) Storage
+        storage = np.multiply(p["gb_stored_user"], p["c_gb_month"], dtype=np.float64)
+
+    shape = np.broadcast_shapes(chat.shape, doc.shape, img.shape, vid.shape, storage.shape)
+    return RoutedCost(
+        chat=np.broadcast_to(chat, shape),
+        doc=np.broadcast_to(doc, shape),
+        img=np.broadcast_to(img, shape),
+        vid=np.broadcast_to(vid, shape),
+        storage=np.broadcast_to(storage, shape),
+        chat_by_model=chat_by_model,
+        img_by_model=img_by_model,
+        vid_by_model=vid_by_model
+    )
+
+
+if __name__ == "__main__":
+    from app.compute_total_monthly_cost import cost_monthly_user
+
+    example_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    # Due modelli con frazioni fisse: stesso risultato di cost_monthly_user
+    chat_2 = ModelRouting.from_catalog(fractions={"GPT-4o": 0.3, "GPT-4oMini": 0.7})
+    caption_2 = ModelRouting.from_catalog(fractions={"GPT-4o": 0.3, "GPT-4oMini": 0.7})
+    routed = cost_monthly_user_routed(chat_2, caption_2, **example_params)
+    print(f"2 modelli: {float(routed.total):.6f} $ (cost_monthly_user = {cost_monthly_user(**example_params):.6f} $)")
+
+    # Cinque modelli, routing della chat in base alla lunghezza del prompt
+    models = {
+        "nano":   {"p_in": 0.0001,  "p_out": 0.0004},
+        "mini":   {"p_in": 0.00015, "p_out": 0.0006},
+        "medium": {"p_in": 0.001,   "p_out": 0.004},
+        "large":  {"p_in": 0.005,   "p_out": 0.015},
+        "long":   {"p_in": 0.003,   "p_out": 0.015}
+    }
+    chat_rules = ModelRouting(models, rules=[
+        (4000, {"nano": 0.6, "mini": 0.3, "large": 0.1}),
+        (12000, {"mini": 0.5, "medium": 0.3, "large": 0.2}),
+        (None, {"medium": 0.2, "long": 0.8})
+    ])
+    captions = ModelRouting(models, fractions={"mini": 0.8, "large": 0.2})
+
+    n_tenants = 100_000
+    rng = np.random.default_rng(0)
+    tenant_params = dict(example_params, max_pairs=rng.integers(0, 100, n_tenants),
+                         n_chat=rng.integers(0, 30, n_tenants), n_img=rng.integers(0, 20, n_tenants))
+    routed = cost_monthly_user_routed(chat_rules, captions, **tenant_params)
+    print(f"{n_tenants} tenant, 5 modelli: costo medio {routed.total.mean():.4f} $; chat per modello:")
+    for name, value in zip(chat_rules.names, routed.chat_by_model.sum(axis=0)):
+        print(f"  {name:<7} {value:,.2f} $")
@@ -0,0 +1,299 @@
+"""
+File: monte_carlo_costs.py
+
+Scopo: stimare la distribuzione del costo mensile per utente (P50/P95/P99, media)
+       invece di un singolo valore medio.
+
+Ogni parametro di `cost_monthly_user_debug` puo' essere:
+- un valore fisso (int/float), oppure
+- una distribuzione: Poisson, LogNormal, Uniform, Empirical (istogramma / valori osservati).
+
+I campioni sono generati con NumPy a blocchi (`chunk_size` campioni alla volta, per
+limitare la memoria) e valutati con `cost_monthly_user_batch`. Ogni blocco ha il proprio
+generatore derivato da un unico `seed` (SeedSequence.spawn): il risultato e' riproducibile
+e non dipende dal numero di processi usati.
+
+Ogni blocco viene ridotto subito a somme, minimo/massimo e un istogramma a bin logaritmici
+per voce: la memoria non dipende da n_samples ma dall'intervallo dei costi (circa
+log(max / min) / quantile_rel_error bin per voce, ~1 MB per costi tra 0.001 e 1000 $ con
+l'errore di default). La media e' esatta; i quantili hanno errore relativo al piu'
+`quantile_rel_error` (e sono esatti ai bordi: minimo e massimo osservati).
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.compute_total_monthly_cost import cost_monthly_user_batch
+
+
+# Errore relativo massimo di default dei quantili (larghezza relativa dei bin)
+QUANTILE_REL_ERROR = 1e-4
+
+# Costi (in dollari) sotto questa soglia, 0 compreso, sono contati come 0 dall'istogramma
+_HIST_MIN_COST = 1e-12
+
+# Voci ridotte per ogni blocco
+_COMPONENTS = ("chat", "ingestion", "storage", "total")
+
+
+class Poisson:
+    """Conteggi Poisson di media `lam` (es. n_doc, n_chat)."""
+    __slots__ = ("lam",)
+
+    def __init__(self, lam: float):
+        self.lam = lam
+
+    def sample(self, rng, size: int) -> np.ndarray:
+        return rng.poisson(self.lam, size)
+
+
+class LogNormal:
+    """
+    Valori lognormali con mediana `median` e deviazione standard `sigma` del logaritmo
+    (es. token per messaggio, pagine per documento, durata dei video).
+    """
+    __slots__ = ("median", "sigma")
+
+    def __init__(self, median: float, sigma: float):
+        self.median = median
+        self.sigma = sigma
+
+    def sample(self, rng, size: int) -> np.ndarray:
+        return rng.lognormal(np.log(self.median), self.sigma, size)
+
+
+class Uniform:
+    """Valori uniformi in [low, high) (es. frazioni di traffico su GPT-4o)."""
+    __slots__ = ("low", "high")
+
+    def __init__(self, low: float, high: float):
+        self.low = low
+        self.high = high
+
+    def sample(self, rng, size: int) -> np.ndarray:
+        return rng.uniform(self.low, self.high, size)
+
+
+class Empirical:
+    """
+    Distribuzione empirica: valori osservati (o centri di un istogramma) con
+    pesi opzionali (frequenze dell'istogramma).
+    """
+    __slots__ = ("values", "probs")
+
+    def __init__(self, values, weights=None):
+        self.values = np.asarray(values)
+        if weights is None:
+            self.probs = None
+        else:
+            weights = np.asarray(weights, dtype=np.float64)
+            self.probs = weights / weights.sum()
+
+    def sample(self, rng, size: int) -> np.ndarray:
+        return rng.choice(self.values, size=size, p=self.probs)
+
+
+def _sample_params(params: dict, rng, size: int) -> dict:
+    """Sostituisce ogni distribuzione con un array di `size` campioni."""
+    return {name: (value.sample(rng, size) if hasattr(value, "sample") else value)
+            for name, value in params.items()}
+
+
+class _LogHistogram:
+    """
+    Riassunto in streaming di una voce di costo: numero di campioni, somma, minimo, massimo
+    e conteggi su bin logaritmici [e^(i s), e^((i + 1) s)) con s = log(1 + rel_error).
+    Si memorizzano solo i bin tra il minimo e il massimo indice osservati.
+    """
+    __slots__ = ("log_step", "n", "total", "low", "high", "n_zero", "offset", "counts")
+
+    def __init__(self, rel_error: float):
+        self.log_step = np.log1p(rel_error)
+        self.n = 0
+        self.total = 0.0
+        self.low = np.inf
+        self.high = -np.inf
+        self.n_zero = 0
+        self.offset = 0
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64).ravel()
+        if values.size == 0:
+            return
+        self.n += values.size
+        self.total += float(values.sum())
+        self.low = min(self.low, float(values.min()))
+        self.high = max(self.high, float(values.max()))
+        positive = values[values >= _HIST_MIN_COST]
+        self.n_zero += values.size - positive.size
+        if positive.size:
+            index = np.floor(np.log(positive) / self.log_step).astype(np.int64)
+            start = int(index.min())
+            self._add_counts(start, np.bincount(index - start))
+
+    def merge(self, other) -> None:
+        """Aggiunge i campioni riassunti da un altro istogramma (stesso rel_error)."""
+        self.n += other.n
+        self.total += other.total
+        self.low = min(self.low, other.low)
+        self.high = max(self.high, other.high)
+        self.n_zero += other.n_zero
+        self._add_counts(other.offset, other.counts)
+
+    def _add_counts(self, offset: int, counts: np.ndarray) -> None:
+        if counts.size == 0:
+            return
+        if self.counts.size == 0:
+            self.offset, self.counts = offset, counts.astype(np.int64)
+            return
+        start = min(self.offset, offset)
+        stop = max(self.offset + self.counts.size, offset + counts.size)
+        if start != self.offset or stop != self.offset + self.counts.size:
+            grown = np.zeros(stop - start, dtype=np.int64)
+            grown[self.offset - start:self.offset - start + self.counts.size] = self.counts
+            self.offset, self.counts = start, grown
+        self.counts[offset - self.offset:offset - self.offset + counts.size] += counts
+
+    def quantiles(self, quantiles) -> np.ndarray:
+        """
+        Quantili con la stessa interpolazione lineare tra ranghi di `np.quantile`, dove il
+        campione di ogni rango e' approssimato con il centro (geometrico) del suo bin.
+        """
+        cumulative = self.n_zero + np.cumsum(self.counts)
+
+        def value_at(rank):
+            if rank == 0:
+                return self.low
+            if rank == self.n - 1:
+                return self.high
+            if rank < self.n_zero:
+                value = 0.0
+            else:
+                i = int(np.searchsorted(cumulative, rank, side="right"))
+                value = float(np.exp((self.offset + i + 0.5) * self.log_step))
+            return min(max(value, self.low), self.high)
+
+        out = []
+        for q in quantiles:
+            rank = q * (self.n - 1)
+            below = int(np.floor(rank))
+            lo = value_at(below)
+            hi = value_at(min(below + 1, self.n - 1))
+            out.append(lo + (hi - lo) * (rank - below))
+        return np.array(out)
+
+
+def _simulate_chunk(task) -> tuple:
+    """
+    Valuta un blocco di campioni e lo riduce a un `_LogHistogram` per ciascuna voce
+    (chat, ingestion, storage, totale).
+    """
+    params, seed_seq, size, rel_error = task
+    rng = np.random.default_rng(seed_seq)
+    breakdown = cost_monthly_user_batch(**_sample_params(params, rng, size))
+    chat = np.broadcast_to(breakdown.chat, (size,))
+    ingestion = np.broadcast_to(breakdown.ingestion, (size,))
+    storage = np.broadcast_to(breakdown.storage, (size,))
+    histograms = tuple(_LogHistogram(rel_error) for _ in _COMPONENTS)
+    for histogram, values in zip(histograms, (chat, ingestion, storage, chat + ingestion + storage)):
+        histogram.add(values)
+    return histograms
+
+
+def simulate_monthly_costs(
+    params: dict,
+    n_samples: int = 1_000_000,
+    seed: int = None,
+    quantiles=(0.5, 0.95, 0.99),
+    chunk_size: int = 250_000,
+    processes: int = 1,
+    quantile_rel_error: float = QUANTILE_REL_ERROR
+) -> dict:
+    """
+    Simulazione Monte Carlo del costo mensile di un utente.
+
+    Parametri:
+    -----------
+    params : dict
+        Parametri keyword di `cost_monthly_user_debug`, dove ogni valore e' un numero
+        oppure una distribuzione (Poisson, LogNormal, Uniform, Empirical).
+    n_samples : int
+        Numero totale di campioni (utenti-mese simulati).
+    seed : int
+        Seme del generatore (None => non riproducibile).
+    quantiles : tuple di float
+        Quantili da calcolare (es. 0.5, 0.95, 0.99).
+    chunk_size : int
+        Campioni generati e valutati per blocco (limita la memoria dei parametri).
+    processes : int
+        Numero di processi su cui distribuire i blocchi (1 => nessun pool).
+    quantile_rel_error : float
+        Errore relativo massimo dei quantili (larghezza relativa dei bin dell'istogramma).
+
+    Solleva ValueError se n_samples < 1 o chunk_size < 1.
+
+    Ritorna:
+    -----------
+    dict
+        {"chat"|"ingestion"|"storage"|"total": {"mean": ..., "p50": ..., "p95": ..., ...}}
+        con i costi in dollari.
+    """
+    if n_samples < 1:
+        raise ValueError(f"n_samples deve essere >= 1: {n_samples}")
+    if chunk_size < 1:
+        raise ValueError(f"chunk_size deve essere >= 1: {chunk_size}")
+    sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(params, seed_seq, size, quantile_rel_error) for seed_seq, size in zip(seeds, sizes)]
+
+    # Ogni blocco e' ridotto a un istogramma per voce: nessun array per campione
+    histograms = tuple(_LogHistogram(quantile_rel_error) for _ in _COMPONENTS)
+    if processes > 1:
+        with ProcessPoolExecutor(max_workers=processes) as pool:
+            chunks = pool.map(_simulate_chunk, tasks)
+            for chunk in chunks:
+                for histogram, part in zip(histograms, chunk):
+                    histogram.merge(part)
+    else:
+        for task in tasks:
+            for histogram, part in zip(histograms, _simulate_chunk(task)):
+                histogram.merge(part)
+
+    result = {}
+    for component, histogram in zip(_COMPONENTS, histograms):
+        stats = {"mean": histogram.total / histogram.n}
+        for q, value in zip(quantiles, histogram.quantiles(quantiles)):
+            stats[f"p{q * 100:g}"] = float(value)
+        result[component] = stats
+    return result
+
+
+if __name__ == "__main__":
+    import time
+
+    mc_params = dict(
+        n_chat=Poisson(8), n_msg_per_chat=Poisson(20), user_tokens_per_msg=LogNormal(100, 0.5),
+        n_kbox_per_msg=1.5, r_per_kbox=5, chunk_size_retrieval=300,
+        out_tokens_per_msg=LogNormal(300, 0.4), fraction_4o=Uniform(0.1, 0.5),
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=Poisson(8), n_img=Poisson(2), n_vid=Poisson(1),
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6,
+        pages_per_doc=Empirical([1, 5, 10, 50, 200], weights=[10, 30, 35, 20, 5]),
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=LogNormal(120, 0.8), sampling_sec_vid=10, vid_width=512, vid_height=512,
+        t_descr_vid_frame=50, c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=LogNormal(0.1, 1.0), c_gb_month=0.25
+    )
+
+    t0 = time.perf_counter()
+    stats = simulate_monthly_costs(mc_params, n_samples=1_000_000, seed=42)
+    elapsed = time.perf_counter() - t0
+    for component, values in stats.items():
+        print(f"{component:>9}: " + ", ".join(f"{k}={v:.4f} $" for k, v in values.items()))
+    print(f"(1.000.000 campioni in {elapsed:.2f}s)")
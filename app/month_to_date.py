@@ -0,0 +1,284 @@
+"""
+File: month_to_date.py
+
+Scopo: costo "month-to-date" per utente aggiornato in modo incrementale, evento per evento,
+       invece di ricalcolare `cost_monthly_user_debug` da zero a ogni messaggio o upload.
+
+`MonthToDateCosts` usa le stesse formule del calcolo mensile (costi unitari tramite le
+cache LRU di `app.price_catalog`) e mantiene per ogni utente una riga di una matrice NumPy
+con le voci di `CostBreakdown` + i GB memorizzati (80 byte per utente): milioni di
+accumulatori vivi occupano poche decine di MB.
+
+Ogni evento (messaggio, upload, variazione dello storage) aggiorna una sola cella in O(1).
+Gli upload cancellati si stornano con `retract_*` (stessi argomenti dell'upload), e lo
+stato completo si salva / ripristina con `snapshot()` / `restore()`.
+
+Gli utenti sono identificati da un indice intero 0..N-1 (la mappatura degli id esterni
+e' a carico del servizio chiamante).
+"""
+
+import numpy as np
+
+from app.cost_breakdown import CostBreakdown
+from app.send_message import average_history_pairs, average_cached_history_tokens
+from app.price_catalog import (
+    cached_cost_of_message,
+    cached_cost_upload_pdf,
+    cached_cost_upload_image,
+    cached_cost_upload_video
+)
+
+
+# Colonne della matrice di stato: voci di CostBreakdown + GB memorizzati
+_COLUMNS = CostBreakdown._fields + ("gb_stored",)
+_COL = {name: i for i, name in enumerate(_COLUMNS)}
+
+
+class MonthToDateCosts:
+    """
+    Accumulatore incrementale del costo del mese corrente per molti utenti.
+
+    Parametri:
+    -----------
+    params : dict
+        Parametri keyword di `cost_monthly_user_debug` (prezzi e dimensioni medie).
+        I conteggi (n_chat, n_doc, ...) e gb_stored_user vengono ignorati: sono gli
+        eventi a determinarli (n_msg_per_chat serve solo con growing_history=True, anche
+        per lo sconto del prompt caching: cached_input_ratio, cache_hit_rate).
+        Le dimensioni di ogni upload possono essere sovrascritte per il singolo
+        evento (es. pages_per_doc=..., img_width=...).
+    n_users : int
+        Capacita' iniziale (la matrice cresce automaticamente).
+    """
+    __slots__ = ("params", "_state", "_unit")
+
+    def __init__(self, params: dict, n_users: int = 0):
+        self.params = dict(params)
+        self._unit = {}  # (tipo evento, variante) -> costo unitario senza override
+        self._state = np.zeros((max(n_users, 1), len(_COLUMNS)), dtype=np.float64)
+
+    def __len__(self) -> int:
+        return self._state.shape[0]
+
+    def _row(self, user: int) -> np.ndarray:
+        if user < 0:
+            raise IndexError(f"Indice utente non valido: {user}")
+        state = self._state
+        if user >= state.shape[0]:
+            grown = np.zeros((max(user + 1, 2 * state.shape[0]), state.shape[1]), dtype=np.float64)
+            grown[:state.shape[0]] = state
+            self._state = state = grown
+        return state[user]
+
+    def _add(self, user: int, column: str, amount: float) -> float:
+        self._row(user)[_COL[column]] += amount
+        return amount
+
+    def _unit_cost(self, cost_fn, variant: str, overrides: dict) -> float:
+        if overrides:
+            return cost_fn(variant, overrides)
+        key = (cost_fn.__name__, variant)
+        unit = self._unit.get(key)
+        if unit is None:
+            unit = self._unit[key] = cost_fn(variant, overrides)
+        return unit
+
+    # ------------------------------------------------------------------
+    # Costi unitari (stesse formule e cache di cost_monthly_user_breakdown)
+    # ------------------------------------------------------------------
+    def _message_cost(self, model: str, overrides: dict) -> float:
+        p = dict(self.params, **overrides) if overrides else self.params
+        # History crescente: numero medio di coppie, come in cost_monthly_user_breakdown
+        max_pairs = p.get("max_pairs", 25)
+        avg_tokens = p.get("avg_tokens_per_message", 100)
+        growing = p.get("growing_history", False)
+        history_pairs = average_history_pairs(p["n_msg_per_chat"], max_pairs) if growing else max_pairs
+        unit = cached_cost_of_message(
+            max_pairs=history_pairs,
+            avg_tokens_per_message=avg_tokens,
+            user_tokens=p["user_tokens_per_msg"],
+            n_kbox=p["n_kbox_per_msg"],
+            r_per_kbox=p["r_per_kbox"],
+            chunk_size=p["chunk_size_retrieval"],
+            out_tokens=p["out_tokens_per_msg"],
+            p_in=p[f"p_in_{model}"],
+            p_out=p[f"p_out_{model}"],
+            c_retrieval=p["c_retrieval"],
+            c_store=p["c_store"]
+        )
+        cached_input_ratio = p.get("cached_input_ratio")
+        if cached_input_ratio is not None and growing:
+            # Sconto del prompt caching sul prefisso di history riusato
+            cached_tokens = average_cached_history_tokens(p["n_msg_per_chat"], max_pairs, avg_tokens)
+            discount = (1.0 - cached_input_ratio) * p.get("cache_hit_rate", 1.0) * cached_tokens / 1000.0
+            unit -= discount * p[f"p_in_{model}"]
+        return unit
+
+    def _pdf_cost(self, pipeline: str, overrides: dict) -> float:
+        p = dict(self.params, **overrides) if overrides else self.params
+        return cached_cost_upload_pdf(
+            n_pages=p["pages_per_doc"],
+            c_page=p[f"c_page_{pipeline}"],
+            t_total=p["t_total_doc"],
+            barT_chunk=p["barT_chunk_doc"],
+            c_embed=p["c_embed_doc"],
+            c_db_chunk=p["c_db_chunk_doc"]
+        )
+
+    def _image_cost(self, model: str, overrides: dict) -> float:
+        p = dict(self.params, **overrides) if overrides else self.params
+        return cached_cost_upload_image(
+            width=p["img_width"],
+            height=p["img_height"],
+            t_descr=p["t_descr_img"],
+            p_in=p[f"p_in_{model}_imgvid"],
+            p_out=p[f"p_out_{model}_imgvid"],
+            c_embed=p["c_embed_img"],
+            c_db_chunk=p["c_db_chunk_img"]
+        )
+
+    def _video_cost(self, model: str, overrides: dict) -> float:
+        p = dict(self.params, **overrides) if overrides else self.params
+        return cached_cost_upload_video(
+            duration_sec=p["dur_sec_vid"],
+            sampling_sec=p["sampling_sec_vid"],
+            width=p["vid_width"],
+            height=p["vid_height"],
+            t_descr=p["t_descr_vid_frame"],
+            p_in=p[f"p_in_{model}_imgvid"],
+            p_out=p[f"p_out_{model}_imgvid"],
+            c_embed=p["c_embed_vid"],
+            c_db_chunk=p["c_db_chunk_vid"],
+            t_descr_total=p["t_descr_vid_total"]
+        )
+
+    # ------------------------------------------------------------------
+    # Eventi (ognuno ritorna l'importo applicato, in dollari)
+    # ------------------------------------------------------------------
+    def add_messages(self, user: int, model: str = "4o", count: int = 1, **overrides) -> float:
+        """`count` messaggi di chat con il modello "4o" o "mini"."""
+        unit = self._unit_cost(self._message_cost, model, overrides)
+        return self._add(user, f"chat_{model}", count * unit)
+
+    def add_pdf(self, user: int, pipeline: str = "hires", count: int = 1, **overrides) -> float:
+        """Upload di `count` documenti con la pipeline "hires" o "fast"."""
+        unit = self._unit_cost(self._pdf_cost, pipeline, overrides)
+        return self._add(user, f"doc_{pipeline}", count * unit)
+
+    def add_image(self, user: int, model: str = "4o", count: int = 1, **overrides) -> float:
+        """Upload di `count` immagini con caption del modello "4o" o "mini"."""
+        unit = self._unit_cost(self._image_cost, model, overrides)
+        return self._add(user, f"img_{model}", count * unit)
+
+    def add_video(self, user: int, model: str = "4o", count: int = 1, **overrides) -> float:
+        """Upload di `count` video con caption del modello "4o" o "mini"."""
+        unit = self._unit_cost(self._video_cost, model, overrides)
+        return self._add(user, f"vid_{model}", count * unit)
+
+    def retract_pdf(self, user: int, pipeline: str = "hires", count: int = 1, **overrides) -> float:
+        """Storna documenti cancellati (stessi argomenti dell'upload)."""
+        return self.add_pdf(user, pipeline, -count, **overrides)
+
+    def retract_image(self, user: int, model: str = "4o", count: int = 1, **overrides) -> float:
+        """Storna immagini cancellate (stessi argomenti dell'upload)."""
+        return self.add_image(user, model, -count, **overrides)
+
+    def retract_video(self, user: int, model: str = "4o", count: int = 1, **overrides) -> float:
+        """Storna video cancellati (stessi argomenti dell'upload)."""
+        return self.add_video(user, model, -count, **overrides)
+
+    def set_storage(self, user: int, gb_stored: float) -> float:
+        """Imposta i GB memorizzati; la voce storage vale gb_stored * c_gb_month."""
+        row = self._row(user)
+        row[_COL["gb_stored"]] = gb_stored
+        row[_COL["storage"]] = storage = gb_stored * self.params["c_gb_month"]
+        return storage
+
+    def add_storage(self, user: int, delta_gb: float) -> float:
+        """Variazione (positiva o negativa) dei GB memorizzati."""
+        return self.set_storage(user, self._row(user)[_COL["gb_stored"]] + delta_gb)
+
+    # ------------------------------------------------------------------
+    # Lettura, cambio mese, snapshot
+    # ------------------------------------------------------------------
+    def breakdown(self, user: int) -> CostBreakdown:
+        """CostBreakdown month-to-date dell'utente."""
+        if user < 0:
+            raise IndexError(f"Indice utente non valido: {user}")
+        if user >= self._state.shape[0]:
+            return CostBreakdown()
+        return CostBreakdown(*self._state[user, :len(CostBreakdown._fields)].tolist())
+
+    def totals(self) -> CostBreakdown:
+        """CostBreakdown di viste sulle colonne (un valore per utente)."""
+        return CostBreakdown(*(self._state[:, i] for i in range(len(CostBreakdown._fields))))
+
+    def start_new_month(self) -> None:
+        """Azzera tutte le voci; lo storage riparte dai GB attualmente memorizzati."""
+        state = self._state
+        state[:, :len(CostBreakdown._fields)] = 0.0
+        state[:, _COL["storage"]] = state[:, _COL["gb_stored"]] * self.params["c_gb_month"]
+
+    def snapshot(self) -> np.ndarray:
+        """Copia dello stato completo (matrice utenti x (voci + GB))."""
+        return self._state.copy()
+
+    def restore(self, snapshot: np.ndarray) -> None:
+        """Ripristina uno stato ottenuto con `snapshot()`."""
+        snapshot = np.asarray(snapshot, dtype=np.float64)
+        if snapshot.ndim != 2 or snapshot.shape[1] != len(_COLUMNS):
+            raise ValueError(f"Snapshot non valido: shape {snapshot.shape}")
+        self._state = snapshot.copy()
+
+
+if __name__ == "__main__":
+    import time
+
+    from app.compute_total_monthly_cost import cost_monthly_user_breakdown
+
+    example_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    mtd = MonthToDateCosts(example_params)
+    # Stessi eventi del mese di esempio: 160 messaggi (48 GPT-4o), 4+4 documenti,
+    # 1+1 immagini, 1 video con GPT-4o Mini, 0.1 GB
+    mtd.add_messages(0, "4o", count=48)
+    mtd.add_messages(0, "mini", count=112)
+    mtd.add_pdf(0, "hires", count=4)
+    mtd.add_pdf(0, "fast", count=4)
+    mtd.add_image(0, "4o")
+    mtd.add_image(0, "mini")
+    mtd.add_video(0, "mini")
+    mtd.set_storage(0, 0.1)
+    expected = cost_monthly_user_breakdown(**example_params).total
+    print(f"Month-to-date = {mtd.breakdown(0).total:.6f} $ (cost_monthly_user = {expected:.6f} $)")
+
+    saved = mtd.snapshot()
+    mtd.add_pdf(0, "hires", pages_per_doc=300, t_total_doc=150_000)
+    print(f"Dopo un PDF da 300 pagine = {mtd.breakdown(0).total:.6f} $")
+    mtd.retract_pdf(0, "hires", pages_per_doc=300, t_total_doc=150_000)
+    print(f"Dopo la cancellazione      = {mtd.breakdown(0).total:.6f} $")
+    mtd.restore(saved)
+
+    n_users, n_events = 1_000_000, 1_000_000
+    mtd = MonthToDateCosts(example_params, n_users=n_users)
+    users = np.random.default_rng(0).integers(0, n_users, n_events).tolist()
+    t0 = time.perf_counter()
+    for user in users:
+        mtd.add_messages(user, "mini")
+    elapsed = time.perf_counter() - t0
+    print(f"{n_events} eventi su {n_users} utenti in {elapsed:.2f}s "
+          f"({n_events / elapsed:,.0f} eventi/s, stato = {mtd.snapshot().nbytes / 1e6:.0f} MB)")
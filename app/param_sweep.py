@@ -0,0 +1,302 @@
+"""
+File: param_sweep.py
+
+Scopo: motore generico di "sweep" dei parametri, al posto dei cicli annidati scritti a mano
+       (run_experiments_pdf_image_video, __main__ di send_message.py).
+
+Una sweep e' descritta da una specifica dichiarativa (dict serializzabile in JSON):
+
+    {
+        "kernel": "cost_upload_image",           # chiave di SWEEP_KERNELS
+        "fixed": {"t_descr": 100, ...},          # parametri costanti
+        "axes": [                                # prodotto cartesiano degli assi
+            {"width": [512, 1024], "height": [512, 1024]},   # parametri che variano insieme
+            {"p_in": [0.005, 0.00015], "p_out": [0.015, 0.0006]}
+        ]
+    }
+
+Ogni asse e' un dict {parametro: lista di valori} con liste della stessa lunghezza: i
+parametri di uno stesso asse variano insieme (zip), gli assi si combinano con il prodotto
+cartesiano (ordine C: l'ultimo asse varia piu' velocemente).
+
+Le righe vengono valutate a blocchi (`chunk_rows`) con i kernel vettorizzati `*_batch`, e
+scritte in un file .npy per colonna (parametri variabili + risultati) nella cartella
+<cache_dir>/<sha256 della specifica>/:
+- content-addressed: una specifica identica riusa la stessa cartella; nell'hash entra
+  anche il sorgente dei moduli che implementano il kernel, per cui una modifica alle
+  formule invalida automaticamente i risultati in cache;
+- riprendibile: dopo ogni blocco si aggiorna progress.json, e una sweep interrotta
+  riparte dal primo blocco mancante;
+- una sweep gia' completa non viene ricalcolata: le colonne si aprono in memory mapping.
+"""
+
+import hashlib
+import importlib
+import inspect
+import json
+import os
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from app.send_message import cost_of_message_batch
+from app.upload_file_in_kbox import (
+    cost_upload_pdf_batch,
+    cost_upload_image_batch,
+    cost_upload_video_batch
+)
+from app.compute_total_monthly_cost import cost_monthly_user_batch
+from app.cost_breakdown import CostBreakdown
+
+
+# Versione del formato su disco (entra nell'hash: cambiarla invalida le cache esistenti)
+SWEEP_FORMAT_VERSION = 1
+
+DEFAULT_CACHE_DIR = os.path.join(".cache", "sweeps")
+DEFAULT_CHUNK_ROWS = 65536
+
+
+def _monthly_columns(**params) -> dict:
+    breakdown = cost_monthly_user_batch(**params)
+    columns = dict(zip(CostBreakdown._fields, breakdown))
+    columns["total"] = breakdown.total
+    return columns
+
+
+# Moduli con le formule dei kernel (il loro sorgente entra nella chiave della cache)
+_MESSAGE_MODULES = ("app.send_message",)
+_UPLOAD_MODULES = ("app.upload_file_in_kbox",)
+_MONTHLY_MODULES = ("app.compute_total_monthly_cost", "app.send_message",
+                    "app.upload_file_in_kbox", "app.price_catalog", "app.cost_breakdown")
+
+# kernel -> (funzione vettorizzata che ritorna {colonna: array}, colonne di output, moduli)
+SWEEP_KERNELS = {
+    "cost_of_message": (
+        lambda **kw: {"cost": cost_of_message_batch(**kw)}, ("cost",), _MESSAGE_MODULES),
+    "cost_upload_pdf": (
+        lambda **kw: {"cost": cost_upload_pdf_batch(**kw)}, ("cost",), _UPLOAD_MODULES),
+    "cost_upload_image": (
+        lambda **kw: {"cost": cost_upload_image_batch(**kw)}, ("cost",), _UPLOAD_MODULES),
+    "cost_upload_video": (
+        lambda **kw: {"cost": cost_upload_video_batch(**kw)}, ("cost",), _UPLOAD_MODULES),
+    "cost_monthly_user": (
+        _monthly_columns, CostBreakdown._fields + ("total",), _MONTHLY_MODULES)
+}
+
+
+class SweepResult(NamedTuple):
+    """
+    path    : cartella della sweep nella cache
+    columns : {nome: array 1-D (memmap in sola lettura)}, parametri variabili e risultati
+    cached  : True se i risultati erano gia' tutti su disco
+    """
+    path: str
+    columns: dict
+    cached: bool
+
+
+@lru_cache(maxsize=None)
+def kernel_code_hash(kernel: str) -> str:
+    """Hash sha256 del sorgente dei moduli che implementano il kernel."""
+    digest = hashlib.sha256()
+    for module_name in SWEEP_KERNELS[kernel][2]:
+        digest.update(module_name.encode("utf-8"))
+        digest.update(inspect.getsource(importlib.import_module(module_name)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def sweep_key(spec: dict) -> str:
+    """
+    Hash sha256 della forma canonica (JSON ordinato) della specifica, della versione del
+    formato e del sorgente del kernel (`kernel_code_hash`).
+    """
+    canonical = json.dumps({"version": SWEEP_FORMAT_VERSION,
+                            "code": kernel_code_hash(spec["kernel"]),
+                            "spec": spec},
+                           sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _axis_lengths(spec: dict) -> list:
+    lengths = []
+    for axis in spec.get("axes", []):
+        sizes = {len(values) for values in axis.values()}
+        if len(sizes) != 1:
+            raise ValueError(f"I parametri di un asse devono avere lo stesso numero di valori: {axis}")
+        lengths.append(sizes.pop())
+    return lengths
+
+
+def _write_progress(path: str, rows_done: int) -> None:
+    tmp = os.path.join(path, "progress.json.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"rows_done": rows_done}, f)
+    os.replace(tmp, os.path.join(path, "progress.json"))
+
+
+def _read_progress(path: str) -> int:
+    try:
+        with open(os.path.join(path, "progress.json"), "r", encoding="utf-8") as f:
+            return json.load(f)["rows_done"]
+    except FileNotFoundError:
+        return 0
+
+
+def run_sweep(
+    spec: dict,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    chunk_rows: int = DEFAULT_CHUNK_ROWS
+) -> SweepResult:
+    """
+    Valuta (o legge dalla cache) tutte le combinazioni di una specifica di sweep.
+
+    Parametri:
+    -----------
+    spec : dict
+        Specifica dichiarativa: "kernel", "fixed", "axes" (vedi docstring del modulo).
+    cache_dir : str
+        Cartella radice della cache su disco.
+    chunk_rows : int
+        Righe valutate (e scritte) per blocco.
+
+    Ritorna:
+    -----------
+    SweepResult
+    """
+    fn, outputs, _ = SWEEP_KERNELS[spec["kernel"]]
+    axes = spec.get("axes", [])
+    lengths = _axis_lengths(spec)
+    n_rows = int(np.prod(lengths, dtype=np.int64))
+    axis_params = [name for axis in axes for name in axis]
+    column_names = axis_params + list(outputs)
+
+    path = os.path.join(cache_dir, sweep_key(spec))
+    rows_done = _read_progress(path)
+    if rows_done >= n_rows and os.path.exists(os.path.join(path, "spec.json")):
+        columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                   for name in column_names}
+        return SweepResult(path=path, columns=columns, cached=True)
+
+    os.makedirs(path, exist_ok=True)
+    with open(os.path.join(path, "spec.json"), "w", encoding="utf-8") as f:
+        json.dump(spec, f, indent=2, sort_keys=True)
+
+    # Colonne preallocate a lunghezza piena: ogni blocco scrive la propria fetta
+    mode = "r+" if rows_done > 0 else "w+"
+    columns = {
+        name: np.lib.format.open_memmap(os.path.join(path, f"{name}.npy"), mode=mode,
+                                        dtype=np.float64, shape=(n_rows,))
+        for name in column_names
+    }
+    axis_values = [{name: np.asarray(values, dtype=np.float64) for name, values in axis.items()}
+                   for axis in axes]
+    fixed = spec.get("fixed", {})
+
+    for start in range(rows_done, n_rows, chunk_rows):
+        stop = min(start + chunk_rows, n_rows)
+        # Senza assi la sweep ha una sola riga, con i soli parametri fissi
+        index = np.unravel_index(np.arange(start, stop), lengths) if lengths else ()
+        params = dict(fixed)
+        for axis_index, axis in zip(index, axis_values):
+            for name, values in axis.items():
+                params[name] = values[axis_index]
+        results = fn(**params)
+        for name in axis_params:
+            columns[name][start:stop] = params[name]
+        for name in outputs:
+            columns[name][start:stop] = results[name]
+        for column in columns.values():
+            column.flush()
+        _write_progress(path, stop)
+
+    if n_rows == 0:
+        _write_progress(path, 0)
+    columns = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+               for name in column_names}
+    return SweepResult(path=path, columns=columns, cached=False)
+
+
+# ----------------------------------------------------------------------
+# Griglie degli esperimenti storici, in forma dichiarativa
+# ----------------------------------------------------------------------
+_MODEL_AXIS = {"p_in": [0.005, 0.00015], "p_out": [0.015, 0.00060]}  # GPT-4o, GPT-4oMini
+_RESOLUTIONS = [512, 1024, 2048]
+_VIDEO_FRAMES = [max(1, int(round(60.0 * rate))) for rate in (1.0, 0.5, 0.2, 0.1)]
+
+# Griglia di run_experiments_pdf_image_video
+EXPERIMENT_SWEEPS = {
+    "pdf": {
+        "kernel": "cost_upload_pdf",
+        "fixed": {"barT_chunk": 500, "c_embed": 0.00002, "c_db_chunk": 7.5e-6},
+        "axes": [
+            {"c_page": [0.01, 0.001]},  # HiRes, Fast
+            {"n_pages": [5, 10, 20, 50, 100], "t_total": [500 * n for n in (5, 10, 20, 50, 100)]}
+        ]
+    },
+    "image": {
+        "kernel": "cost_upload_image",
+        "fixed": {"t_descr": 100, "c_embed": 0.00002, "c_db_chunk": 7.5e-6},
+        "axes": [{"width": _RESOLUTIONS, "height": _RESOLUTIONS}, _MODEL_AXIS]
+    },
+    "video": {
+        "kernel": "cost_upload_video",
+        "fixed": {"duration_sec": 60.0, "t_descr": 50, "c_embed": 0.00002, "c_db_chunk": 7.5e-6},
+        "axes": [
+            {"width": _RESOLUTIONS, "height": _RESOLUTIONS},
+            {"sampling_sec": [60.0 / n for n in _VIDEO_FRAMES],
+             "t_descr_total": [50 * n for n in _VIDEO_FRAMES]},
+            _MODEL_AXIS
+        ]
+    }
+}
+
+# Griglia del __main__ di send_message.py
+MESSAGE_SWEEP = {
+    "kernel": "cost_of_message",
+    "fixed": {"avg_tokens_per_message": 100, "user_tokens": 50, "chunk_size": 300,
+              "out_tokens": 300, "c_retrieval": 1e-5, "c_store": 1e-5},
+    "axes": [{"max_pairs": [10, 20, 30]}, {"n_kbox": [1, 2, 3]},
+             {"r_per_kbox": [5, 10, 15]}, _MODEL_AXIS]
+}
+
+
+if __name__ == "__main__":
+    import time
+
+    for name, spec in list(EXPERIMENT_SWEEPS.items()) + [("message", MESSAGE_SWEEP)]:
+        result = run_sweep(spec)
+        cost = result.columns["cost"]
+        print(f"[{name}] {cost.size} combinazioni, min={cost.min():.6f} $, max={cost.max():.6f} $ "
+              f"({'cache' if result.cached else 'calcolate'})")
+
+    # Sweep grande del costo mensile: la seconda esecuzione legge solo la cache
+    big_spec = {
+        "kernel": "cost_monthly_user",
+        "fixed": dict(
+            n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+            r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300,
+            p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+            c_retrieval=1e-5, c_store=1e-5, n_img=2, n_vid=1,
+            c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+            barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+            fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+            p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+            img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+            dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+            c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+            gb_stored_user=0.1, c_gb_month=0.25
+        ),
+        "axes": [
+            {"fraction_4o": [i / 100 for i in range(101)]},
+            {"n_doc": list(range(100))},
+            {"fraction_hires": [i / 100 for i in range(101)]}
+        ]
+    }
+    for attempt in (1, 2):
+        t0 = time.perf_counter()
+        result = run_sweep(big_spec)
+        total = result.columns["total"]
+        elapsed = time.perf_counter() - t0
+        print(f"[monthly] run {attempt}: {total.size} righe, costo medio={total.mean():.4f} $ "
+              f"in {elapsed:.3f}s ({'cache' if result.cached else 'calcolate'})")
@@ -0,0 +1,275 @@
+"""
+File: price_catalog.py
+
+Scopo: raccogliere in un unico catalogo versionato tutti i prezzi usati dal modello
+       di costo (modelli LLM, pipeline Unstructured, embedding, DB, storage,
+       retrieval/store) e fornire una cache LRU limitata dei costi unitari derivati
+       (costo di un messaggio, di un'immagine, di un video, di un documento).
+
+I costi unitari sono memorizzati con `functools.lru_cache`, la cui chiave e' l'insieme
+completo dei parametri (modello/prezzi compresi): esecuzioni massive su molti tenant
+con parametri ricorrenti riusano i valori gia' calcolati. `unit_cost_cache_info()`
+espone hit/miss di ciascuna cache.
+"""
+
+from functools import lru_cache
+from typing import NamedTuple
+
+from app.send_message import cost_of_message
+from app.upload_file_in_kbox import (
+    cost_upload_pdf,
+    cost_upload_image,
+    cost_upload_video
+)
+
+
+# Numero massimo di costi unitari memorizzati per ciascuna funzione
+UNIT_COST_CACHE_SIZE = 4096
+
+# Catalogo prezzi per versione (prezzi LLM/embedding in $ per 1k token)
+PRICE_CATALOGS = {
+    "2024-07": {
+        "models": {
+            "GPT-4o":     {"p_in": 0.005,   "p_out": 0.015},
+            "GPT-4oMini": {"p_in": 0.00015, "p_out": 0.00060}
+        },
+        "pipelines": {
+            "HiRes": 0.01,
+            "Fast": 0.001
+        },
+        "c_embed": 0.00002,
+        "c_db_chunk": 7.5e-6,
+        "c_gb_month": 0.25,
+        "c_retrieval": 1e-5,
+        "c_store": 1e-5
+    }
+}
+
+LATEST_PRICE_VERSION = "2024-07"
+
+
+class PriceCatalog(NamedTuple):
+    """Prezzi di una specifica versione del catalogo."""
+    version: str
+    models: dict
+    pipelines: dict
+    c_embed: float
+    c_db_chunk: float
+    c_gb_month: float
+    c_retrieval: float
+    c_store: float
+
+
+@lru_cache(maxsize=None)
+def get_price_catalog(version: str = None) -> PriceCatalog:
+    """
+    Ritorna il catalogo prezzi della versione richiesta (default: l'ultima).
+
+    Parametri:
+    -----------
+    version : str
+        Chiave di PRICE_CATALOGS (es. "2024-07").
+
+    Ritorna:
+    -----------
+    PriceCatalog
+    """
+    version = LATEST_PRICE_VERSION if version is None else version
+    if version not in PRICE_CATALOGS:
+        raise KeyError(f"Versione del catalogo prezzi sconosciuta: {version!r}")
+    return PriceCatalog(version=version, **PRICE_CATALOGS[version])
+
+
+def monthly_price_kwargs(
+    catalog: PriceCatalog,
+    chat_model_4o: str = "GPT-4o",
+    chat_model_mini: str = "GPT-4oMini",
+    imgvid_model_4o: str = "GPT-4o",
+    imgvid_model_mini: str = "GPT-4oMini",
+    pipeline_hires: str = "HiRes",
+    pipeline_fast: str = "Fast"
+) -> dict:
+    """
+    Traduce un catalogo nei parametri di prezzo "sciolti" di `cost_monthly_user_debug`
+    (p_in_4o, p_out_mini, c_page_hires, c_embed_doc, c_gb_month, ...).
+
+    Ritorna:
+    -----------
+    dict
+        Parametri keyword da combinare con quelli di utilizzo dell'utente.
+    """
+    m = catalog.models
+    return dict(
+        p_in_4o=m[chat_model_4o]["p_in"],
+        p_out_4o=m[chat_model_4o]["p_out"],
+        p_in_mini=m[chat_model_mini]["p_in"],
+        p_out_mini=m[chat_model_mini]["p_out"],
+        c_retrieval=catalog.c_retrieval,
+        c_store=catalog.c_store,
+        c_page_hires=catalog.pipelines[pipeline_hires],
+        c_page_fast=catalog.pipelines[pipeline_fast],
+        c_embed_doc=catalog.c_embed,
+        c_db_chunk_doc=catalog.c_db_chunk,
+        p_in_4o_imgvid=m[imgvid_model_4o]["p_in"],
+        p_out_4o_imgvid=m[imgvid_model_4o]["p_out"],
+        p_in_mini_imgvid=m[imgvid_model_mini]["p_in"],
+        p_out_mini_imgvid=m[imgvid_model_mini]["p_out"],
+        c_embed_img=catalog.c_embed,
+        c_db_chunk_img=catalog.c_db_chunk,
+        c_embed_vid=catalog.c_embed,
+        c_db_chunk_vid=catalog.c_db_chunk,
+        c_gb_month=catalog.c_gb_month
+    )
+
+
+# ---------------------------------------------------------------------------
+# Cache LRU dei costi unitari: stesse firme delle funzioni originali
+# (la chiave comprende tutti i parametri, prezzi inclusi).
+# ---------------------------------------------------------------------------
+
+cached_cost_of_message = lru_cache(maxsize=UNIT_COST_CACHE_SIZE)(cost_of_message)
+cached_cost_upload_pdf = lru_cache(maxsize=UNIT_COST_CACHE_SIZE)(cost_upload_pdf)
+cached_cost_upload_image = lru_cache(maxsize=UNIT_COST_CACHE_SIZE)(cost_upload_image)
+cached_cost_upload_video = lru_cache(maxsize=UNIT_COST_CACHE_SIZE)(cost_upload_video)
+
+_UNIT_COST_CACHES = {
+    "message": cached_cost_of_message,
+    "pdf": cached_cost_upload_pdf,
+    "image": cached_cost_upload_image,
+    "video": cached_cost_upload_video
+}
+
+
+def unit_cost_cache_info() -> dict:
+    """
+    Ritorna {nome: CacheInfo(hits, misses, maxsize, currsize)} per ciascuna cache
+    dei costi unitari.
+    """
+    return {name: fn.cache_info() for name, fn in _UNIT_COST_CACHES.items()}
+
+
+def clear_unit_cost_cache() -> None:
+    """Svuota tutte le cache dei costi unitari (e azzera i contatori hit/miss)."""
+    for fn in _UNIT_COST_CACHES.values():
+        fn.cache_clear()
+
+
+# ---------------------------------------------------------------------------
+# Costi unitari per nome di modello/pipeline, risolti tramite il catalogo
+# ---------------------------------------------------------------------------
+
+def unit_cost_message(
+    model: str,
+    max_pairs: int,
+    avg_tokens_per_message: int,
+    user_tokens: float,
+    n_kbox: float,
+    r_per_kbox: float,
+    chunk_size: float,
+    out_tokens: float,
+    version: str = None
+) -> float:
+    """
+    Costo (cache) di un singolo messaggio con il modello `model` del catalogo `version`.
+    """
+    catalog = get_price_catalog(version)
+    prices = catalog.models[model]
+    return cached_cost_of_message(
+        max_pairs=max_pairs,
+        avg_tokens_per_message=avg_tokens_per_message,
+        user_tokens=user_tokens,
+        n_kbox=n_kbox,
+        r_per_kbox=r_per_kbox,
+        chunk_size=chunk_size,
+        out_tokens=out_tokens,
+        p_in=prices["p_in"],
+        p_out=prices["p_out"],
+        c_retrieval=catalog.c_retrieval,
+        c_store=catalog.c_store
+    )
+
+
+def unit_cost_pdf(
+    pipeline: str,
+    n_pages: int,
+    t_total: float,
+    barT_chunk: float,
+    version: str = None
+) -> float:
+    """
+    Costo (cache) di un documento con la pipeline `pipeline` del catalogo `version`.
+    """
+    catalog = get_price_catalog(version)
+    return cached_cost_upload_pdf(
+        n_pages=n_pages,
+        c_page=catalog.pipelines[pipeline],
+        t_total=t_total,
+        barT_chunk=barT_chunk,
+        c_embed=catalog.c_embed,
+        c_db_chunk=catalog.c_db_chunk
+    )
+
+
+def unit_cost_image(
+    model: str,
+    width: int,
+    height: int,
+    t_descr: float,
+    version: str = None
+) -> float:
+    """
+    Costo (cache) di un'immagine di risoluzione width x height, caption con `model`.
+    """
+    catalog = get_price_catalog(version)
+    prices = catalog.models[model]
+    return cached_cost_upload_image(
+        width=width,
+        height=height,
+        t_descr=t_descr,
+        p_in=prices["p_in"],
+        p_out=prices["p_out"],
+        c_embed=catalog.c_embed,
+        c_db_chunk=catalog.c_db_chunk
+    )
+
+
+def unit_cost_video(
+    model: str,
+    duration_sec: float,
+    sampling_sec: float,
+    width: int,
+    height: int,
+    t_descr: float,
+    t_descr_total: float,
+    version: str = None
+) -> float:
+    """
+    Costo (cache) di un video, caption dei frame con `model`.
+    """
+    catalog = get_price_catalog(version)
+    prices = catalog.models[model]
+    return cached_cost_upload_video(
+        duration_sec=duration_sec,
+        sampling_sec=sampling_sec,
+        width=width,
+        height=height,
+        t_descr=t_descr,
+        p_in=prices["p_in"],
+        p_out=prices["p_out"],
+        c_embed=catalog.c_embed,
+        c_db_chunk=catalog.c_db_chunk,
+        t_descr_total=t_descr_total
+    )
+
+
+if __name__ == "__main__":
+    catalog = get_price_catalog()
+    print(f"Catalogo prezzi versione {catalog.version}: modelli={list(catalog.models)}, "
+          f"pipeline={list(catalog.pipelines)}")
+
+    for _ in range(3):
+        for model in catalog.models:
+            for res in (512, 1024, 2048):
+                unit_cost_image(model, res, res, t_descr=100)
+    for name, info in unit_cost_cache_info().items():
+        print(f"  cache {name}: hits={info.hits}, misses={info.misses}, size={info.currsize}")
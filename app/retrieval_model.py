@@ -0,0 +1,338 @@
+"""
+File: retrieval_model.py
+
+Scopo: modello dello stadio di retrieval (RAG) di un messaggio, da cui derivare i token di
+       contesto effettivamente inseriti nel prompt.
+
+`cost_of_message` tratta il retrieval come un costo fisso `c_retrieval` piu'
+n_kbox * r_per_kbox * chunk_size token di contesto. La pipeline reale invece:
+- interroga n_kbox KBox (ricerca vettoriale), ognuna con un proprio costo e latenza;
+- scarta i candidati duplicati tra KBox diverse (overlap_ratio);
+- opzionalmente fa il rerank dei candidati unici (costo e latenza per candidato) e
+  tiene solo i primi `rerank_top_k`;
+- taglia il contesto al budget di token del prompt (max_context_tokens), a chunk interi.
+
+Per messaggio:
+    candidati     = n_kbox * r_per_kbox
+    unici         = candidati * (1 - overlap_ratio)
+    nel prompt    = min(unici, rerank_top_k, floor(max_context_tokens / chunk_size))
+    T_context     = nel prompt * chunk_size
+    C_retrieval   = c_query_fixed + n_kbox * c_query_kbox + unici * c_rerank_candidate
+
+Senza overlap, reranker e tetto di token, T_context coincide con
+n_kbox * r_per_kbox * chunk_size e `cost_of_message_rag` con `cost_of_message`.
+"""
+
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+from app.send_message import cost_of_message, cost_of_message_batch
+
+
+class RetrievalStage(NamedTuple):
+    """
+    n_candidates   : chunk restituiti dalle KBox (n_kbox * r_per_kbox)
+    n_unique       : candidati dopo la dedup tra KBox
+    n_in_prompt    : chunk inseriti nel prompt (dopo rerank top-k e tetto di token)
+    context_tokens : token di contesto nel prompt (n_in_prompt * chunk_size)
+    cost           : costo dello stadio di retrieval (query + rerank), in dollari
+    latency_ms     : latenza dello stadio di retrieval, in millisecondi
+    """
+    n_candidates: float
+    n_unique: float
+    n_in_prompt: float
+    context_tokens: float
+    cost: float
+    latency_ms: float
+
+
+def retrieval_stage(
+    n_kbox: float,
+    r_per_kbox: float,
+    chunk_size: float,
+    overlap_ratio: float = 0.0,
+    rerank_top_k: float = None,
+    max_context_tokens: float = None,
+    c_query_fixed: float = 0.0,
+    c_query_kbox: float = 0.0,
+    c_rerank_candidate: float = 0.0,
+    latency_query_fixed_ms: float = 0.0,
+    latency_query_kbox_ms: float = 0.0,
+    latency_rerank_candidate_ms: float = 0.0,
+    parallel_kbox: bool = True
+) -> RetrievalStage:
+    """
+    Calcola candidati, token di contesto, costo e latenza dello stadio di retrieval.
+
+    Parametri:
+    -----------
+    n_kbox : float
+        Numero medio di KBox interrogate (es. 1.5).
+    r_per_kbox : float
+        Numero di chunk restituiti per ogni KBox (es. 5).
+    chunk_size : float
+        Lunghezza media (in token) di un chunk (es. 300), positiva.
+    overlap_ratio : float
+        Frazione dei candidati scartata come duplicata tra KBox diverse (0..1).
+    rerank_top_k : float
+        Se indicato, i candidati unici passano dal reranker e nel prompt entrano
+        solo i primi `rerank_top_k`; se None nessun reranker.
+    max_context_tokens : float
+        Se indicato, budget di token di contesto nel prompt: entrano solo i chunk
+        interi che ci stanno.
+    c_query_fixed : float
+        Costo fisso per messaggio (es. embedding della query), in dollari.
+    c_query_kbox : float
+        Costo di una query vettoriale su una KBox, in dollari.
+    c_rerank_candidate : float
+        Costo del rerank di un candidato, in dollari (solo con `rerank_top_k`).
+    latency_query_fixed_ms, latency_query_kbox_ms, latency_rerank_candidate_ms : float
+        Latenze (in ms) corrispondenti ai tre costi.
+    parallel_kbox : bool
+        Se True le KBox sono interrogate in parallelo (la latenza di query e' quella di
+        una KBox), altrimenti in sequenza (n_kbox * latency_query_kbox_ms).
+
+    Solleva ValueError se chunk_size <= 0 o overlap_ratio e' fuori da [0, 1].
+
+    Ritorna:
+    -----------
+    RetrievalStage
+    """
+    if not chunk_size > 0:
+        raise ValueError("chunk_size deve essere positivo")
+    if not 0.0 <= overlap_ratio <= 1.0:
+        raise ValueError("overlap_ratio deve essere compreso tra 0 e 1")
+
+    n_candidates = n_kbox * r_per_kbox
+    n_unique = n_candidates * (1.0 - overlap_ratio)
+
+    n_in_prompt = n_unique
+    cost = c_query_fixed + n_kbox * c_query_kbox
+    if parallel_kbox:
+        latency_ms = latency_query_fixed_ms + (latency_query_kbox_ms if n_kbox > 0 else 0.0)
+    else:
+        latency_ms = latency_query_fixed_ms + n_kbox * latency_query_kbox_ms
+
+    if rerank_top_k is not None:
+        n_in_prompt = min(n_in_prompt, rerank_top_k)
+        cost += n_unique * c_rerank_candidate
+        latency_ms += n_unique * latency_rerank_candidate_ms
+
+    if max_context_tokens is not None:
+        n_in_prompt = min(n_in_prompt, math.floor(max_context_tokens / chunk_size))
+
+    return RetrievalStage(
+        n_candidates=n_candidates,
+        n_unique=n_unique,
+        n_in_prompt=n_in_prompt,
+        context_tokens=n_in_prompt * chunk_size,
+        cost=cost,
+        latency_ms=latency_ms
+    )
+
+
+def retrieval_stage_batch(
+    n_kbox,
+    r_per_kbox,
+    chunk_size,
+    overlap_ratio=0.0,
+    rerank_top_k=None,
+    max_context_tokens=None,
+    c_query_fixed=0.0,
+    c_query_kbox=0.0,
+    c_rerank_candidate=0.0,
+    latency_query_fixed_ms=0.0,
+    latency_query_kbox_ms=0.0,
+    latency_rerank_candidate_ms=0.0,
+    parallel_kbox=True
+) -> RetrievalStage:
+    """
+    Versione vettorizzata (NumPy) di `retrieval_stage`.
+
+    Ogni parametro numerico puo' essere uno scalare oppure un array broadcastabile.
+    In `rerank_top_k` e `max_context_tokens` il valore NaN (per elemento) o None
+    (per tutti) indica "nessun reranker" / "nessun tetto", cosi' che in un'unica
+    griglia si possano confrontare configurazioni con e senza reranker.
+
+    Parametri:
+    -----------
+    Gli stessi di `retrieval_stage` (scalari o array broadcastabili), con gli stessi
+    vincoli su chunk_size e overlap_ratio verificati su ogni elemento.
+
+    Ritorna:
+    -----------
+    RetrievalStage
+        Con un array (float64) in ogni campo, di shape pari al broadcast degli input.
+    """
+    chunk_size = np.asarray(chunk_size, dtype=np.float64)
+    overlap_ratio = np.asarray(overlap_ratio, dtype=np.float64)
+    if not np.all(chunk_size > 0):
+        raise ValueError("chunk_size deve essere positivo")
+    if not np.all((overlap_ratio >= 0.0) & (overlap_ratio <= 1.0)):
+        raise ValueError("overlap_ratio deve essere compreso tra 0 e 1")
+
+    n_kbox = np.asarray(n_kbox, dtype=np.float64)
+    n_candidates = n_kbox * r_per_kbox
+    n_unique = n_candidates * (1.0 - overlap_ratio)
+
+    n_in_prompt = n_unique
+    cost = c_query_fixed + n_kbox * c_query_kbox
+    if parallel_kbox:
+        latency_ms = latency_query_fixed_ms + np.where(n_kbox > 0, latency_query_kbox_ms, 0.0)
+    else:
+        latency_ms = latency_query_fixed_ms + n_kbox * latency_query_kbox_ms
+
+    if rerank_top_k is not None:
+        rerank_top_k = np.asarray(rerank_top_k, dtype=np.float64)
+        reranked = ~np.isnan(rerank_top_k)
+        n_in_prompt = np.where(reranked, np.fmin(n_in_prompt, rerank_top_k), n_in_prompt)
+        cost = cost + np.where(reranked, n_unique * c_rerank_candidate, 0.0)
+        latency_ms = latency_ms + np.where(reranked, n_unique * latency_rerank_candidate_ms, 0.0)
+
+    if max_context_tokens is not None:
+        max_chunks = np.floor(np.divide(max_context_tokens, chunk_size, dtype=np.float64))
+        n_in_prompt = np.fmin(n_in_prompt, max_chunks)
+
+    shape = np.broadcast_shapes(np.shape(n_in_prompt), np.shape(chunk_size), np.shape(cost),
+                                np.shape(latency_ms))
+    return RetrievalStage(
+        n_candidates=np.broadcast_to(n_candidates, shape),
+        n_unique=np.broadcast_to(n_unique, shape),
+        n_in_prompt=np.broadcast_to(n_in_prompt, shape),
+        context_tokens=np.broadcast_to(n_in_prompt * chunk_size, shape),
+        cost=np.broadcast_to(np.asarray(cost, dtype=np.float64), shape),
+        latency_ms=np.broadcast_to(np.asarray(latency_ms, dtype=np.float64), shape)
+    )
+
+
+def cost_of_message_rag(
+    max_pairs: int,
+    avg_tokens_per_message: int,
+    user_tokens: float,
+    n_kbox: float,
+    r_per_kbox: float,
+    chunk_size: float,
+    out_tokens: float,
+    p_in: float,
+    p_out: float,
+    c_retrieval: float,
+    c_store: float,
+    history_tokens: float = None,
+    breakdown: str = None,
+    **retrieval
+):
+    """
+    Costo di un messaggio con lo stadio di retrieval esplicito: i token di contesto
+    sono derivati da `retrieval_stage` e il suo costo si somma a `c_retrieval`.
+
+    Parametri:
+    -----------
+    max_pairs, ..., breakdown :
+        Come in `cost_of_message`; `c_retrieval` resta il costo fisso di retrieval non
+        coperto dallo stadio (es. lettura dei chunk).
+    **retrieval :
+        Parametri opzionali di `retrieval_stage` (overlap_ratio, rerank_top_k,
+        max_context_tokens, c_query_kbox, c_rerank_candidate, latenze, ...).
+
+    Ritorna:
+    -----------
+    (costo, RetrievalStage)
+        Costo del messaggio in dollari (o `CostBreakdown` se `breakdown` e' indicato)
+        e dettaglio dello stadio di retrieval.
+    """
+    stage = retrieval_stage(n_kbox, r_per_kbox, chunk_size, **retrieval)
+    cost = cost_of_message(
+        max_pairs=max_pairs,
+        avg_tokens_per_message=avg_tokens_per_message,
+        user_tokens=user_tokens,
+        n_kbox=n_kbox,
+        r_per_kbox=r_per_kbox,
+        chunk_size=chunk_size,
+        out_tokens=out_tokens,
+        p_in=p_in,
+        p_out=p_out,
+        c_retrieval=c_retrieval + stage.cost,
+        c_store=c_store,
+        history_tokens=history_tokens,
+        breakdown=breakdown,
+        retrieval_tokens=stage.context_tokens
+    )
+    return cost, stage
+
+
+def cost_of_message_rag_batch(
+    max_pairs,
+    avg_tokens_per_message,
+    user_tokens,
+    n_kbox,
+    r_per_kbox,
+    chunk_size,
+    out_tokens,
+    p_in,
+    p_out,
+    c_retrieval,
+    c_store,
+    history_tokens=None,
+    **retrieval
+):
+    """
+    Versione vettorizzata (NumPy) di `cost_of_message_rag`.
+
+    Parametri:
+    -----------
+    Gli stessi di `cost_of_message_rag` (scalari o array broadcastabili), con i
+    parametri di `retrieval_stage_batch` in **retrieval.
+
+    Ritorna:
+    -----------
+    (np.ndarray, RetrievalStage)
+        Costo per messaggio di ogni combinazione e dettaglio dello stadio di retrieval.
+    """
+    stage = retrieval_stage_batch(n_kbox, r_per_kbox, chunk_size, **retrieval)
+    cost = cost_of_message_batch(
+        max_pairs=max_pairs,
+        avg_tokens_per_message=avg_tokens_per_message,
+        user_tokens=user_tokens,
+        n_kbox=n_kbox,
+        r_per_kbox=r_per_kbox,
+        chunk_size=chunk_size,
+        out_tokens=out_tokens,
+        p_in=p_in,
+        p_out=p_out,
+        c_retrieval=c_retrieval + stage.cost,
+        c_store=c_store,
+        history_tokens=history_tokens,
+        retrieval_tokens=stage.context_tokens
+    )
+    return cost, stage
+
+
+if __name__ == "__main__":
+    message_kwargs = dict(max_pairs=5, avg_tokens_per_message=300, user_tokens=100,
+                          n_kbox=1.5, chunk_size=300, out_tokens=300,
+                          p_in=0.005, p_out=0.015, c_retrieval=1e-5, c_store=1e-5)
+
+    # Coerenza con il modello originale (niente overlap, reranker o tetto)
+    rag_cost, _ = cost_of_message_rag(r_per_kbox=5, **message_kwargs)
+    base_cost = cost_of_message(r_per_kbox=5, **message_kwargs)
+    print(f"Senza stadio esplicito: {rag_cost:.6f} $ (cost_of_message = {base_cost:.6f} $)")
+
+    # Trade-off costo / dimensione del prompt (GPT-4o): r_per_kbox da 1 a 20, senza e con
+    # reranker (top-8, 0.00002 $ e 1 ms per candidato), 20% di overlap, tetto di 3000 token
+    retrieval = dict(overlap_ratio=0.2, max_context_tokens=3000,
+                     c_query_kbox=2e-5, latency_query_fixed_ms=30.0, latency_query_kbox_ms=40.0,
+                     c_rerank_candidate=2e-5, latency_rerank_candidate_ms=1.0)
+    r_values = np.array([1, 2, 3, 5, 8, 12, 20], dtype=np.float64)
+    rerank = np.array([np.nan, 8.0])[:, None]
+    cost, stage = cost_of_message_rag_batch(r_per_kbox=r_values[None, :], rerank_top_k=rerank,
+                                            **retrieval, **message_kwargs)
+
+    print(f"{'r_per_kbox':>10} | {'reranker':>8} | {'chunk prompt':>12} | {'T_context':>9} | "
+          f"{'latenza ms':>10} | {'costo msg $':>11}")
+    for i, label in enumerate(["no", "top-8"]):
+        for j, r in enumerate(r_values):
+            print(f"{r:>10.0f} | {label:>8} | {stage.n_in_prompt[i, j]:>12.2f} | "
+                  f"{stage.context_tokens[i, j]:>9.0f} | {stage.latency_ms[i, j]:>10.1f} | "
+                  f"{cost[i, j]:>11.6f}")
@@ -1,3 +1,11 @@
+import io
+import math
+
+import numpy as np
+
+from app.cost_breakdown import CostBreakdown
+
+
 def calculate_history_tokens(max_pairs: int,
                              avg_tokens_per_message: int) -> float:
     """
@@ -45,23 +53,50 @@ def build_history_text(max_pairs: int,
         Una stringa che simula l'intero contenuto di 'history' più il messaggio utente finale.
     """
 
-    lines = []
-    for i in range(max_pairs):
-        # Messaggio utente fittizio (placeholder)
-        user_msg = f"[USER_{i+1}] " + ("x " * avg_tokens_per_message)
-        # Messaggio AI fittizio (placeholder)
-        bot_msg = f"[BOT_{i+1}] " + ("y " * avg_tokens_per_message)
+    # I blocchi di riempimento sono identici per tutti i messaggi: li costruiamo
+    # una sola volta e scriviamo tutto in un unico buffer.
+    buffer = io.StringIO()
+    for chunk in iter_history_text(max_pairs, avg_tokens_per_message, user_input_text):
+        buffer.write(chunk)
+    return buffer.getvalue()
 
-        lines.append(user_msg)
-        lines.append(bot_msg)
 
-    # Aggiunge il messaggio di input effettivo alla fine (messaggio "corrente")
-    final_user_input = "[USER_INPUT] " + user_input_text
+def iter_history_text(max_pairs: int,
+                      avg_tokens_per_message: int,
+                      user_input_text: str,
+                      pairs_per_chunk: int = 256):
+    """
+    Variante "streaming" di `build_history_text`: produce la stessa history
+    a blocchi di (al massimo) `pairs_per_chunk` coppie, cosi' che history molto
+    grandi non debbano mai stare interamente in memoria.
+
+    La concatenazione dei blocchi prodotti e' identica a `build_history_text(...)`.
+
+    Parametri:
+    -----------
+    max_pairs, avg_tokens_per_message, user_input_text :
+        Come in `build_history_text`.
+    pairs_per_chunk : int
+        Numero di coppie (utente+AI) per blocco prodotto.
+
+    Ritorna:
+    -----------
+    generator di str
+        Blocchi consecutivi del testo di history.
+    """
+    # Riempitivi costruiti una sola volta (placeholder di avg_tokens_per_message token)
+    user_filler = "x " * avg_tokens_per_message
+    bot_filler = "y " * avg_tokens_per_message
 
-    lines.append(final_user_input)
+    for start in range(0, max_pairs, pairs_per_chunk):
+        stop = min(start + pairs_per_chunk, max_pairs)
+        yield "".join(
+            f"[USER_{i}] {user_filler}\n[BOT_{i}] {bot_filler}\n"
+            for i in range(start + 1, stop + 1)
+        )
 
-    # Unisce tutto con newline
-    return "\n".join(lines)
+    # Messaggio di input effettivo alla fine (messaggio "corrente")
+    yield "[USER_INPUT] " + user_input_text
 
 
 def cost_of_message(
@@ -79,7 +114,13 @@ def cost_of_message(
     p_out: float,
     # ---- costi retrieval e store ----
     c_retrieval: float,
-    c_store: float
+    c_store: float,
+    # ---- token di history gia' contati (opzionale) ----
+    history_tokens: float = None,
+    # ---- risultato strutturato (opzionale) ----
+    breakdown: str = None,
+    # ---- token di contesto gia' derivati dallo stadio di retrieval (opzionale) ----
+    retrieval_tokens: float = None
 ) -> float:
     """
     Calcola il costo di un singolo messaggio (turno domanda+risposta) secondo
@@ -110,6 +151,17 @@ def cost_of_message(
         Costo fisso per retrieval (embedding query, query vettoriale, lettura chunk).
     c_store : float
         Costo fisso per salvare conversazione (scritture DB, eventuale embedding conversazione).
+    history_tokens : float
+        Se indicato, numero reale di token della history (es. da
+        `token_counter.ConversationHistory`), usato al posto della stima
+        `calculate_history_tokens(max_pairs, avg_tokens_per_message)`.
+    breakdown : str
+        Se indicato (es. "chat_4o" o "chat_mini"), ritorna un `CostBreakdown` con il
+        costo assegnato a quella voce invece di un float.
+    retrieval_tokens : float
+        Se indicato, token di contesto effettivamente inseriti nel prompt (es. da
+        `retrieval_model.retrieval_stage`, dopo dedup, rerank e tetto di token),
+        usati al posto di n_kbox * r_per_kbox * chunk_size.
 
     Ritorna:
     -----------
@@ -121,19 +173,251 @@ def cost_of_message(
                 + c_retrieval + c_store
     """
 
-    # Calcola i token dovuti allo storico, usando la funzione dedicata:
-    history_tokens = calculate_history_tokens(max_pairs, avg_tokens_per_message)
+    # Calcola i token dovuti allo storico, usando la funzione dedicata
+    # (a meno che non siano gia' stati contati sulla history reale):
+    if history_tokens is None:
+        history_tokens = calculate_history_tokens(max_pairs, avg_tokens_per_message)
+
+    # Token di contesto del retrieval (a meno che non siano gia' stati derivati)
+    if retrieval_tokens is None:
+        retrieval_tokens = n_kbox * r_per_kbox * chunk_size
 
     # Calcolo dei token totali di input
-    t_in = history_tokens + user_tokens + (n_kbox * r_per_kbox * chunk_size)
+    t_in = history_tokens + user_tokens + retrieval_tokens
 
     # Costo LLM = (token_in/1000 * p_in) + (token_out/1000 * p_out)
     cost_llm = (t_in / 1000.0) * p_in + (out_tokens / 1000.0) * p_out
 
     # Somma costi retrieval + store
     cost_total = cost_llm + c_retrieval + c_store
+    if breakdown is not None:
+        return CostBreakdown(**{breakdown: cost_total})
     return cost_total
 
+def average_history_pairs(n_msg_per_chat: int, max_pairs: int) -> float:
+    """
+    Numero medio di coppie presenti nella history durante una chat che parte vuota
+    e cresce di una coppia per messaggio, fino alla finestra di `max_pairs` coppie.
+
+    Al turno k (k = 0 .. n_msg_per_chat-1) la history contiene min(k, max_pairs) coppie;
+    la somma si calcola in forma chiusa:
+
+        n <= P:  sum = n (n - 1) / 2
+        n >  P:  sum = P (P - 1) / 2 + (n - P) P
+
+    Parametri:
+    -----------
+    n_msg_per_chat : int
+        Numero di messaggi (turni) della chat.
+    max_pairs : int
+        Dimensione massima della finestra di history (coppie utente+AI).
+
+    Ritorna:
+    -----------
+    float
+        sum_k min(k, max_pairs) / n_msg_per_chat (0.0 per una chat vuota).
+    """
+    n = n_msg_per_chat
+    if n <= 0:
+        return 0.0
+    if n <= max_pairs:
+        total_pairs = n * (n - 1) / 2.0
+    else:
+        total_pairs = max_pairs * (max_pairs - 1) / 2.0 + (n - max_pairs) * max_pairs
+    return total_pairs / n
+
+
+def average_history_pairs_batch(n_msg_per_chat, max_pairs) -> np.ndarray:
+    """
+    Versione vettorizzata di `average_history_pairs` (array broadcastabili).
+    """
+    n = np.asarray(n_msg_per_chat, dtype=np.float64)
+    p = np.asarray(max_pairs, dtype=np.float64)
+    total_pairs = np.where(n <= p, n * (n - 1) / 2.0, p * (p - 1) / 2.0 + (n - p) * p)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(n > 0, total_pairs / np.where(n > 0, n, 1.0), 0.0)
+
+
+# Lunghezza minima (in token) di un prefisso perche' il provider lo metta in cache
+PROMPT_CACHE_MIN_TOKENS = 1024
+
+
+def average_cached_history_tokens(
+    n_msg_per_chat: int,
+    max_pairs: int,
+    avg_tokens_per_message: int,
+    min_cached_tokens: float = PROMPT_CACHE_MIN_TOKENS
+) -> float:
+    """
+    Numero medio, per messaggio, di token di input riletti dalla cache del provider
+    (prompt caching) in una chat che parte vuota, con la history in testa al prompt.
+
+    Al turno k il prompt inizia con la history del turno precedente: se la finestra non
+    e' ancora piena (1 <= k <= max_pairs) il prefisso riusato vale 2 (k - 1) avg token,
+    e conta solo se supera `min_cached_tokens`. Quando la finestra scorre (k > max_pairs)
+    la coppia piu' vecchia esce dal prompt, il prefisso cambia e non c'e' riuso.
+
+    Con m = min(n - 1, P) e j0 = ceil(min_cached_tokens / (2 avg)), in forma chiusa:
+
+        sum_k cached_k = sum_{j=j0}^{m-1} 2 avg j = avg (m (m - 1) - j0 (j0 - 1))   (se m > j0)
+
+    Parametri:
+    -----------
+    n_msg_per_chat : int
+        Numero di messaggi (turni) della chat.
+    max_pairs : int
+        Dimensione massima della finestra di history (coppie utente+AI).
+    avg_tokens_per_message : int
+        Token medi per messaggio nella history.
+    min_cached_tokens : float
+        Prefisso minimo messo in cache dal provider.
+
+    Ritorna:
+    -----------
+    float
+        Token in cache medi per messaggio (0.0 per una chat vuota).
+    """
+    n = n_msg_per_chat
+    if n <= 0 or avg_tokens_per_message <= 0:
+        return 0.0
+    m = min(n - 1, max_pairs)
+    j0 = math.ceil(min_cached_tokens / (2.0 * avg_tokens_per_message))
+    if m <= j0:
+        return 0.0
+    return avg_tokens_per_message * (m * (m - 1) - j0 * (j0 - 1)) / n
+
+
+def average_cached_history_tokens_batch(
+    n_msg_per_chat,
+    max_pairs,
+    avg_tokens_per_message,
+    min_cached_tokens=PROMPT_CACHE_MIN_TOKENS
+) -> np.ndarray:
+    """
+    Versione vettorizzata di `average_cached_history_tokens` (array broadcastabili).
+    """
+    n = np.asarray(n_msg_per_chat, dtype=np.float64)
+    a = np.asarray(avg_tokens_per_message, dtype=np.float64)
+    m = np.minimum(n - 1, max_pairs)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        j0 = np.ceil(min_cached_tokens / (2.0 * a))
+        cached = a * (m * (m - 1) - j0 * (j0 - 1)) / np.where(n > 0, n, 1.0)
+        return np.where((n > 0) & (a > 0) & (m > j0), cached, 0.0)
+
+
+def cost_of_chat(
+    n_msg_per_chat: int,
+    max_pairs: int,
+    avg_tokens_per_message: int,
+    user_tokens: float,
+    n_kbox: float,
+    r_per_kbox: float,
+    chunk_size: float,
+    out_tokens: float,
+    p_in: float,
+    p_out: float,
+    c_retrieval: float,
+    c_store: float,
+    breakdown: str = None
+) -> float:
+    """
+    Costo esatto di un'intera chat di `n_msg_per_chat` messaggi in cui la history
+    parte vuota e cresce fino a `max_pairs` coppie (finestra scorrevole), invece
+    di assumere la history sempre piena come `cost_of_message`.
+
+    Poiche' il costo di un messaggio e' affine nel numero di coppie di history,
+    la somma sui turni equivale a n_msg_per_chat messaggi con history pari al
+    numero medio di coppie (`average_history_pairs`): il calcolo e' O(1).
+
+    Parametri:
+    -----------
+    n_msg_per_chat : int
+        Numero di messaggi della chat.
+    Gli altri parametri sono quelli di `cost_of_message`.
+
+    Ritorna:
+    -----------
+    float
+        Costo totale della chat in dollari (o un `CostBreakdown` se `breakdown` e' indicato).
+    """
+    cost_avg_message = cost_of_message(
+        max_pairs=average_history_pairs(n_msg_per_chat, max_pairs),
+        avg_tokens_per_message=avg_tokens_per_message,
+        user_tokens=user_tokens,
+        n_kbox=n_kbox,
+        r_per_kbox=r_per_kbox,
+        chunk_size=chunk_size,
+        out_tokens=out_tokens,
+        p_in=p_in,
+        p_out=p_out,
+        c_retrieval=c_retrieval,
+        c_store=c_store,
+        breakdown=breakdown
+    )
+    return n_msg_per_chat * cost_avg_message
+
+
+def cost_of_message_batch(
+    max_pairs,
+    avg_tokens_per_message,
+    user_tokens,
+    n_kbox,
+    r_per_kbox,
+    chunk_size,
+    out_tokens,
+    p_in,
+    p_out,
+    c_retrieval,
+    c_store,
+    history_tokens=None,
+    retrieval_tokens=None
+) -> np.ndarray:
+    """
+    Versione vettorizzata (NumPy) di `cost_of_message`.
+
+    Ogni parametro puo' essere uno scalare oppure un array (o una colonna) NumPy;
+    gli input vengono combinati secondo le regole di broadcasting di NumPy, per cui
+    e' possibile valutare in un'unica chiamata intere griglie di parametri
+    (es. milioni di combinazioni max_pairs x n_kbox x r_per_kbox x modello).
+
+    Le operazioni sono eseguite nello stesso ordine della versione scalare, in
+    float64, per cui i risultati coincidono elemento per elemento con quelli
+    di `cost_of_message`.
+
+    Parametri:
+    -----------
+    Gli stessi di `cost_of_message` (scalari o array broadcastabili),
+    compresi gli opzionali `history_tokens` e `retrieval_tokens`.
+
+    Ritorna:
+    -----------
+    np.ndarray
+        Array (float64) con il costo in dollari di ogni combinazione, di shape
+        pari al broadcast delle shape di input.
+    """
+    if history_tokens is None:
+        max_pairs = np.asarray(max_pairs, dtype=np.float64)
+        avg_tokens_per_message = np.asarray(avg_tokens_per_message, dtype=np.float64)
+
+        # T_history = 2 * max_pairs * avg_tokens_per_message
+        history_tokens = 2.0 * max_pairs * avg_tokens_per_message
+    else:
+        history_tokens = np.asarray(history_tokens, dtype=np.float64)
+
+    # T_in = T_history + user_tokens + (n_kbox * r_per_kbox * chunk_size)
+    if retrieval_tokens is None:
+        retrieval_tokens = np.multiply(np.multiply(n_kbox, r_per_kbox, dtype=np.float64),
+                                       chunk_size, dtype=np.float64)
+    else:
+        retrieval_tokens = np.asarray(retrieval_tokens, dtype=np.float64)
+    t_in = history_tokens + user_tokens + retrieval_tokens
+
+    # Costo LLM + costi fissi retrieval/store
+    cost_llm = (t_in / 1000.0) * p_in + (np.asarray(out_tokens, dtype=np.float64) / 1000.0) * p_out
+    cost_total = cost_llm + c_retrieval + c_store
+    return np.asarray(cost_total, dtype=np.float64)
+
+
 if __name__ == "__main__":
     # Esempio di costruzione di una history di prova (parametri fissi)
     simulated_history = build_history_text(
@@ -193,3 +477,27 @@ if __name__ == "__main__":
                           f"n_kbox={n_kbox_ex}, r_per_kbox={r_per_kbox_ex}, "
                           f"model={model_name} => costo={cost_example:.6f} $")
     print("\n*** Fine combinazioni ***\n")
+
+    # Stessa griglia valutata in un'unica chiamata vettorizzata
+    model_names = list(models.keys())
+    grid_pairs, grid_kbox, grid_r, grid_model = np.meshgrid(
+        max_pairs_list, n_kbox_list, r_per_kbox_list, np.arange(len(model_names)),
+        indexing="ij"
+    )
+    p_in_arr = np.array([models[m]["p_in"] for m in model_names])[grid_model]
+    p_out_arr = np.array([models[m]["p_out"] for m in model_names])[grid_model]
+    costs_grid = cost_of_message_batch(
+        max_pairs=grid_pairs,
+        avg_tokens_per_message=avg_tokens_per_msg,
+        user_tokens=user_tokens_ex,
+        n_kbox=grid_kbox,
+        r_per_kbox=grid_r,
+        chunk_size=chunk_size_ex,
+        out_tokens=out_tokens_ex,
+        p_in=p_in_arr,
+        p_out=p_out_arr,
+        c_retrieval=c_retr_ex,
+        c_store=c_store_ex
+    )
+    print(f"cost_of_message_batch -> {costs_grid.size} combinazioni, "
+          f"min={costs_grid.min():.6f} $, max={costs_grid.max():.6f} $")
@@ -0,0 +1,306 @@
+"""
+File: sensitivity.py
+
+Scopo: analisi di sensitivita' del costo mensile di un utente. Invece di ricalcolare
+       `cost_monthly_user_debug` perturbando un parametro alla volta, si calcolano in
+       un'unica passata le derivate parziali analitiche e le elasticita'
+       (d costo / d x * x / costo) rispetto a ogni parametro di input.
+
+Tutte le formule sono vettorizzate: ogni parametro puo' essere un array (un valore per
+tenant), e il risultato contiene un array di derivate per parametro.
+
+Funzioni a gradini (regole a tratti):
+- ceil(t_total / barT_chunk) in `cost_upload_pdf` e ceil(duration_sec / sampling_sec)
+  in `cost_upload_video`, e gli arrotondamenti int(round(...)) dei conteggi per bucket
+  (doc Hi-Res/Fast, img/video GPT-4o/Mini) sono costanti a tratti.
+  - relax_steps=False: derivate esatte quasi ovunque, cioe' 0 per il contributo dei gradini
+    (all'interno di un tratto il numero di chunk/frame/doc per bucket non cambia);
+  - relax_steps=True (default): i gradini vengono sostituiti dalla loro pendenza media
+    (ceil(x) -> x, round(n * f) -> n * f), utile per la pianificazione della capacita',
+    dove interessa l'effetto medio di una variazione.
+- Con il prompt caching (cached_input_ratio e growing_history=True) lo sconto dipende dai
+  token riusati in una chat, a (m (m - 1) - j0 (j0 - 1)) con m = min(n - 1, P) e
+  j0 = ceil(PROMPT_CACHE_MIN_TOKENS / (2 a)): j0 e' trattato come gli altri gradini
+  (costante a tratti, oppure ceil(x) -> x con relax_steps=True).
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+from app.compute_total_monthly_cost import cost_monthly_user_batch
+from app.send_message import PROMPT_CACHE_MIN_TOKENS
+
+
+# Token equivalenti per pixel (stesso rapporto di tokens_for_resolution)
+_TOKENS_PER_PX = 255.0 / (512.0 * 512.0)
+
+
+class CostSensitivity(NamedTuple):
+    """
+    total      : costo mensile (esatto) in dollari
+    gradient   : {parametro: d costo / d parametro}
+    elasticity : {parametro: d costo / d parametro * parametro / costo}
+    """
+    total: np.ndarray
+    gradient: dict
+    elasticity: dict
+
+
+def monthly_cost_sensitivity(relax_steps: bool = True, **params) -> CostSensitivity:
+    """
+    Derivate parziali analitiche ed elasticita' del costo mensile rispetto a tutti
+    i parametri di `cost_monthly_user_debug`.
+
+    Parametri:
+    -----------
+    relax_steps : bool
+        Trattamento dei gradini (ceil e arrotondamenti dei conteggi), vedi docstring
+        del modulo.
+    **params :
+        Parametri keyword di `cost_monthly_user_debug` (scalari o array, uno per tenant),
+        inclusi gli opzionali max_pairs, avg_tokens_per_message, growing_history,
+        cached_input_ratio e cache_hit_rate.
+
+    Ritorna:
+    -----------
+    CostSensitivity
+    """
+    p = {k: (v if k == "growing_history" else np.asarray(v, dtype=np.float64))
+         for k, v in params.items() if v is not None}
+    max_pairs = p.get("max_pairs", np.float64(25))
+    avg_tokens = p.get("avg_tokens_per_message", np.float64(100))
+    growing = bool(params.get("growing_history", False))
+
+    g = {}
+
+    # ------------------------------------------------------------------
+    # 1) Chat
+    # ------------------------------------------------------------------
+    n_chat, n_msg = p["n_chat"], p["n_msg_per_chat"]
+    f = p["fraction_4o"]
+    msgs = n_chat * n_msg
+
+    if growing:
+        # P_bar(n, P) = (n - 1) / 2              se n <= P
+        #             = P - P (P + 1) / (2 n)    se n >  P
+        with np.errstate(divide="ignore", invalid="ignore"):
+            safe_n = np.where(n_msg > 0, n_msg, 1.0)
+            short = n_msg <= max_pairs
+            pairs = np.where(n_msg > 0,
+                             np.where(short, (n_msg - 1) / 2.0,
+                                      max_pairs - max_pairs * (max_pairs + 1) / (2.0 * safe_n)),
+                             0.0)
+            d_pairs_d_n = np.where(short, 0.5, max_pairs * (max_pairs + 1) / (2.0 * safe_n ** 2))
+            d_pairs_d_p = np.where(short, 0.0, 1.0 - (2.0 * max_pairs + 1) / (2.0 * safe_n))
+    else:
+        pairs = max_pairs
+        d_pairs_d_n = 0.0
+        d_pairs_d_p = 1.0
+
+    retrieval_tokens = p["n_kbox_per_msg"] * p["r_per_kbox"] * p["chunk_size_retrieval"]
+    t_in = 2.0 * pairs * avg_tokens + p["user_tokens_per_msg"] + retrieval_tokens
+    t_out = p["out_tokens_per_msg"]
+    c_fixed = p["c_retrieval"] + p["c_store"]
+    c_4o = t_in / 1000.0 * p["p_in_4o"] + t_out / 1000.0 * p["p_out_4o"] + c_fixed
+    c_mini = t_in / 1000.0 * p["p_in_mini"] + t_out / 1000.0 * p["p_out_mini"] + c_fixed
+    c_mix = f * c_4o + (1.0 - f) * c_mini
+    p_in_mix = f * p["p_in_4o"] + (1.0 - f) * p["p_in_mini"]
+    p_out_mix = f * p["p_out_4o"] + (1.0 - f) * p["p_out_mini"]
+    d_tin = msgs * p_in_mix / 1000.0  # d chat / d T_in
+
+    g["n_chat"] = n_msg * c_mix
+    g["n_msg_per_chat"] = n_chat * c_mix + d_tin * 2.0 * avg_tokens * d_pairs_d_n
+    g["user_tokens_per_msg"] = d_tin
+    g["n_kbox_per_msg"] = d_tin * p["r_per_kbox"] * p["chunk_size_retrieval"]
+    g["r_per_kbox"] = d_tin * p["n_kbox_per_msg"] * p["chunk_size_retrieval"]
+    g["chunk_size_retrieval"] = d_tin * p["n_kbox_per_msg"] * p["r_per_kbox"]
+    g["out_tokens_per_msg"] = msgs * p_out_mix / 1000.0
+    g["fraction_4o"] = msgs * (c_4o - c_mini)
+    g["p_in_4o"] = msgs * f * t_in / 1000.0
+    g["p_out_4o"] = msgs * f * t_out / 1000.0
+    g["p_in_mini"] = msgs * (1.0 - f) * t_in / 1000.0
+    g["p_out_mini"] = msgs * (1.0 - f) * t_out / 1000.0
+    g["c_retrieval"] = msgs
+    g["c_store"] = msgs
+    g["max_pairs"] = d_tin * 2.0 * avg_tokens * d_pairs_d_p
+    g["avg_tokens_per_message"] = d_tin * 2.0 * pairs
+
+    # Prompt caching: sconto = n_chat * reused * p_in_mix * (1 - ratio) * hit_rate / 1000,
+    # con reused = token di input riletti dalla cache in una chat
+    g["cached_input_ratio"] = 0.0
+    g["cache_hit_rate"] = 0.0
+    if "cached_input_ratio" in p and growing:
+        ratio = p["cached_input_ratio"]
+        hit_rate = p.get("cache_hit_rate", np.float64(1.0))
+        m = np.minimum(n_msg - 1, max_pairs)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x = PROMPT_CACHE_MIN_TOKENS / (2.0 * avg_tokens)
+        j0 = x if relax_steps else np.ceil(x)
+        active = (n_msg > 0) & (avg_tokens > 0) & (m > j0)
+        reused = np.where(active, avg_tokens * (m * (m - 1) - j0 * (j0 - 1)), 0.0)
+        d_reused_d_m = np.where(active, avg_tokens * (2.0 * m - 1), 0.0)
+        d_reused_d_a = np.where(active, m * (m - 1) - j0 * (j0 - 1)
+                                + (x * (2.0 * x - 1) if relax_steps else 0.0), 0.0)
+        window_growing = n_msg - 1 <= max_pairs
+        saved = (1.0 - ratio) * hit_rate / 1000.0   # frazione di p_in risparmiata, per token
+        k = n_chat * p_in_mix * saved               # d sconto / d reused
+
+        g["n_chat"] = g["n_chat"] - reused * p_in_mix * saved
+        g["n_msg_per_chat"] = g["n_msg_per_chat"] - k * np.where(window_growing, d_reused_d_m, 0.0)
+        g["max_pairs"] = g["max_pairs"] - k * np.where(window_growing, 0.0, d_reused_d_m)
+        g["avg_tokens_per_message"] = g["avg_tokens_per_message"] - k * d_reused_d_a
+        g["fraction_4o"] = g["fraction_4o"] - n_chat * reused * (p["p_in_4o"] - p["p_in_mini"]) * saved
+        g["p_in_4o"] = g["p_in_4o"] - n_chat * reused * f * saved
+        g["p_in_mini"] = g["p_in_mini"] - n_chat * reused * (1.0 - f) * saved
+        g["cached_input_ratio"] = n_chat * reused * p_in_mix * hit_rate / 1000.0
+        g["cache_hit_rate"] = -n_chat * reused * p_in_mix * (1.0 - ratio) / 1000.0
+
+    # ------------------------------------------------------------------
+    # Conteggi per bucket: esatti (rint, pendenza 0) o rilassati (n * f)
+    # ------------------------------------------------------------------
+    def split(n, frac):
+        if relax_steps:
+            return n * frac, frac, n
+        return np.rint(n * frac), 0.0, 0.0
+
+    # ------------------------------------------------------------------
+    # 2a) Documenti
+    # ------------------------------------------------------------------
+    n_doc, f_hires = p["n_doc"], p["fraction_hires"]
+    q_hires, dq_hires_dn, dq_hires_df = split(n_doc, f_hires)
+    q_fast = n_doc - q_hires
+    t_total, bar_t = p["t_total_doc"], p["barT_chunk_doc"]
+    if relax_steps:
+        n_chunk = t_total / bar_t
+        dchunk_dt, dchunk_dbar = 1.0 / bar_t, -t_total / bar_t ** 2
+    else:
+        n_chunk = np.ceil(t_total / bar_t)
+        dchunk_dt, dchunk_dbar = 0.0, 0.0
+    per_chunk = bar_t / 1000.0 * p["c_embed_doc"] + p["c_db_chunk_doc"]
+    pages = p["pages_per_doc"]
+    u_hires = pages * p["c_page_hires"] + n_chunk * per_chunk
+    u_fast = pages * p["c_page_fast"] + n_chunk * per_chunk
+
+    g["n_doc"] = dq_hires_dn * u_hires + (1.0 - dq_hires_dn) * u_fast
+    g["fraction_hires"] = dq_hires_df * (u_hires - u_fast)
+    g["c_page_hires"] = q_hires * pages
+    g["c_page_fast"] = q_fast * pages
+    g["pages_per_doc"] = q_hires * p["c_page_hires"] + q_fast * p["c_page_fast"]
+    g["t_total_doc"] = n_doc * per_chunk * dchunk_dt
+    g["barT_chunk_doc"] = n_doc * (dchunk_dbar * per_chunk + n_chunk * p["c_embed_doc"] / 1000.0)
+    g["c_embed_doc"] = n_doc * n_chunk * bar_t / 1000.0
+    g["c_db_chunk_doc"] = n_doc * n_chunk
+
+    # ------------------------------------------------------------------
+    # 2b) Immagini
+    # ------------------------------------------------------------------
+    f_iv = p["fraction_4o_imgvid"]
+    n_img = p["n_img"]
+    q_img_4o, dq_img_dn, dq_img_df = split(n_img, f_iv)
+    q_img_mini = n_img - q_img_4o
+    w_img, h_img, t_descr = p["img_width"], p["img_height"], p["t_descr_img"]
+    t_img = w_img * h_img * _TOKENS_PER_PX
+    img_tail = t_descr / 1000.0 * p["c_embed_img"] + p["c_db_chunk_img"]
+    u_img_4o = t_img / 1000.0 * p["p_in_4o_imgvid"] + t_descr / 1000.0 * p["p_out_4o_imgvid"] + img_tail
+    u_img_mini = t_img / 1000.0 * p["p_in_mini_imgvid"] + t_descr / 1000.0 * p["p_out_mini_imgvid"] + img_tail
+    img_p_in = q_img_4o * p["p_in_4o_imgvid"] + q_img_mini * p["p_in_mini_imgvid"]
+    img_p_out = q_img_4o * p["p_out_4o_imgvid"] + q_img_mini * p["p_out_mini_imgvid"]
+
+    g["n_img"] = dq_img_dn * u_img_4o + (1.0 - dq_img_dn) * u_img_mini
+    g["img_width"] = img_p_in * h_img * _TOKENS_PER_PX / 1000.0
+    g["img_height"] = img_p_in * w_img * _TOKENS_PER_PX / 1000.0
+    g["t_descr_img"] = (img_p_out + n_img * p["c_embed_img"]) / 1000.0
+    g["c_embed_img"] = n_img * t_descr / 1000.0
+    g["c_db_chunk_img"] = n_img
+
+    # ------------------------------------------------------------------
+    # 2c) Video
+    # ------------------------------------------------------------------
+    n_vid = p["n_vid"]
+    q_vid_4o, dq_vid_dn, dq_vid_df = split(n_vid, f_iv)
+    q_vid_mini = n_vid - q_vid_4o
+    dur, samp = p["dur_sec_vid"], p["sampling_sec_vid"]
+    if relax_steps:
+        n_frame = dur / samp
+        dframe_ddur, dframe_dsamp = 1.0 / samp, -dur / samp ** 2
+    else:
+        n_frame = np.ceil(dur / samp)
+        dframe_ddur, dframe_dsamp = 0.0, 0.0
+    w_vid, h_vid, t_frame = p["vid_width"], p["vid_height"], p["t_descr_vid_frame"]
+    t_vid = w_vid * h_vid * _TOKENS_PER_PX
+    frame_4o = t_vid / 1000.0 * p["p_in_4o_imgvid"] + t_frame / 1000.0 * p["p_out_4o_imgvid"]
+    frame_mini = t_vid / 1000.0 * p["p_in_mini_imgvid"] + t_frame / 1000.0 * p["p_out_mini_imgvid"]
+    vid_tail = p["t_descr_vid_total"] / 1000.0 * p["c_embed_vid"] + p["c_db_chunk_vid"]
+    u_vid_4o = n_frame * frame_4o + vid_tail
+    u_vid_mini = n_frame * frame_mini + vid_tail
+    frames_llm = q_vid_4o * frame_4o + q_vid_mini * frame_mini
+    vid_p_in = q_vid_4o * p["p_in_4o_imgvid"] + q_vid_mini * p["p_in_mini_imgvid"]
+    vid_p_out = q_vid_4o * p["p_out_4o_imgvid"] + q_vid_mini * p["p_out_mini_imgvid"]
+
+    g["n_vid"] = dq_vid_dn * u_vid_4o + (1.0 - dq_vid_dn) * u_vid_mini
+    g["dur_sec_vid"] = frames_llm * dframe_ddur
+    g["sampling_sec_vid"] = frames_llm * dframe_dsamp
+    g["vid_width"] = n_frame * vid_p_in * h_vid * _TOKENS_PER_PX / 1000.0
+    g["vid_height"] = n_frame * vid_p_in * w_vid * _TOKENS_PER_PX / 1000.0
+    g["t_descr_vid_frame"] = n_frame * vid_p_out / 1000.0
+    g["c_embed_vid"] = n_vid * p["t_descr_vid_total"] / 1000.0
+    g["c_db_chunk_vid"] = n_vid
+    g["t_descr_vid_total"] = n_vid * p["c_embed_vid"] / 1000.0
+
+    # Parametri condivisi tra immagini e video
+    g["fraction_4o_imgvid"] = dq_img_df * (u_img_4o - u_img_mini) + dq_vid_df * (u_vid_4o - u_vid_mini)
+    g["p_in_4o_imgvid"] = (q_img_4o * t_img + q_vid_4o * n_frame * t_vid) / 1000.0
+    g["p_out_4o_imgvid"] = (q_img_4o * t_descr + q_vid_4o * n_frame * t_frame) / 1000.0
+    g["p_in_mini_imgvid"] = (q_img_mini * t_img + q_vid_mini * n_frame * t_vid) / 1000.0
+    g["p_out_mini_imgvid"] = (q_img_mini * t_descr + q_vid_mini * n_frame * t_frame) / 1000.0
+
+    # ------------------------------------------------------------------
+    # 3) Storage
+    # ------------------------------------------------------------------
+    g["gb_stored_user"] = p["c_gb_month"]
+    g["c_gb_month"] = p["gb_stored_user"]
+
+    total = cost_monthly_user_batch(**params).total
+    gradient = {}
+    elasticity = {}
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for name, d in g.items():
+            if name not in p:
+                continue
+            gradient[name] = np.broadcast_to(np.asarray(d, dtype=np.float64), total.shape)
+            elasticity[name] = np.where(total != 0, gradient[name] * p[name] / total, 0.0)
+    return CostSensitivity(total=total, gradient=gradient, elasticity=elasticity)
+
+
+if __name__ == "__main__":
+    example_params = dict(
+        n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+        r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+        p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+        c_retrieval=1e-5, c_store=1e-5,
+        n_doc=8, n_img=2, n_vid=1,
+        fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+        barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+        fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+        p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+        img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+        dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+        c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+        gb_stored_user=0.1, c_gb_month=0.25
+    )
+
+    sens = monthly_cost_sensitivity(**example_params)
+    print(f"Costo mensile = {float(sens.total):.6f} $")
+    print("Parametri ordinati per |elasticita'|:")
+    ranking = sorted(sens.elasticity.items(), key=lambda kv: -abs(float(kv[1])))
+    for name, e in ranking[:12]:
+        print(f"  {name:<24} elasticita'={float(e):+.4f}  d$/dx={float(sens.gradient[name]):+.6g}")
+
+    # Con history crescente e prompt caching (sconto sul prefisso di history riusato)
+    sens = monthly_cost_sensitivity(growing_history=True, cached_input_ratio=0.5,
+                                    cache_hit_rate=0.8, **example_params)
+    print(f"\nCon prompt caching: costo mensile = {float(sens.total):.6f} $")
+    for name in ("n_msg_per_chat", "cached_input_ratio", "cache_hit_rate"):
+        print(f"  {name:<24} elasticita'={float(sens.elasticity[name]):+.4f}  "
+              f"d$/dx={float(sens.gradient[name]):+.6g}")
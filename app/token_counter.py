@@ -0,0 +1,222 @@
+"""
+File: token_counter.py
+
+Scopo: contare i token "reali" di una history di chat invece di usare
+       l'approssimazione 2 * max_pairs * avg_tokens_per_message di
+       `calculate_history_tokens`.
+
+Contatori disponibili (stessa interfaccia: `count(text) -> int`):
+- BPETokenCounter: tokenizer BPE offline, con vocabolario caricato da un file locale
+  nel formato "<token in base64> <rank>" per riga (formato dei file .tiktoken).
+- HeuristicTokenCounter: fallback senza vocabolario; conta i pre-token
+  (parole, numeri, punteggiatura), che per testo inglese/italiano e' una buona
+  stima dal basso del numero di token BPE.
+
+`ConversationHistory` memorizza il numero di token di ogni messaggio e le somme
+prefisse: aggiungere un turno costa O(nuovo messaggio) e i token della finestra
+degli ultimi `max_pairs` turni si leggono in O(1), da passare a
+`cost_of_message(..., history_tokens=...)`.
+"""
+
+import base64
+import os
+import re
+from functools import lru_cache
+
+from app.send_message import cost_of_message
+
+
+# Pre-tokenizzazione in stile GPT-2 (versione senza classi Unicode \p{..})
+_PRETOKEN_PATTERN = re.compile(
+    r"""'s|'t|'re|'ve|'m|'ll|'d| ?[^\W\d_]+| ?\d+| ?[^\s\w]+|\s+(?!\S)|\s+"""
+)
+
+# Separatore tra messaggi usato da `build_history_text`
+HISTORY_SEPARATOR = "\n"
+
+# Numero massimo di pre-token distinti memorizzati dal tokenizer BPE
+PRETOKEN_CACHE_SIZE = 65536
+
+
+class HeuristicTokenCounter:
+    """
+    Stima del numero di token senza vocabolario: un token per pre-token
+    (parola, numero, gruppo di punteggiatura, blocco di spazi).
+    """
+    __slots__ = ()
+
+    def count(self, text: str) -> int:
+        return sum(1 for _ in _PRETOKEN_PATTERN.finditer(text))
+
+
+class BPETokenCounter:
+    """
+    Tokenizer BPE byte-level offline. Le regole di merge sono date dal rank dei
+    token nel vocabolario: a ogni passo si fonde la coppia adiacente il cui
+    concatenato ha rank minimo, finche' nessuna coppia e' nel vocabolario.
+
+    Il conteggio di ogni pre-token e' memorizzato in una cache LRU: le parole
+    ricorrenti di una conversazione vengono tokenizzate una sola volta.
+    """
+    __slots__ = ("ranks", "_count_piece")
+
+    def __init__(self, ranks: dict):
+        self.ranks = ranks
+        self._count_piece = lru_cache(maxsize=PRETOKEN_CACHE_SIZE)(self._bpe_count)
+
+    @classmethod
+    def from_file(cls, path: str) -> "BPETokenCounter":
+        """
+        Carica il vocabolario da un file locale con righe "<token base64> <rank>".
+        """
+        ranks = {}
+        with open(path, "rb") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                token_b64, rank = line.split()
+                ranks[base64.b64decode(token_b64)] = int(rank)
+        return cls(ranks)
+
+    def _bpe_count(self, piece: bytes) -> int:
+        ranks = self.ranks
+        if piece in ranks:
+            return 1
+        parts = [piece[i:i + 1] for i in range(len(piece))]
+        while len(parts) > 1:
+            best_rank = None
+            best_i = -1
+            for i in range(len(parts) - 1):
+                rank = ranks.get(parts[i] + parts[i + 1])
+                if rank is not None and (best_rank is None or rank < best_rank):
+                    best_rank = rank
+                    best_i = i
+            if best_rank is None:
+                break
+            parts[best_i:best_i + 2] = [parts[best_i] + parts[best_i + 1]]
+        return len(parts)
+
+    def count(self, text: str) -> int:
+        count_piece = self._count_piece
+        return sum(count_piece(m.group().encode("utf-8"))
+                   for m in _PRETOKEN_PATTERN.finditer(text))
+
+
+def get_token_counter(vocab_path: str = None):
+    """
+    Ritorna un BPETokenCounter se `vocab_path` indica un file esistente,
+    altrimenti il contatore euristico di fallback.
+    """
+    if vocab_path and os.path.exists(vocab_path):
+        return BPETokenCounter.from_file(vocab_path)
+    return HeuristicTokenCounter()
+
+
+class ConversationHistory:
+    """
+    History di una chat con conteggio incrementale dei token.
+
+    Per ogni messaggio si conta una sola volta il testo nuovo (piu' il separatore)
+    e si aggiorna la somma prefissa; i token degli ultimi `max_pairs` turni si
+    ottengono come differenza di due somme prefisse, in O(1).
+    """
+    __slots__ = ("counter", "_prefix", "_separator_tokens")
+
+    def __init__(self, counter=None):
+        self.counter = HeuristicTokenCounter() if counter is None else counter
+        self._prefix = [0]  # _prefix[k] = token dei primi k messaggi
+        self._separator_tokens = self.counter.count(HISTORY_SEPARATOR)
+
+    def __len__(self) -> int:
+        return len(self._prefix) - 1
+
+    def append(self, message: str) -> int:
+        """Aggiunge un messaggio e ritorna i suoi token (separatore incluso)."""
+        n_tokens = self.counter.count(message) + self._separator_tokens
+        self._prefix.append(self._prefix[-1] + n_tokens)
+        return n_tokens
+
+    def add_turn(self, user_message: str, bot_message: str) -> None:
+        """Aggiunge una coppia utente + AI."""
+        self.append(user_message)
+        self.append(bot_message)
+
+    def history_tokens(self, max_pairs: int = None) -> int:
+        """
+        Token della history: tutti i messaggi, oppure solo gli ultimi `max_pairs`
+        coppie se indicato (finestra scorrevole).
+        """
+        n_messages = len(self)
+        if max_pairs is None or 2 * max_pairs >= n_messages:
+            return self._prefix[-1]
+        return self._prefix[-1] - self._prefix[n_messages - 2 * max_pairs]
+
+    def cost_next_message(
+        self,
+        user_message: str,
+        max_pairs: int,
+        n_kbox: float,
+        r_per_kbox: float,
+        chunk_size: float,
+        out_tokens: float,
+        p_in: float,
+        p_out: float,
+        c_retrieval: float,
+        c_store: float
+    ) -> float:
+        """
+        Costo del prossimo turno: history reale (finestra di `max_pairs` coppie)
+        + token reali del messaggio utente, tramite `cost_of_message`.
+        """
+        return cost_of_message(
+            max_pairs=max_pairs,
+            avg_tokens_per_message=0,
+            user_tokens=self.counter.count(user_message),
+            n_kbox=n_kbox,
+            r_per_kbox=r_per_kbox,
+            chunk_size=chunk_size,
+            out_tokens=out_tokens,
+            p_in=p_in,
+            p_out=p_out,
+            c_retrieval=c_retrieval,
+            c_store=c_store,
+            history_tokens=self.history_tokens(max_pairs)
+        )
+
+
+def count_history_tokens(messages, counter=None) -> int:
+    """
+    Conta i token di una history data come lista di messaggi (nell'ordine),
+    con lo stesso separatore di `build_history_text`.
+    """
+    history = ConversationHistory(counter)
+    for message in messages:
+        history.append(message)
+    return history.history_tokens()
+
+
+if __name__ == "__main__":
+    from app.send_message import build_history_text, calculate_history_tokens
+
+    counter = get_token_counter(os.environ.get("BPE_VOCAB_PATH"))
+    print(f"Contatore token: {type(counter).__name__}")
+
+    text = build_history_text(max_pairs=25, avg_tokens_per_message=100,
+                              user_input_text="Questo è il messaggio utente corrente")
+    print(f"Token history (stima 2*pairs*avg) = {calculate_history_tokens(25, 100):.0f}")
+    print(f"Token history (conteggio reale)   = {counter.count(text)}")
+
+    # Conversazione che cresce turno per turno
+    history = ConversationHistory(counter)
+    total = 0.0
+    for turn in range(40):
+        user_msg = f"Domanda numero {turn + 1}: riassumi il documento allegato."
+        total += history.cost_next_message(
+            user_message=user_msg, max_pairs=25, n_kbox=1.5, r_per_kbox=5,
+            chunk_size=300, out_tokens=300, p_in=0.00015, p_out=0.00060,
+            c_retrieval=1e-5, c_store=1e-5
+        )
+        history.add_turn(user_msg, "Ecco il riassunto richiesto. " * 20)
+    print(f"Costo conversazione di 40 turni (GPT-4o Mini) = {total:.6f} $, "
+          f"token history finali = {history.history_tokens(25)}")
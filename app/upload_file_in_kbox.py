@@ -1,5 +1,9 @@
 import math
 
+import numpy as np
+
+from app.cost_breakdown import CostBreakdown
+
 def tokens_for_resolution(width: int, height: int) -> float:
     """
     Stima il numero di token equivalenti per un'immagine/frame
@@ -26,6 +30,107 @@ def tokens_for_resolution(width: int, height: int) -> float:
     return px_count * ratio_tokens_per_px
 
 
+# ---------------------------------------------------------------------------
+# Modello a tile (prezzi "vision" reali): l'immagine viene ridimensionata per
+# stare in un quadrato MAX_SIDE x MAX_SIDE, poi (se serve) ridotta in modo che il
+# lato corto sia SHORT_SIDE; si contano le tile TILE_SIZE x TILE_SIZE necessarie.
+#   detail="high" => TILE_BASE_TOKENS + TILE_TOKENS * n_tile
+#   detail="low"  => TILE_BASE_TOKENS (immagine a bassa risoluzione, costo fisso)
+# I valori di default sono quelli di GPT-4o; per altri modelli si passano
+# base_tokens / tile_tokens.
+# ---------------------------------------------------------------------------
+TILE_SIZE = 512
+TILE_MAX_SIDE = 2048
+TILE_SHORT_SIDE = 768
+TILE_BASE_TOKENS = 85
+TILE_TOKENS = 170
+DETAIL_LEVELS = ("high", "low")
+
+# Risoluzioni comuni (foto, screenshot, frame video) precalcolate all'import
+COMMON_RESOLUTIONS = (
+    (512, 512), (1024, 1024), (2048, 2048), (4096, 4096),
+    (640, 480), (800, 600), (1024, 768), (1280, 720), (1280, 1024),
+    (1920, 1080), (1080, 1920), (2560, 1440), (3840, 2160), (2160, 3840),
+    (3024, 4032), (4032, 3024), (1170, 2532), (2532, 1170)
+)
+
+
+def _check_detail(detail: str) -> None:
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"detail sconosciuto: {detail!r} (ammessi: {', '.join(DETAIL_LEVELS)})")
+
+
+def _tiled_tokens(width, height, detail, base_tokens, tile_tokens) -> float:
+    _check_detail(detail)
+    if detail == "low":
+        return float(base_tokens)
+    w, h = float(width), float(height)
+    if not (w > 0 and h > 0):
+        raise ValueError(f"Dimensioni dell'immagine non valide: {width}x{height}")
+    scale = min(1.0, TILE_MAX_SIDE / max(w, h))
+    w, h = w * scale, h * scale
+    scale = min(1.0, TILE_SHORT_SIDE / min(w, h))
+    w, h = w * scale, h * scale
+    n_tile = math.ceil(w / TILE_SIZE) * math.ceil(h / TILE_SIZE)
+    return float(base_tokens + tile_tokens * n_tile)
+
+
+# (width, height, detail) -> token, con base_tokens / tile_tokens di default
+TILED_TOKENS_TABLE = {
+    (w, h, detail): _tiled_tokens(w, h, detail, TILE_BASE_TOKENS, TILE_TOKENS)
+    for w, h in COMMON_RESOLUTIONS
+    for detail in DETAIL_LEVELS
+}
+
+
+def tokens_for_resolution_tiled(
+    width: int,
+    height: int,
+    detail: str = "high",
+    base_tokens: float = TILE_BASE_TOKENS,
+    tile_tokens: float = TILE_TOKENS
+) -> float:
+    """
+    Stima dei token di un'immagine/frame con il modello a tile (ridimensionamento +
+    numero di tile da 512 px), alternativa a `tokens_for_resolution`.
+
+    Parametri:
+    -----------
+    width, height : int
+        Dimensioni in pixel dell'immagine/frame.
+    detail : str
+        "high" (tile) oppure "low" (costo fisso di base_tokens).
+    base_tokens, tile_tokens : float
+        Token fissi per immagine e token per tile (default GPT-4o: 85 e 170).
+
+    Solleva ValueError se detail non e' in DETAIL_LEVELS, oppure (con detail="high") se
+    width o height non sono positivi.
+
+    Ritorna:
+    -----------
+    float
+        Numero di token di input per l'immagine.
+    """
+    if base_tokens == TILE_BASE_TOKENS and tile_tokens == TILE_TOKENS:
+        tokens = TILED_TOKENS_TABLE.get((width, height, detail))
+        if tokens is not None:
+            return tokens
+    return _tiled_tokens(width, height, detail, base_tokens, tile_tokens)
+
+
+def image_tokens(width: int, height: int, token_model: str = "linear", detail: str = "high") -> float:
+    """
+    Token di un'immagine/frame secondo `token_model`: "linear" (`tokens_for_resolution`)
+    o "tiled" (`tokens_for_resolution_tiled` con il livello `detail`, validato solo in
+    questo caso).
+    """
+    if token_model == "linear":
+        return tokens_for_resolution(width, height)
+    if token_model == "tiled":
+        return tokens_for_resolution_tiled(width, height, detail)
+    raise ValueError(f"token_model sconosciuto: {token_model!r}")
+
+
 def cost_upload_pdf(
     # Numero di pagine
     n_pages: int,
@@ -38,7 +143,9 @@ def cost_upload_pdf(
     # Costo embedding per 1k token (es. 0.00002)
     c_embed: float,
     # Costo scrittura di 1 chunk su DB+Vector (es. 7.5e-6)
-    c_db_chunk: float
+    c_db_chunk: float,
+    # Voce di CostBreakdown (opzionale)
+    breakdown: str = None
 ) -> float:
     """
     Calcola il costo di caricamento e indicizzazione di un documento PDF/testuale
@@ -60,6 +167,9 @@ def cost_upload_pdf(
         Costo per generare embedding di 1k token (es. 0.00002).
     c_db_chunk : float
         Costo scrittura di 1 chunk + embedding su DB (es. 7.5e-6).
+    breakdown : str
+        Se indicato (es. "doc_hires"), ritorna un `CostBreakdown` con il costo
+        assegnato a quella voce invece di un float.
 
     Ritorna:
     -----------
@@ -79,7 +189,10 @@ def cost_upload_pdf(
     # 4) Costo DB
     c_db = n_chunk * c_db_chunk
 
-    return c_processing + c_embedding + c_db
+    cost_total = c_processing + c_embedding + c_db
+    if breakdown is not None:
+        return CostBreakdown(**{breakdown: cost_total})
+    return cost_total
 
 
 def cost_upload_image(
@@ -95,7 +208,12 @@ def cost_upload_image(
     # Costo embedding per 1k token
     c_embed: float,
     # Costo DB (scrittura chunk+embedding)
-    c_db_chunk: float
+    c_db_chunk: float,
+    # Voce di CostBreakdown (opzionale)
+    breakdown: str = None,
+    # Modello dei token immagine: "linear" o "tiled" (con livello di dettaglio)
+    token_model: str = "linear",
+    detail: str = "high"
 ) -> float:
     """
     Calcola il costo di caricamento e indicizzazione di un'immagine,
@@ -116,6 +234,14 @@ def cost_upload_image(
         Costo embedding (in $) per 1k token.
     c_db_chunk : float
         Costo scrittura su DB di un chunk + embedding (es. ~7.5e-6).
+    breakdown : str
+        Se indicato (es. "img_mini"), ritorna un `CostBreakdown` con il costo
+        assegnato a quella voce invece di un float.
+    token_model : str
+        "linear" (default, `tokens_for_resolution`) oppure "tiled"
+        (`tokens_for_resolution_tiled`).
+    detail : str
+        Livello di dettaglio per token_model="tiled" ("high" o "low").
 
     Ritorna:
     -----------
@@ -124,7 +250,7 @@ def cost_upload_image(
         generare didascalia, embedding e salvare nel DB.
     """
     # 1) Calcolo dei token equivalenti dell'immagine
-    t_img = tokens_for_resolution(width, height)
+    t_img = image_tokens(width, height, token_model, detail)
 
     # 2) Costo LLM caption (input + output)
     cost_llm_caption = (t_img / 1000.0) * p_in + (t_descr / 1000.0) * p_out
@@ -135,7 +261,10 @@ def cost_upload_image(
     # 4) Costo DB
     cost_db = c_db_chunk  # un singolo chunk con embedding
 
-    return cost_llm_caption + cost_embedding + cost_db
+    cost_total = cost_llm_caption + cost_embedding + cost_db
+    if breakdown is not None:
+        return CostBreakdown(**{breakdown: cost_total})
+    return cost_total
 
 
 def cost_upload_video(
@@ -155,7 +284,12 @@ def cost_upload_video(
     # Costo DB (scrittura chunk+embedding)
     c_db_chunk: float,
     # Numero token totali (unificati) per l'embedding finale
-    t_descr_total: float
+    t_descr_total: float,
+    # Voce di CostBreakdown (opzionale)
+    breakdown: str = None,
+    # Modello dei token dei frame: "linear" o "tiled" (con livello di dettaglio)
+    token_model: str = "linear",
+    detail: str = "high"
 ) -> float:
     """
     Calcola il costo di caricamento di un video, considerando l'estrazione
@@ -182,6 +316,11 @@ def cost_upload_video(
     t_descr_total : float
         Numero di token totali di tutte le didascalie combinate.
         (p.es. n_frame * t_descr, se uniamo tutto in un singolo testo)
+    breakdown : str
+        Se indicato (es. "vid_mini"), ritorna un `CostBreakdown` con il costo
+        assegnato a quella voce invece di un float.
+    token_model, detail : str
+        Modello dei token dei frame, come in `cost_upload_image`.
 
     Ritorna:
     -----------
@@ -192,7 +331,7 @@ def cost_upload_video(
     n_frame = math.ceil(duration_sec / sampling_sec)
 
     # 2) Token equivalenti di un frame
-    t_img = tokens_for_resolution(width, height)
+    t_img = image_tokens(width, height, token_model, detail)
 
     # 3) Costo LLM su each frame
     #    (input t_img e output t_descr)
@@ -205,8 +344,174 @@ def cost_upload_video(
     # 5) Costo DB (1 chunk unificato)
     cost_db = c_db_chunk
 
-    return cost_llm_all_frames + cost_embedding_final + cost_db
+    cost_total = cost_llm_all_frames + cost_embedding_final + cost_db
+    if breakdown is not None:
+        return CostBreakdown(**{breakdown: cost_total})
+    return cost_total
+
+
+
+# ---------------------------------------------------------------------------
+# Versioni vettorizzate (NumPy): ogni parametro puo' essere uno scalare oppure
+# una colonna di un manifest di upload (array broadcastabili). Le operazioni
+# seguono lo stesso ordine delle versioni scalari, per cui i risultati
+# coincidono elemento per elemento.
+# ---------------------------------------------------------------------------
+
+def tokens_for_resolution_batch(width, height) -> np.ndarray:
+    """
+    Versione vettorizzata di `tokens_for_resolution`.
+
+    Parametri:
+    -----------
+    width, height : array-like di int
+        Dimensioni in pixel di ciascuna immagine/frame.
+
+    Ritorna:
+    -----------
+    np.ndarray
+        Token equivalenti stimati per ogni immagine (float64).
+    """
+    px_count = np.multiply(width, height, dtype=np.float64)
+    ratio_tokens_per_px = 255.0 / (512.0 * 512.0)
+    return px_count * ratio_tokens_per_px
+
+
+def tokens_for_resolution_tiled_batch(
+    width,
+    height,
+    detail: str = "high",
+    base_tokens: float = TILE_BASE_TOKENS,
+    tile_tokens: float = TILE_TOKENS
+) -> np.ndarray:
+    """
+    Versione vettorizzata di `tokens_for_resolution_tiled` su array di (width, height):
+    stesse regole di ridimensionamento e conteggio delle tile, senza cicli Python.
+    Come la versione scalare, solleva ValueError per dimensioni non positive (detail="high").
+    """
+    _check_detail(detail)
+    w = np.asarray(width, dtype=np.float64)
+    h = np.asarray(height, dtype=np.float64)
+    if detail == "low":
+        return np.broadcast_to(np.float64(base_tokens), np.broadcast(w, h).shape).copy()
+    invalid = ~((w > 0) & (h > 0))
+    if np.any(invalid):
+        w_bad, h_bad = np.broadcast_arrays(w, h)
+        raise ValueError(f"Dimensioni dell'immagine non valide: {w_bad[invalid][0]:g}x{h_bad[invalid][0]:g}")
+    scale = np.minimum(1.0, TILE_MAX_SIDE / np.maximum(w, h))
+    w, h = w * scale, h * scale
+    scale = np.minimum(1.0, TILE_SHORT_SIDE / np.minimum(w, h))
+    w, h = w * scale, h * scale
+    n_tile = np.ceil(w / TILE_SIZE) * np.ceil(h / TILE_SIZE)
+    return base_tokens + tile_tokens * n_tile
+
+
+def image_tokens_batch(width, height, token_model: str = "linear", detail: str = "high") -> np.ndarray:
+    """Versione vettorizzata di `image_tokens`."""
+    if token_model == "linear":
+        return tokens_for_resolution_batch(width, height)
+    if token_model == "tiled":
+        return tokens_for_resolution_tiled_batch(width, height, detail)
+    raise ValueError(f"token_model sconosciuto: {token_model!r}")
+
+
+def cost_upload_pdf_batch(
+    n_pages,
+    c_page,
+    t_total,
+    barT_chunk,
+    c_embed,
+    c_db_chunk
+) -> np.ndarray:
+    """
+    Versione vettorizzata di `cost_upload_pdf`: calcola in un'unica chiamata
+    il costo di un intero manifest di documenti (una riga per file).
+
+    Il numero di chunk ceil(t_total / barT_chunk) e' calcolato con `np.ceil`.
+
+    Parametri:
+    ----------
+    Gli stessi di `cost_upload_pdf` (scalari o array broadcastabili).
+
+    Ritorna:
+    -----------
+    np.ndarray
+        Costo totale (in dollari) di ciascun documento.
+    """
+    c_processing = np.multiply(n_pages, c_page, dtype=np.float64)
+    n_chunk = np.ceil(np.divide(t_total, barT_chunk, dtype=np.float64))
+    c_embed_chunk = (np.asarray(barT_chunk, dtype=np.float64) / 1000.0) * c_embed
+    c_embedding = n_chunk * c_embed_chunk
+    c_db = n_chunk * c_db_chunk
+    return c_processing + c_embedding + c_db
+
+
+def cost_upload_image_batch(
+    width,
+    height,
+    t_descr,
+    p_in,
+    p_out,
+    c_embed,
+    c_db_chunk,
+    token_model: str = "linear",
+    detail: str = "high"
+) -> np.ndarray:
+    """
+    Versione vettorizzata di `cost_upload_image`.
 
+    Parametri:
+    -----------
+    Gli stessi di `cost_upload_image` (scalari o array broadcastabili).
+
+    Ritorna:
+    -----------
+    np.ndarray
+        Costo totale (in dollari) di ciascuna immagine.
+    """
+    t_img = image_tokens_batch(width, height, token_model, detail)
+    t_descr = np.asarray(t_descr, dtype=np.float64)
+    cost_llm_caption = (t_img / 1000.0) * p_in + (t_descr / 1000.0) * p_out
+    cost_embedding = (t_descr / 1000.0) * c_embed
+    return cost_llm_caption + cost_embedding + c_db_chunk
+
+
+def cost_upload_video_batch(
+    duration_sec,
+    sampling_sec,
+    width,
+    height,
+    t_descr,
+    p_in,
+    p_out,
+    c_embed,
+    c_db_chunk,
+    t_descr_total,
+    token_model: str = "linear",
+    detail: str = "high"
+) -> np.ndarray:
+    """
+    Versione vettorizzata di `cost_upload_video`: durate, sampling e
+    risoluzioni possono essere colonne del manifest dei video.
+
+    Il numero di frame ceil(duration_sec / sampling_sec) e' calcolato con `np.ceil`.
+
+    Parametri:
+    -----------
+    Gli stessi di `cost_upload_video` (scalari o array broadcastabili).
+
+    Ritorna:
+    -----------
+    np.ndarray
+        Costo totale (in dollari) di ciascun video.
+    """
+    n_frame = np.ceil(np.divide(duration_sec, sampling_sec, dtype=np.float64))
+    t_img = image_tokens_batch(width, height, token_model, detail)
+    cost_llm_one_frame = ((t_img / 1000.0) * p_in
+                          + (np.asarray(t_descr, dtype=np.float64) / 1000.0) * p_out)
+    cost_llm_all_frames = cost_llm_one_frame * n_frame
+    cost_embedding_final = (np.asarray(t_descr_total, dtype=np.float64) / 1000.0) * c_embed
+    return cost_llm_all_frames + cost_embedding_final + c_db_chunk
 
 
 def run_experiments_pdf_image_video():
@@ -0,0 +1,278 @@
+"""
+File: video_segments.py
+
+Scopo: modello di costo di ingestion video per segmenti, per video lunghi e in gran parte
+       statici (lezioni, riunioni, videosorveglianza).
+
+Rispetto a `cost_upload_video`:
+- il video e' una sequenza di segmenti (durata, sampling, duplicate_ratio), ognuno con il
+  proprio intervallo di campionamento;
+- `duplicate_ratio` e' la frazione di frame campionati che un rilevatore di cambio scena
+  scarta come duplicati: questi frame non vengono mandati al modello di caption;
+- i token delle caption sono derivati in modo coerente: t_descr_total = frame captionati
+  * t_descr (invece di un parametro separato che puo' non coincidere);
+- i segmenti si elaborano in streaming (qualsiasi iterabile, anche un generatore su ore di
+  video), e per molti video esiste una versione vettorizzata su una tabella di segmenti.
+
+Per segmento:
+    frame campionati = ceil(durata / sampling)
+    duplicati attesi = frame campionati * duplicate_ratio   (frazionario)
+Per video:
+    frame duplicati  = floor(somma dei duplicati attesi dei segmenti)
+    frame captionati = campionati - duplicati
+
+L'arrotondamento si fa una sola volta per video, quindi il risultato non dipende da come
+il video e' diviso in segmenti (7200 segmenti da 1s a 0.9 danno gli stessi frame di un
+segmento da 7200s a 0.9).
+
+Con un solo segmento, duplicate_ratio = 0 e t_descr_total = n_frame * t_descr il costo
+coincide con `cost_upload_video`.
+"""
+
+import math
+from typing import NamedTuple
+
+import numpy as np
+
+from app.cost_breakdown import CostBreakdown
+from app.upload_file_in_kbox import tokens_for_resolution, tokens_for_resolution_batch
+
+
+# Tolleranza relativa sui duplicati attesi (es. 10 * 0.7 = 7.000000000000001, o la somma
+# di molti 0.9), scalata sul numero di frame campionati
+_DUP_EPS = 1e-9
+
+
+class VideoSegment(NamedTuple):
+    duration_sec: float
+    sampling_sec: float
+    duplicate_ratio: float = 0.0
+
+
+class VideoSegmentsCost(NamedTuple):
+    """
+    cost             : costo totale (in dollari) con lo scarto dei frame duplicati
+    cost_no_dedup    : costo se tutti i frame campionati venissero captionati
+    frames_sampled   : frame estratti dal video
+    frames_captioned : frame effettivamente inviati al modello di caption
+    t_descr_total    : token totali delle caption (frames_captioned * t_descr)
+    """
+    cost: float
+    cost_no_dedup: float
+    frames_sampled: float
+    frames_captioned: float
+    t_descr_total: float
+
+    @property
+    def savings(self):
+        # Con `breakdown` i due costi sono CostBreakdown: si confrontano i totali
+        if isinstance(self.cost, CostBreakdown):
+            return self.cost_no_dedup.total - self.cost.total
+        return self.cost_no_dedup - self.cost
+
+
+def _floor_duplicates(expected_duplicates: float, n_sampled: float) -> int:
+    """Frame duplicati interi dai duplicati attesi (frazionari) di un intero video."""
+    return math.floor(expected_duplicates + _DUP_EPS * max(1.0, n_sampled))
+
+
+def segment_frames(duration_sec: float, sampling_sec: float, duplicate_ratio: float = 0.0):
+    """
+    Ritorna (frame campionati, frame captionati) di un video composto dal solo segmento.
+    Per piu' segmenti i duplicati attesi vanno sommati prima di arrotondare (vedi
+    `cost_upload_video_segments`).
+    """
+    n_sampled = math.ceil(duration_sec / sampling_sec)
+    return n_sampled, n_sampled - _floor_duplicates(n_sampled * duplicate_ratio, n_sampled)
+
+
+def cost_upload_video_segments(
+    segments,
+    width: int,
+    height: int,
+    t_descr: float,
+    p_in: float,
+    p_out: float,
+    c_embed: float,
+    c_db_chunk: float,
+    barT_chunk: float = None,
+    breakdown: str = None
+) -> VideoSegmentsCost:
+    """
+    Costo di ingestion di un video descritto per segmenti, elaborati in streaming.
+
+    Parametri:
+    -----------
+    segments : iterabile di VideoSegment o tuple (duration_sec, sampling_sec[, duplicate_ratio])
+        Segmenti del video, nell'ordine (anche un generatore).
+    width, height : int
+        Dimensioni in pixel dei frame.
+    t_descr : float
+        Token di caption per frame captionato (es. 50).
+    p_in, p_out : float
+        Costi input e output LLM (in $/1k token).
+    c_embed : float
+        Costo embedding (in $) per 1k token.
+    c_db_chunk : float
+        Costo scrittura di un chunk + embedding.
+    barT_chunk : float
+        Se indicato, le caption fuse vengono divise in ceil(t_descr_total / barT_chunk)
+        chunk (come per i PDF); di default un unico chunk, come `cost_upload_video`.
+    breakdown : str
+        Se indicato (es. "vid_mini"), i campi `cost` e `cost_no_dedup` sono `CostBreakdown`
+        con il costo assegnato a quella voce.
+
+    Ritorna:
+    -----------
+    VideoSegmentsCost
+    """
+    # I duplicati attesi restano frazionari fino alla fine: si arrotonda una volta per video
+    frames_sampled = 0
+    expected_duplicates = 0.0
+    for segment in segments:
+        segment = VideoSegment(*segment)
+        n_sampled = math.ceil(segment.duration_sec / segment.sampling_sec)
+        frames_sampled += n_sampled
+        expected_duplicates += n_sampled * segment.duplicate_ratio
+    frames_captioned = frames_sampled - _floor_duplicates(expected_duplicates, frames_sampled)
+
+    t_img = tokens_for_resolution(width, height)
+    cost_llm_one_frame = (t_img / 1000.0) * p_in + (t_descr / 1000.0) * p_out
+
+    def total(n_frames):
+        t_descr_total = n_frames * t_descr
+        n_chunk = 1 if barT_chunk is None else max(1, math.ceil(t_descr_total / barT_chunk))
+        return (cost_llm_one_frame * n_frames
+                + (t_descr_total / 1000.0) * c_embed
+                + n_chunk * c_db_chunk)
+
+    cost_total = total(frames_captioned)
+    cost_no_dedup = total(frames_sampled)
+    if breakdown is not None:
+        cost_total = CostBreakdown(**{breakdown: cost_total})
+        cost_no_dedup = CostBreakdown(**{breakdown: cost_no_dedup})
+    return VideoSegmentsCost(
+        cost=cost_total,
+        cost_no_dedup=cost_no_dedup,
+        frames_sampled=frames_sampled,
+        frames_captioned=frames_captioned,
+        t_descr_total=frames_captioned * t_descr
+    )
+
+
+def cost_upload_video_segments_batch(
+    video_index,
+    duration_sec,
+    sampling_sec,
+    duplicate_ratio,
+    width,
+    height,
+    t_descr,
+    p_in,
+    p_out,
+    c_embed,
+    c_db_chunk,
+    barT_chunk=None,
+    n_videos: int = None
+) -> VideoSegmentsCost:
+    """
+    Versione vettorizzata su molti video: una tabella di segmenti (una riga per segmento,
+    con l'indice del video di appartenenza) viene aggregata per video.
+
+    Parametri:
+    -----------
+    video_index : array di int
+        Indice 0..n_videos-1 del video di ogni segmento.
+    duration_sec, sampling_sec, duplicate_ratio : array (uno per segmento) o scalari
+    width, height, t_descr, p_in, p_out, c_embed, c_db_chunk, barT_chunk :
+        scalari oppure array con un valore per video.
+    n_videos : int
+        Numero di video (default: max(video_index) + 1).
+
+    Ritorna:
+    -----------
+    VideoSegmentsCost
+        Con un array (uno per video) in ogni campo.
+    """
+    video_index = np.asarray(video_index, dtype=np.int64)
+    if n_videos is None:
+        n_videos = int(video_index.max()) + 1 if video_index.size else 0
+
+    n_sampled = np.ceil(np.divide(duration_sec, sampling_sec, dtype=np.float64))
+    n_sampled = np.broadcast_to(n_sampled, video_index.shape)
+    expected_duplicates = n_sampled * np.asarray(duplicate_ratio, dtype=np.float64)
+    frames_sampled = np.bincount(video_index, weights=n_sampled, minlength=n_videos)
+    expected_duplicates = np.bincount(
+        video_index, weights=np.broadcast_to(expected_duplicates, video_index.shape), minlength=n_videos)
+    frames_captioned = frames_sampled - np.floor(
+        expected_duplicates + _DUP_EPS * np.maximum(1.0, frames_sampled))
+
+    t_img = tokens_for_resolution_batch(width, height)
+    t_descr = np.asarray(t_descr, dtype=np.float64)
+    cost_llm_one_frame = (t_img / 1000.0) * p_in + (t_descr / 1000.0) * p_out
+
+    def total(n_frames):
+        t_descr_total = n_frames * t_descr
+        if barT_chunk is None:
+            n_chunk = 1.0
+        else:
+            n_chunk = np.maximum(1.0, np.ceil(np.divide(t_descr_total, barT_chunk, dtype=np.float64)))
+        return (cost_llm_one_frame * n_frames
+                + (t_descr_total / 1000.0) * c_embed
+                + n_chunk * np.asarray(c_db_chunk, dtype=np.float64))
+
+    return VideoSegmentsCost(
+        cost=total(frames_captioned),
+        cost_no_dedup=total(frames_sampled),
+        frames_sampled=frames_sampled,
+        frames_captioned=frames_captioned,
+        t_descr_total=frames_captioned * t_descr
+    )
+
+
+if __name__ == "__main__":
+    import time
+
+    from app.upload_file_in_kbox import cost_upload_video
+
+    caption_kwargs = dict(width=512, height=512, t_descr=50, p_in=0.00015, p_out=0.00060,
+                          c_embed=0.00002, c_db_chunk=7.5e-6)
+
+    # Coerenza con il modello a segmento unico
+    single = cost_upload_video_segments([(120, 10)], **caption_kwargs)
+    legacy = cost_upload_video(120, 10, t_descr_total=12 * 50, **caption_kwargs)
+    print(f"Segmento unico: {single.cost:.6f} $ (cost_upload_video = {legacy:.6f} $)")
+
+    # Lezione di 2 ore, segmento di 1 minuto: slide statiche (90% duplicati) con
+    # sampling a 2s, e ogni 10 minuti una demo dal vivo (sampling 1s, 20% duplicati)
+    def lecture_segments(hours=2):
+        for minute in range(hours * 60):
+            if minute % 10 == 9:
+                yield VideoSegment(60, 1.0, 0.2)
+            else:
+                yield VideoSegment(60, 2.0, 0.9)
+
+    lecture = cost_upload_video_segments(lecture_segments(), barT_chunk=500, **caption_kwargs)
+    print(f"Lezione 2h: frame campionati={lecture.frames_sampled}, captionati={lecture.frames_captioned}, "
+          f"costo={lecture.cost:.4f} $ (senza dedup {lecture.cost_no_dedup:.4f} $, "
+          f"risparmio {lecture.savings:.4f} $)")
+
+    # 5.000 video, in media 60 segmenti ciascuno
+    rng = np.random.default_rng(0)
+    n_videos = 5000
+    n_segments = rng.poisson(60, n_videos)
+    video_index = np.repeat(np.arange(n_videos), n_segments)
+    t0 = time.perf_counter()
+    result = cost_upload_video_segments_batch(
+        video_index,
+        duration_sec=60.0,
+        sampling_sec=rng.choice([1.0, 2.0, 5.0], video_index.size),
+        duplicate_ratio=rng.beta(5, 2, video_index.size),
+        n_videos=n_videos,
+        barT_chunk=500,
+        **caption_kwargs
+    )
+    elapsed = time.perf_counter() - t0
+    print(f"{n_videos} video / {video_index.size} segmenti in {elapsed * 1e3:.1f} ms: "
+          f"costo={result.cost.sum():.2f} $, senza dedup={result.cost_no_dedup.sum():.2f} $, "
+          f"risparmio={result.savings.sum():.2f} $")
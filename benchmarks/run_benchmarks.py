@@ -0,0 +1,287 @@
+"""
+File: run_benchmarks.py
+
+Scopo: benchmark riproducibili dei percorsi "caldi" del modello di costo
+       (cost_of_message, build_history_text, cost_upload_*, run_experiments_pdf_image_video,
+       cost_monthly_user_debug / cost_monthly_user / cost_monthly_user_batch), con confronto
+       tra versioni scalari e vettorizzate.
+
+Uso (dalla root del repository):
+    python -m benchmarks.run_benchmarks                         # stampa i risultati in JSON
+    python -m benchmarks.run_benchmarks --output bench.json
+    python -m benchmarks.run_benchmarks --baseline benchmarks/baseline.json
+    python -m benchmarks.run_benchmarks --save-baseline benchmarks/baseline.json
+
+Ogni benchmark riporta il tempo per chiamata (minimo su `repeat` ripetizioni) e,
+quando ha senso, il tempo per elemento. Con --baseline i benchmark piu' lenti del
+baseline di oltre `--tolerance` sono segnalati come regressioni (exit code 1).
+Tutti gli input casuali usano semi fissi. I tempi dipendono dalla macchina: il baseline
+va rigenerato (--save-baseline) sulla macchina su cui si confrontano i risultati.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from app.send_message import (
+    build_history_text,
+    iter_history_text,
+    cost_of_message,
+    cost_of_message_batch
+)
+from app.upload_file_in_kbox import (
+    cost_upload_pdf,
+    cost_upload_image,
+    cost_upload_video,
+    cost_upload_pdf_batch,
+    cost_upload_image_batch,
+    cost_upload_video_batch,
+    run_experiments_pdf_image_video
+)
+from app.compute_total_monthly_cost import (
+    cost_monthly_user_debug,
+    cost_monthly_user,
+    cost_monthly_user_batch
+)
+from app.price_catalog import clear_unit_cost_cache
+
+
+SEED = 12345
+BATCH_SIZE = 1_000_000
+
+# Stessi parametri dell'esempio in compute_total_monthly_cost.py
+MONTHLY_PARAMS = dict(
+    n_chat=8, n_msg_per_chat=20, user_tokens_per_msg=100, n_kbox_per_msg=1.5,
+    r_per_kbox=5, chunk_size_retrieval=300, out_tokens_per_msg=300, fraction_4o=0.3,
+    p_in_4o=0.005, p_out_4o=0.015, p_in_mini=0.00015, p_out_mini=0.00060,
+    c_retrieval=1e-5, c_store=1e-5,
+    n_doc=8, n_img=2, n_vid=1,
+    fraction_hires=0.5, c_page_hires=0.01, c_page_fast=0.001, t_total_doc=5000,
+    barT_chunk_doc=500, c_embed_doc=0.00002, c_db_chunk_doc=7.5e-6, pages_per_doc=10,
+    fraction_4o_imgvid=0.3, p_in_4o_imgvid=0.005, p_out_4o_imgvid=0.015,
+    p_in_mini_imgvid=0.00015, p_out_mini_imgvid=0.00060,
+    img_width=512, img_height=512, t_descr_img=100, c_embed_img=0.00002, c_db_chunk_img=7.5e-6,
+    dur_sec_vid=120, sampling_sec_vid=10, vid_width=512, vid_height=512, t_descr_vid_frame=50,
+    c_embed_vid=0.00002, c_db_chunk_vid=7.5e-6, t_descr_vid_total=600,
+    gb_stored_user=0.1, c_gb_month=0.25
+)
+
+MESSAGE_PARAMS = dict(
+    max_pairs=25, avg_tokens_per_message=100, user_tokens=50, n_kbox=1.5, r_per_kbox=5,
+    chunk_size=300, out_tokens=300, p_in=0.005, p_out=0.015, c_retrieval=1e-5, c_store=1e-5
+)
+
+
+def time_call(fn, repeat: int = 5, number: int = 1) -> float:
+    """
+    Tempo (in secondi) di una singola chiamata di `fn`: minimo su `repeat` misure,
+    ognuna delle quali esegue `number` chiamate.
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        best = min(best, (time.perf_counter() - t0) / number)
+    return best
+
+
+def quiet(fn):
+    """Esegue `fn` scartando lo stdout (per le funzioni che stampano debug)."""
+    def wrapper():
+        with contextlib.redirect_stdout(io.StringIO()):
+            return fn()
+    return wrapper
+
+
+def _message_columns(rng, n: int) -> dict:
+    return dict(
+        max_pairs=rng.integers(0, 50, n),
+        avg_tokens_per_message=rng.integers(10, 300, n),
+        user_tokens=rng.uniform(0, 500, n),
+        n_kbox=rng.uniform(0, 4, n),
+        r_per_kbox=rng.integers(1, 20, n),
+        chunk_size=rng.uniform(100, 600, n),
+        out_tokens=rng.uniform(10, 900, n),
+        p_in=rng.choice([0.005, 0.00015], n),
+        p_out=rng.choice([0.015, 0.0006], n),
+        c_retrieval=1e-5,
+        c_store=1e-5
+    )
+
+
+def _scalar_vs_batch(name, scalar_fn, batch_fn, n_items, results, repeat):
+    """Registra i benchmark scalare e batch e il relativo speedup per elemento."""
+    t_scalar = time_call(scalar_fn, repeat=repeat, number=1000)
+    t_batch = time_call(batch_fn, repeat=repeat)
+    results[f"{name}.scalar"] = {"seconds_per_call": t_scalar, "seconds_per_item": t_scalar}
+    results[f"{name}.batch_{n_items}"] = {
+        "seconds_per_call": t_batch,
+        "seconds_per_item": t_batch / n_items,
+        "speedup_vs_scalar": t_scalar / (t_batch / n_items)
+    }
+
+
+def run_benchmarks(repeat: int = 5, batch_size: int = BATCH_SIZE) -> dict:
+    """
+    Esegue tutti i benchmark e ritorna {nome: {"seconds_per_call": ..., ...}}.
+    """
+    rng = np.random.default_rng(SEED)
+    results = {}
+
+    # --- cost_of_message: scalare vs batch ---
+    msg_cols = _message_columns(rng, batch_size)
+    _scalar_vs_batch(
+        "cost_of_message",
+        lambda: cost_of_message(**MESSAGE_PARAMS),
+        lambda: cost_of_message_batch(**msg_cols),
+        batch_size, results, repeat
+    )
+
+    # --- build_history_text a max_pairs crescente ---
+    for max_pairs in (100, 1000, 10000):
+        results[f"build_history_text.max_pairs_{max_pairs}"] = {
+            "seconds_per_call": time_call(
+                lambda: build_history_text(max_pairs, 100, "input utente"), repeat=repeat)
+        }
+    results["iter_history_text.max_pairs_10000"] = {
+        "seconds_per_call": time_call(
+            lambda: sum(len(c) for c in iter_history_text(10000, 100, "input utente")),
+            repeat=repeat)
+    }
+
+    # --- cost_upload_*: scalare vs batch ---
+    w = rng.integers(64, 4096, batch_size)
+    h = rng.integers(64, 4096, batch_size)
+    pages = rng.integers(1, 300, batch_size)
+    t_total = rng.uniform(0, 1e5, batch_size)
+    duration = rng.uniform(1, 7200, batch_size)
+    sampling = rng.uniform(0.5, 30, batch_size)
+
+    _scalar_vs_batch(
+        "cost_upload_pdf",
+        lambda: cost_upload_pdf(10, 0.01, 5000, 500, 0.00002, 7.5e-6),
+        lambda: cost_upload_pdf_batch(pages, 0.01, t_total, 500, 0.00002, 7.5e-6),
+        batch_size, results, repeat
+    )
+    _scalar_vs_batch(
+        "cost_upload_image",
+        lambda: cost_upload_image(1024, 1024, 100, 0.005, 0.015, 0.00002, 7.5e-6),
+        lambda: cost_upload_image_batch(w, h, 100, 0.005, 0.015, 0.00002, 7.5e-6),
+        batch_size, results, repeat
+    )
+    _scalar_vs_batch(
+        "cost_upload_video",
+        lambda: cost_upload_video(120, 10, 512, 512, 50, 0.005, 0.015, 0.00002, 7.5e-6, 600),
+        lambda: cost_upload_video_batch(duration, sampling, w, h, 50, 0.005, 0.015,
+                                        0.00002, 7.5e-6, 600),
+        batch_size, results, repeat
+    )
+
+    # --- run_experiments_pdf_image_video (stdout scartato) ---
+    results["run_experiments_pdf_image_video"] = {
+        "seconds_per_call": time_call(quiet(run_experiments_pdf_image_video), repeat=repeat)
+    }
+
+    # --- costo mensile a n_doc/n_img/n_vid crescenti ---
+    for n in (10, 1000, 100000):
+        params = dict(MONTHLY_PARAMS, n_doc=n, n_img=n, n_vid=n)
+        results[f"cost_monthly_user_debug.n_{n}"] = {
+            "seconds_per_call": time_call(quiet(lambda: cost_monthly_user_debug(**params)),
+                                          repeat=repeat)
+        }
+        # Cache dei costi unitari svuotata a ogni chiamata: con argomenti costanti si
+        # misurerebbe solo la lookup della lru_cache (vedi la voce .warm_cache)
+        results[f"cost_monthly_user.n_{n}"] = {
+            "seconds_per_call": time_call(lambda: (clear_unit_cost_cache(), cost_monthly_user(**params)),
+                                          repeat=repeat, number=100)
+        }
+        results[f"cost_monthly_user.n_{n}.warm_cache"] = {
+            "seconds_per_call": time_call(lambda: cost_monthly_user(**params),
+                                          repeat=repeat, number=100)
+        }
+
+    n_users = batch_size // 10
+    user_cols = dict(
+        MONTHLY_PARAMS,
+        n_chat=rng.integers(0, 30, n_users),
+        n_doc=rng.integers(0, 50, n_users),
+        n_img=rng.integers(0, 20, n_users),
+        n_vid=rng.integers(0, 5, n_users)
+    )
+    t_batch = time_call(lambda: cost_monthly_user_batch(**user_cols), repeat=repeat)
+    results[f"cost_monthly_user_batch.users_{n_users}"] = {
+        "seconds_per_call": t_batch,
+        "seconds_per_item": t_batch / n_users,
+        "speedup_vs_scalar": results["cost_monthly_user.n_10"]["seconds_per_call"] / (t_batch / n_users)
+    }
+
+    return results
+
+
+def compare_with_baseline(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Ritorna la lista delle regressioni: benchmark presenti nel baseline il cui
+    tempo per chiamata supera quello del baseline di oltre `tolerance` (es. 0.25 = +25%).
+    """
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        ratio = current["seconds_per_call"] / base["seconds_per_call"]
+        if ratio > 1.0 + tolerance:
+            regressions.append({"benchmark": name, "ratio": ratio,
+                                "baseline": base["seconds_per_call"],
+                                "current": current["seconds_per_call"]})
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark del modello di costo")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--output", help="file JSON in cui scrivere i risultati")
+    parser.add_argument("--baseline", help="file JSON di baseline con cui confrontare")
+    parser.add_argument("--save-baseline", help="salva i risultati come nuovo baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="rallentamento tollerato rispetto al baseline (default 0.5 = +50%%)")
+    args = parser.parse_args(argv)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "seed": SEED,
+            "batch_size": args.batch_size,
+            "repeat": args.repeat
+        },
+        "results": run_benchmarks(repeat=args.repeat, batch_size=args.batch_size)
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        report["regressions"] = compare_with_baseline(report["results"], baseline, args.tolerance)
+        if report["regressions"]:
+            exit_code = 1
+
+    text = json.dumps(report, indent=2, sort_keys=True)
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(text + "\n")
+    print(text)
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
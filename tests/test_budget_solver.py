@@ -0,0 +1,55 @@
+import pytest
+
+from app.budget_solver import solve_budget, solve_budget_scale
+from app.compute_total_monthly_cost import cost_monthly_user
+
+
+def cost_with(params, **overrides):
+    return cost_monthly_user(**dict(params, **overrides))
+
+
+@pytest.mark.parametrize("name, budget, high", [
+    ("n_doc", 3.0, 100_000),       # a gradini, intero
+    ("max_pairs", 2.0, 1000),      # affine, intero
+    ("n_chat", 5.0, 10_000),       # affine, intero
+])
+def test_integer_solution_is_the_largest_within_budget(example_params, name, budget, high):
+    value = solve_budget(example_params, name, budget, high=high)
+    assert isinstance(value, int)
+    assert cost_with(example_params, **{name: value}) <= budget
+    assert cost_with(example_params, **{name: value + 1}) > budget
+
+
+@pytest.mark.parametrize("name, budget", [("fraction_4o", 2.0), ("fraction_hires", 2.6),
+                                          ("fraction_4o_imgvid", 2.6)])
+def test_fraction_solution_sits_on_the_budget_boundary(example_params, name, budget):
+    value = solve_budget(example_params, name, budget, tolerance=1e-9)
+    assert 0.0 <= value < 1.0
+    assert cost_with(example_params, **{name: value}) <= budget + 1e-12
+    assert cost_with(example_params, **{name: min(1.0, value + 1e-6)}) > budget
+
+
+def test_growing_history_is_solved_by_bisection(example_params):
+    params = dict(example_params, growing_history=True)
+    value = solve_budget(params, "max_pairs", 1.6, high=1000)
+    assert 0 < value < 19
+    assert cost_with(params, max_pairs=value) <= 1.6 < cost_with(params, max_pairs=value + 1)
+
+
+def test_budget_edges(example_params):
+    assert solve_budget(example_params, "fraction_4o", 0.01) is None
+    assert solve_budget(example_params, "fraction_4o", 1000.0) == 1.0
+    with pytest.raises(ValueError):
+        solve_budget(example_params, "n_doc", 3.0)
+
+
+def test_scale_keeps_scaled_ingestion_within_budget(example_params):
+    names = ["n_doc", "n_img", "n_vid"]
+    scale = solve_budget_scale(example_params, names, 5.0)
+
+    def scaled(s):
+        return cost_with(example_params, **{n: int(s * example_params[n]) for n in names})
+
+    assert scale > 1.0
+    assert scaled(scale) <= 5.0
+    assert scaled(scale * 1.01) > 5.0
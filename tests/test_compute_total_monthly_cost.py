@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from app.compute_total_monthly_cost import (
+    cost_monthly_user,
+    cost_monthly_user_batch,
+    cost_monthly_user_breakdown,
+    cost_monthly_user_debug
+)
+
+# Costi prodotti dall'implementazione originale (con i cicli per documento/immagine/video)
+BASELINE_CASES = [
+    ({}, 2.5969707499999997),
+    (dict(n_doc=37, n_img=11, n_vid=4, fraction_hires=0.35, fraction_4o_imgvid=0.6), 3.7685535000000008),
+    (dict(n_chat=30, fraction_4o=0.0, img_width=1920, img_height=1080, vid_width=1280, vid_height=720),
+     1.2618601845703123),
+    (dict(fraction_4o=1.0, fraction_hires=1.0, fraction_4o_imgvid=1.0, n_doc=250, n_img=120, n_vid=9,
+          t_total_doc=12345), 32.290590500000235),
+    (dict(n_doc=0, n_img=0, n_vid=0), 2.1518399999999995),
+]
+
+
+@pytest.mark.parametrize("overrides, expected", BASELINE_CASES)
+def test_closed_form_matches_baseline_to_the_cent(example_params, overrides, expected):
+    params = dict(example_params, **overrides)
+    assert round(cost_monthly_user(**params), 2) == round(expected, 2)
+    assert cost_monthly_user(**params) == pytest.approx(expected, rel=1e-12)
+
+
+def test_debug_returns_same_total_as_quiet_version(example_params, capsys):
+    assert cost_monthly_user_debug(**example_params) == pytest.approx(cost_monthly_user(**example_params))
+    assert "COSTO TOTALE MENSILE UTENTE" in capsys.readouterr().out
+
+
+def test_batch_matches_scalar_per_user(example_params):
+    rng = np.random.default_rng(0)
+    n = 200
+    columns = dict(
+        example_params,
+        n_chat=rng.integers(0, 30, n),
+        n_doc=rng.integers(0, 50, n),
+        n_img=rng.integers(0, 20, n),
+        n_vid=rng.integers(0, 5, n),
+        fraction_4o=rng.uniform(0, 1, n),
+        fraction_hires=rng.uniform(0, 1, n),
+        fraction_4o_imgvid=rng.uniform(0, 1, n)
+    )
+    batch = cost_monthly_user_batch(**columns)
+    for i in range(n):
+        row = {k: (v[i] if isinstance(v, np.ndarray) else v) for k, v in columns.items()}
+        scalar = cost_monthly_user_breakdown(**row)
+        np.testing.assert_allclose([field[i] for field in batch], scalar, rtol=1e-12, atol=1e-15)
+
+
+def test_baseline_imports_are_still_re_exported():
+    from app import compute_total_monthly_cost, send_message, upload_file_in_kbox
+
+    for module, names in ((send_message, ("calculate_history_tokens", "build_history_text", "cost_of_message")),
+                          (upload_file_in_kbox, ("tokens_for_resolution", "cost_upload_pdf",
+                                                 "cost_upload_image", "cost_upload_video"))):
+        for name in names:
+            assert getattr(compute_total_monthly_cost, name) is getattr(module, name)
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from app.compute_total_monthly_cost import (
+    cost_monthly_user,
+    cost_monthly_user_breakdown,
+    cost_monthly_user_debug
+)
+from app.cost_breakdown import CostBreakdown
+
+
+def test_numpy_scalar_times_breakdown_stays_a_breakdown():
+    cb = CostBreakdown(chat_4o=1.0, storage=0.5)
+    for k in (np.float64(2.0), np.int64(2)):
+        scaled = k * cb
+        assert isinstance(scaled, CostBreakdown)
+        assert scaled.total == pytest.approx(3.0)
+        assert isinstance(cb * k, CostBreakdown)
+
+
+def test_monthly_cost_accepts_numpy_scalars(example_params):
+    expected = cost_monthly_user(**example_params)
+    params = dict(example_params, n_chat=np.int64(8), fraction_4o=np.float64(0.3),
+                  n_doc=np.int64(8), fraction_4o_imgvid=np.float64(0.3))
+    assert cost_monthly_user(**params) == pytest.approx(expected)
+    assert isinstance(cost_monthly_user_breakdown(**params), CostBreakdown)
+
+
+def test_breakdown_items_sum_to_monthly_total(example_params, capsys):
+    cb = cost_monthly_user_breakdown(**example_params)
+    assert sum(cb) == pytest.approx(cb.total, rel=1e-15)
+    assert cb.chat + cb.ingestion + cb.storage == pytest.approx(cb.total, rel=1e-15)
+    assert cb.total == pytest.approx(2.596971, abs=5e-7)
+    assert float(cb) == cost_monthly_user(**example_params)
+    assert cost_monthly_user_debug(**example_params) == pytest.approx(cb.total)
+    assert f"{cb.total:.6f}" in capsys.readouterr().out
+
+
+def test_breakdown_arithmetic_is_per_item():
+    a = CostBreakdown(chat_4o=1.0, doc_fast=2.0)
+    b = CostBreakdown(chat_4o=0.5, storage=0.25)
+    assert a + b == CostBreakdown(chat_4o=1.5, doc_fast=2.0, storage=0.25)
+    assert sum([a, b, b]) == a + b + b
+    assert 3 * a == a * 3 == CostBreakdown(chat_4o=3.0, doc_fast=6.0)
+    with pytest.raises(TypeError):
+        a + (1.0,)
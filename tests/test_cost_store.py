@@ -0,0 +1,71 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.cost_breakdown import CostBreakdown
+from app.cost_store import STORE_COLUMNS, CostResultStore
+
+
+def make_breakdowns(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return CostBreakdown(*rng.uniform(0, 1, (len(CostBreakdown._fields), n)))
+
+
+def test_top_k_with_non_positive_k_is_empty(tmp_path):
+    with CostResultStore(str(tmp_path / "store")) as store:
+        store.append(np.arange(5), 202407, make_breakdowns(5))
+        assert store.top_k(k=0) == []
+        assert store.top_k(k=-3) == []
+        assert len(store.top_k(k=10)) == 5
+
+
+def test_round_trip_after_reopen(tmp_path):
+    path = str(tmp_path / "store")
+    first, second = make_breakdowns(100, seed=1), make_breakdowns(50, seed=2)
+    with CostResultStore(path) as store:
+        store.append(np.arange(100), 202407, first)
+        store.append(np.arange(50) * 3, 202408, second)
+        store.append(7, 202407, CostBreakdown(chat_4o=9.0))  # nuovo record per (7, 202407)
+
+    with CostResultStore(path, readonly=True) as store:
+        assert len(store) == 151
+        np.testing.assert_array_equal(store.column("doc_hires")[:100], first.doc_hires)
+        np.testing.assert_array_equal(store.breakdown(100, 150).total, second.total)
+        assert store.lookup(12, 202408) == CostBreakdown(*(float(v[4]) for v in second))
+        assert store.lookup(7, 202407) == CostBreakdown(chat_4o=9.0)
+        assert store[-1] == (7, 202407, CostBreakdown(chat_4o=9.0))
+        # Le aggregazioni lavorano su tutti i record accodati
+        assert store.component_total("ingestion", chunk_rows=16) == pytest.approx(
+            first.ingestion.sum() + second.ingestion.sum())
+        top = store.top_k("storage", k=5, chunk_rows=16)
+        expected = np.sort(store.column("storage"))[::-1][:5]
+        np.testing.assert_array_equal([value for *_, value in top], expected)
+        with pytest.raises(KeyError):
+            store.lookup(1, 202408)
+        with pytest.raises(PermissionError):
+            store.append(0, 202409, CostBreakdown())
+
+
+def test_interrupted_append_is_truncated_and_reindexed(tmp_path):
+    path = str(tmp_path / "store")
+    with CostResultStore(path) as store:
+        store.append(np.arange(10), 202407, make_breakdowns(10))
+
+    # Accodamento interrotto: record scritti solo in alcune colonne (l'ultima a meta')
+    # e indice non aggiornato
+    for name, dtype in STORE_COLUMNS[:4]:
+        with open(os.path.join(path, f"{name}.bin"), "ab") as f:
+            f.write(np.zeros(3, dtype=dtype).tobytes()[:-1])
+    os.remove(os.path.join(path, "index.json"))
+
+    with CostResultStore(path) as store:
+        assert len(store) == 10
+        for name, dtype in STORE_COLUMNS:
+            assert os.path.getsize(os.path.join(path, f"{name}.bin")) == 10 * dtype.itemsize
+        assert store.lookup(9, 202407) == store[9][2]
+        store.append(10, 202407, CostBreakdown(storage=1.0))
+
+    with CostResultStore(path, readonly=True) as store:
+        assert len(store) == 11
+        assert store.lookup(10, 202407) == CostBreakdown(storage=1.0)
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from app.compute_total_monthly_cost import cost_monthly_user_batch, cost_monthly_user_breakdown
+from app.model_routing import ModelRouting, cost_monthly_user_routed
+
+
+def two_model_routing(fraction_4o):
+    return ModelRouting.from_catalog(fractions={"GPT-4o": fraction_4o, "GPT-4oMini": 1.0 - fraction_4o})
+
+
+def assert_matches_breakdown(routed, expected):
+    np.testing.assert_allclose(routed.chat, expected.chat, rtol=1e-12)
+    np.testing.assert_allclose(routed.doc, expected.doc, rtol=1e-12)
+    np.testing.assert_allclose(routed.img, expected.img, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(routed.vid, expected.vid, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(routed.total, expected.total, rtol=1e-12)
+
+
+@pytest.mark.parametrize("overrides", [
+    {},
+    dict(fraction_4o=0.0, fraction_4o_imgvid=1.0, n_img=7, n_vid=3),
+    dict(fraction_4o=0.55, fraction_4o_imgvid=0.45, n_img=11, n_vid=5),
+    dict(growing_history=True, cached_input_ratio=0.5, cache_hit_rate=0.8),
+], ids=["example", "edges", "odd_counts", "prompt_caching"])
+def test_two_models_match_cost_monthly_user(example_params, overrides):
+    params = dict(example_params, **overrides)
+    routed = cost_monthly_user_routed(two_model_routing(params["fraction_4o"]),
+                                      two_model_routing(params["fraction_4o_imgvid"]), **params)
+    expected = cost_monthly_user_breakdown(**params)
+    assert_matches_breakdown(routed, expected)
+    np.testing.assert_allclose(routed.chat_by_model, [expected.chat_4o, expected.chat_mini], rtol=1e-12)
+    np.testing.assert_allclose(routed.img_by_model, [expected.img_4o, expected.img_mini], atol=1e-15)
+
+
+def test_two_models_per_tenant_match_batch(example_params):
+    rng = np.random.default_rng(3)
+    n = 1000
+    fraction_4o = rng.uniform(0, 1, n)
+    fraction_imgvid = rng.uniform(0, 1, n)
+    params = dict(example_params, fraction_4o=fraction_4o, fraction_4o_imgvid=fraction_imgvid,
+                  n_chat=rng.integers(0, 30, n), n_img=rng.integers(0, 20, n), n_vid=rng.integers(0, 5, n))
+    routed = cost_monthly_user_routed(two_model_routing(fraction_4o), two_model_routing(fraction_imgvid),
+                                      **params)
+    assert_matches_breakdown(routed, cost_monthly_user_batch(**params))
+
+
+def test_rules_route_on_prompt_length(example_params):
+    models = {"small": {"p_in": 0.0001, "p_out": 0.0004}, "large": {"p_in": 0.005, "p_out": 0.015}}
+    rules = ModelRouting(models, rules=[(4000, {"small": 1.0}), (None, {"large": 1.0})])
+    small = ModelRouting(models, fractions={"small": 1.0})
+    large = ModelRouting(models, fractions={"large": 1.0})
+    # T_in = 2 * max_pairs * 100 + 100 + 2250: max_pairs=5 -> 3350, max_pairs=25 -> 7350
+    for max_pairs, fixed in ((5, small), (25, large)):
+        params = dict(example_params, max_pairs=max_pairs)
+        routed = cost_monthly_user_routed(rules, small, **params)
+        assert float(routed.chat) == pytest.approx(float(cost_monthly_user_routed(fixed, small, **params).chat))
+
+
+def test_invalid_routing_tables():
+    models = {"a": {"p_in": 1.0, "p_out": 1.0}, "b": {"p_in": 2.0, "p_out": 2.0}}
+    with pytest.raises(ValueError):
+        ModelRouting(models, fractions={"a": 0.5, "b": 0.6})
+    with pytest.raises(ValueError):
+        ModelRouting(models, fractions={"a": 1.5, "b": -0.5})
+    with pytest.raises(KeyError):
+        ModelRouting(models, fractions={"c": 1.0})
+    with pytest.raises(ValueError):
+        ModelRouting(models, rules=[(100, {"a": 1.0}), (50, {"b": 1.0})])
+    with pytest.raises(ValueError):
+        ModelRouting(models, rules=[(100, {"a": 1.0})]).fractions_for(200)
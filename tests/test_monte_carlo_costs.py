@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from app.compute_total_monthly_cost import cost_monthly_user, cost_monthly_user_batch
+from app.monte_carlo_costs import (
+    Empirical,
+    LogNormal,
+    Poisson,
+    Uniform,
+    _sample_params,
+    simulate_monthly_costs
+)
+
+QUANTILES = (0.0, 0.5, 0.95, 0.99, 1.0)
+
+
+@pytest.fixture
+def mc_params(example_params):
+    return dict(example_params, n_chat=Poisson(8), user_tokens_per_msg=LogNormal(100, 0.5),
+                fraction_4o=Uniform(0.1, 0.5), n_doc=Poisson(8), n_vid=Poisson(0.5),
+                pages_per_doc=Empirical([1, 5, 10, 50, 200], weights=[10, 30, 35, 20, 5]),
+                gb_stored_user=LogNormal(0.1, 1.0))
+
+
+def exact_samples(params, n_samples, seed, chunk_size):
+    """Costi totali per campione, con gli stessi generatori per blocco della simulazione."""
+    sizes = [min(chunk_size, n_samples - start) for start in range(0, n_samples, chunk_size)]
+    totals = []
+    for seed_seq, size in zip(np.random.SeedSequence(seed).spawn(len(sizes)), sizes):
+        rng = np.random.default_rng(seed_seq)
+        totals.append(cost_monthly_user_batch(**_sample_params(params, rng, size)).total)
+    return np.concatenate(totals)
+
+
+def test_streaming_quantiles_match_exact_within_relative_error(mc_params):
+    stats = simulate_monthly_costs(mc_params, n_samples=20_000, seed=7, quantiles=QUANTILES,
+                                   chunk_size=3_000)["total"]
+    samples = exact_samples(mc_params, 20_000, 7, 3_000)
+    assert stats["mean"] == pytest.approx(samples.mean(), rel=1e-12)
+    for q, exact in zip(QUANTILES, np.quantile(samples, QUANTILES)):
+        assert stats[f"p{q * 100:g}"] == pytest.approx(exact, rel=1e-4)
+    assert stats["p0"] == samples.min() and stats["p100"] == samples.max()
+
+
+def test_fixed_parameters_give_the_deterministic_cost(example_params):
+    stats = simulate_monthly_costs(example_params, n_samples=1_000, seed=0, chunk_size=64)
+    expected = cost_monthly_user(**example_params)
+    assert all(value == pytest.approx(expected, rel=1e-12) for value in stats["total"].values())
+
+
+def test_result_does_not_depend_on_processes(mc_params):
+    kwargs = dict(n_samples=5_000, seed=3, chunk_size=1_000)
+    assert simulate_monthly_costs(mc_params, processes=2, **kwargs) == simulate_monthly_costs(mc_params, **kwargs)
+
+
+@pytest.mark.parametrize("kwargs", [dict(n_samples=0), dict(n_samples=-5), dict(chunk_size=0)])
+def test_invalid_sizes_raise(example_params, kwargs):
+    with pytest.raises(ValueError):
+        simulate_monthly_costs(example_params, **dict(dict(n_samples=10), **kwargs))
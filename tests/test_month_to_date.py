@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from app.compute_total_monthly_cost import cost_monthly_user, cost_monthly_user_breakdown
+from app.cost_breakdown import CostBreakdown
+from app.month_to_date import MonthToDateCosts
+
+
+def replay_month(mtd, user, params):
+    """Eventi di un mese con i conteggi di `params` (bucket arrotondati come nel calcolo mensile)."""
+    n_msg = params["n_chat"] * params["n_msg_per_chat"]
+    n_msg_4o = round(n_msg * params["fraction_4o"])
+    n_hires = round(params["n_doc"] * params["fraction_hires"])
+    n_img_4o = round(params["n_img"] * params["fraction_4o_imgvid"])
+    n_vid_4o = round(params["n_vid"] * params["fraction_4o_imgvid"])
+    # Un evento alla volta, come arrivano dal servizio
+    for _ in range(n_msg_4o):
+        mtd.add_messages(user, "4o")
+    mtd.add_messages(user, "mini", count=n_msg - n_msg_4o)
+    for _ in range(n_hires):
+        mtd.add_pdf(user, "hires")
+    mtd.add_pdf(user, "fast", count=params["n_doc"] - n_hires)
+    mtd.add_image(user, "4o", count=n_img_4o)
+    mtd.add_image(user, "mini", count=params["n_img"] - n_img_4o)
+    mtd.add_video(user, "4o", count=n_vid_4o)
+    mtd.add_video(user, "mini", count=params["n_vid"] - n_vid_4o)
+    mtd.set_storage(user, params["gb_stored_user"])
+
+
+@pytest.mark.parametrize("overrides", [
+    {},
+    dict(n_chat=12, fraction_4o=0.25, n_doc=40, n_img=9, n_vid=5, gb_stored_user=2.5),
+    dict(growing_history=True, max_pairs=10),
+    dict(growing_history=True, cached_input_ratio=0.5, cache_hit_rate=0.8),
+], ids=["example", "heavy", "growing_history", "prompt_caching"])
+def test_month_to_date_equals_cost_monthly_user(example_params, overrides):
+    params = dict(example_params, **overrides)
+    mtd = MonthToDateCosts(params)
+    replay_month(mtd, 3, params)
+    expected = cost_monthly_user_breakdown(**params)
+    np.testing.assert_allclose(mtd.breakdown(3), expected, rtol=1e-12, atol=1e-15)
+    assert mtd.breakdown(3).total == pytest.approx(cost_monthly_user(**params), rel=1e-12)
+    assert mtd.breakdown(0) == CostBreakdown()
+
+
+def test_retract_snapshot_and_new_month(example_params):
+    mtd = MonthToDateCosts(example_params)
+    replay_month(mtd, 0, example_params)
+    before = mtd.breakdown(0)
+    saved = mtd.snapshot()
+
+    mtd.add_pdf(0, "hires", pages_per_doc=300, t_total_doc=150_000)
+    assert mtd.breakdown(0).doc_hires > before.doc_hires
+    mtd.retract_pdf(0, "hires", pages_per_doc=300, t_total_doc=150_000)
+    assert mtd.breakdown(0).total == pytest.approx(before.total, rel=1e-12)
+
+    mtd.add_messages(0, "4o", count=1000)
+    mtd.restore(saved)
+    assert mtd.breakdown(0) == before
+
+    mtd.start_new_month()
+    assert mtd.breakdown(0) == CostBreakdown(storage=before.storage)
+    with pytest.raises(IndexError):
+        mtd.add_messages(-1)
@@ -0,0 +1,52 @@
+import numpy as np
+
+from app.send_message import (
+    average_cached_history_tokens,
+    average_cached_history_tokens_batch,
+    average_history_pairs,
+    average_history_pairs_batch,
+    cost_of_message,
+    cost_of_message_batch
+)
+
+
+def test_cost_of_message_batch_matches_scalar_elementwise():
+    rng = np.random.default_rng(1)
+    n = 500
+    grid = dict(
+        max_pairs=rng.integers(0, 50, n),
+        avg_tokens_per_message=rng.integers(1, 400, n),
+        user_tokens=rng.uniform(0, 500, n),
+        n_kbox=rng.uniform(0, 4, n),
+        r_per_kbox=rng.integers(0, 10, n),
+        chunk_size=rng.choice([200.0, 300.0, 512.0], n),
+        out_tokens=rng.uniform(0, 1000, n),
+        p_in=rng.choice([0.005, 0.00015], n),
+        p_out=rng.choice([0.015, 0.0006], n),
+        c_retrieval=1e-5,
+        c_store=1e-5
+    )
+    batch = cost_of_message_batch(**grid)
+    scalar = [cost_of_message(**{k: (v[i] if isinstance(v, np.ndarray) else v) for k, v in grid.items()})
+              for i in range(n)]
+    np.testing.assert_array_equal(batch, scalar)
+
+
+def test_cost_of_message_batch_broadcasts_parameter_grids():
+    max_pairs = np.arange(0, 30)[:, None]
+    n_kbox = np.array([0.0, 1.0, 1.5, 3.0])[None, :]
+    batch = cost_of_message_batch(max_pairs, 100, 50, n_kbox, 5, 300, 300, 0.005, 0.015, 1e-5, 1e-5)
+    assert batch.shape == (30, 4)
+    assert batch[7, 2] == cost_of_message(7, 100, 50, 1.5, 5, 300, 300, 0.005, 0.015, 1e-5, 1e-5)
+
+
+def test_history_helpers_batch_match_scalar():
+    n_msg = np.arange(0, 80)
+    for max_pairs in (0, 1, 5, 25):
+        np.testing.assert_allclose(
+            average_history_pairs_batch(n_msg, max_pairs),
+            [average_history_pairs(int(n), max_pairs) for n in n_msg])
+        for avg in (0, 60, 100, 700):
+            np.testing.assert_allclose(
+                average_cached_history_tokens_batch(n_msg, max_pairs, avg),
+                [average_cached_history_tokens(int(n), max_pairs, avg) for n in n_msg])
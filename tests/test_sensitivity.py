@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from app.compute_total_monthly_cost import cost_monthly_user
+from app.sensitivity import monthly_cost_sensitivity
+
+# Valori dei parametri opzionali quando non indicati
+OPTIONAL_DEFAULTS = {"max_pairs": 25, "avg_tokens_per_message": 100}
+
+
+def finite_difference(params, name):
+    x = params.get(name, OPTIONAL_DEFAULTS.get(name))
+    h = 1e-6 * max(1.0, abs(x))
+    up = cost_monthly_user(**dict(params, **{name: x + h}))
+    down = cost_monthly_user(**dict(params, **{name: x - h}))
+    return (up - down) / (2 * h)
+
+
+@pytest.fixture(params=[{}, dict(growing_history=True, cached_input_ratio=0.5, cache_hit_rate=0.8)],
+                ids=["base", "prompt_caching"])
+def params(request, example_params):
+    # Lontano dai gradini di ceil(t_total / barT_chunk) e ceil(durata / sampling), con
+    # conteggi per bucket interi (n * fraction) come nella versione rilassata
+    return dict(example_params, t_total_doc=5100, dur_sec_vid=125, n_img=10, n_vid=10, **request.param)
+
+
+def test_exact_gradient_matches_finite_differences(params):
+    sens = monthly_cost_sensitivity(relax_steps=False, **params)
+    assert float(sens.total) == pytest.approx(cost_monthly_user(**params), rel=1e-12)
+    for name, derivative in sens.gradient.items():
+        assert float(derivative) == pytest.approx(finite_difference(params, name), rel=1e-5, abs=1e-9), name
+
+
+@pytest.mark.parametrize("name, step", [("t_total_doc", 500), ("dur_sec_vid", 10)])
+def test_relaxed_gradient_is_the_average_slope_across_a_step(params, name, step):
+    # Pendenza media su un gradino intero di ceil(t_total / barT_chunk) o ceil(durata / sampling)
+    relaxed = monthly_cost_sensitivity(relax_steps=True, **params).gradient[name]
+    exact = monthly_cost_sensitivity(relax_steps=False, **params).gradient[name]
+    x = params[name]
+    secant = (cost_monthly_user(**dict(params, **{name: x + step}))
+              - cost_monthly_user(**dict(params, **{name: x - step}))) / (2 * step)
+    assert float(exact) == 0.0
+    assert float(relaxed) == pytest.approx(secant, rel=1e-9)
+
+
+def test_vectorized_over_tenants(params):
+    n_chat = np.array([1, 8, 30])
+    sens = monthly_cost_sensitivity(relax_steps=False, **dict(params, n_chat=n_chat))
+    for i, n in enumerate(n_chat):
+        single = monthly_cost_sensitivity(relax_steps=False, **dict(params, n_chat=int(n)))
+        assert sens.total[i] == pytest.approx(float(single.total))
+        assert sens.elasticity["n_chat"][i] == pytest.approx(float(single.elasticity["n_chat"]))
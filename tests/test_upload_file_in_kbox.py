@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from app.upload_file_in_kbox import (
+    COMMON_RESOLUTIONS,
+    cost_upload_image,
+    cost_upload_image_batch,
+    cost_upload_pdf,
+    cost_upload_pdf_batch,
+    cost_upload_video,
+    cost_upload_video_batch,
+    image_tokens,
+    image_tokens_batch,
+    tokens_for_resolution_tiled,
+    tokens_for_resolution_tiled_batch
+)
+
+RNG = np.random.default_rng(2)
+N = 300
+WIDTH = RNG.integers(16, 5000, N)
+HEIGHT = RNG.integers(16, 5000, N)
+
+
+def test_pdf_batch_matches_scalar():
+    n_pages = RNG.integers(1, 200, N)
+    c_page = RNG.choice([0.01, 0.001], N)
+    t_total = RNG.integers(1, 50000, N)
+    batch = cost_upload_pdf_batch(n_pages, c_page, t_total, 500, 0.00002, 7.5e-6)
+    scalar = [cost_upload_pdf(n_pages[i], c_page[i], t_total[i], 500, 0.00002, 7.5e-6) for i in range(N)]
+    np.testing.assert_array_equal(batch, scalar)
+
+
+@pytest.mark.parametrize("token_model, detail", [("linear", "high"), ("tiled", "high"), ("tiled", "low")])
+def test_image_and_video_batch_match_scalar(token_model, detail):
+    kwargs = dict(token_model=token_model, detail=detail)
+    batch = cost_upload_image_batch(WIDTH, HEIGHT, 100, 0.005, 0.015, 0.00002, 7.5e-6, **kwargs)
+    scalar = [cost_upload_image(WIDTH[i], HEIGHT[i], 100, 0.005, 0.015, 0.00002, 7.5e-6, **kwargs)
+              for i in range(N)]
+    np.testing.assert_allclose(batch, scalar, rtol=1e-15)
+
+    duration = RNG.uniform(1, 3600, N)
+    sampling = RNG.choice([1.0, 2.0, 10.0], N)
+    batch = cost_upload_video_batch(duration, sampling, WIDTH, HEIGHT, 50, 0.005, 0.015,
+                                    0.00002, 7.5e-6, 600, **kwargs)
+    scalar = [cost_upload_video(duration[i], sampling[i], WIDTH[i], HEIGHT[i], 50, 0.005, 0.015,
+                                0.00002, 7.5e-6, 600, **kwargs)
+              for i in range(N)]
+    np.testing.assert_allclose(batch, scalar, rtol=1e-15)
+
+
+def test_tiled_lookup_table_matches_formula():
+    w, h = np.array(COMMON_RESOLUTIONS).T
+    for detail in ("high", "low"):
+        np.testing.assert_array_equal(
+            tokens_for_resolution_tiled_batch(w, h, detail),
+            [tokens_for_resolution_tiled(int(a), int(b), detail) for a, b in COMMON_RESOLUTIONS])
+
+
+@pytest.mark.parametrize("width, height", [(0, 512), (512, 0), (0, 0), (-10, 512)])
+def test_tiled_rejects_non_positive_sides_in_scalar_and_batch(width, height):
+    with pytest.raises(ValueError):
+        tokens_for_resolution_tiled(width, height)
+    with pytest.raises(ValueError):
+        tokens_for_resolution_tiled_batch([512, width], [512, height])
+    # Con detail="low" il costo e' fisso e non dipende dalle dimensioni
+    assert tokens_for_resolution_tiled(width, height, "low") == 85.0
+    np.testing.assert_array_equal(tokens_for_resolution_tiled_batch([width], [height], "low"), [85.0])
+
+
+def test_detail_is_only_validated_for_the_tiled_model():
+    assert image_tokens(512, 512, "linear", detail="auto") == image_tokens(512, 512)
+    np.testing.assert_array_equal(image_tokens_batch([512], [512], "linear", detail="auto"), [255.0])
+    with pytest.raises(ValueError):
+        image_tokens(512, 512, "tiled", detail="auto")
+    with pytest.raises(ValueError):
+        image_tokens_batch([512], [512], "tiled", detail="auto")
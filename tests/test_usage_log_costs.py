@@ -0,0 +1,104 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from app.usage_log_costs import (
+    aggregate_usage_columns,
+    aggregate_usage_costs,
+    cost_events_chunk,
+    read_usage_columns
+)
+
+
+def test_unknown_model_raises_key_error():
+    events = [
+        {"user": "u1", "month": "2026-10", "type": "message", "model": "GPT-4o"},
+        {"user": "u2", "month": "2026-10", "type": "message", "model": "GPT-4o-typo"},
+    ]
+    with pytest.raises(KeyError, match="GPT-4o-typo"):
+        cost_events_chunk(events)
+
+
+def test_unknown_model_raises_for_captions():
+    events = [{"user": "u1", "month": "2026-10", "type": "img", "model": "nope"}]
+    with pytest.raises(KeyError, match="nope"):
+        cost_events_chunk(events)
+
+
+def test_explicit_prices_do_not_need_a_known_model():
+    events = [{"user": "u1", "month": "2026-10", "type": "message", "model": "custom",
+               "p_in": 0.005, "p_out": 0.015}]
+    known = [{"user": "u1", "month": "2026-10", "type": "message", "model": "GPT-4o"}]
+    assert cost_events_chunk(events)[0] == cost_events_chunk(known)[0]
+
+
+EVENTS = [
+    {"user": "u1", "month": "2026-10", "type": "message", "model": "GPT-4o",
+     "user_tokens": 80, "out_tokens": 250, "max_pairs": 10},
+    {"user": "u1", "month": "2026-10", "type": "doc", "pipeline": "HiRes", "n_pages": 12},
+    {"user": "u2", "month": "2026-10", "type": "img", "width": 1024, "height": 768},
+    {"user": "u2", "month": "2026-10", "type": "vid", "duration_sec": 120, "p_in": 0.001,
+     "p_out": 0.002, "model": "custom"},
+    {"user": "u2", "month": "2026-11", "type": "message", "user_tokens": 40},
+    {"user": "utente-con-un-id-molto-piu-lungo-di-32-byte", "month": "2026-11",
+     "type": "doc", "c_page": 0.02},
+]
+
+
+def _write_logs(tmp_path, events):
+    fields = sorted(set().union(*events))
+    csv_path = tmp_path / "log.csv"
+    with open(csv_path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(events)
+    jsonl_path = tmp_path / "log.jsonl"
+    with open(jsonl_path, "w", encoding="utf-8") as f:
+        for i, e in enumerate(events):
+            f.write(json.dumps(e) + "\n" + ("\n" if i == 1 else ""))
+    return str(csv_path), str(jsonl_path)
+
+
+def _assert_same_totals(a, b):
+    assert a.keys() == b.keys()
+    for key in a:
+        assert a[key]["n_events"] == b[key]["n_events"]
+        for field in ("chat", "doc", "img", "vid", "total"):
+            assert a[key][field] == pytest.approx(b[key][field], rel=1e-12)
+
+
+@pytest.mark.parametrize("chunk_events", [1, 2, 65536])
+def test_columnar_readers_match_event_path(tmp_path, chunk_events):
+    csv_path, jsonl_path = _write_logs(tmp_path, EVENTS)
+    expected = aggregate_usage_costs(EVENTS)
+    for path in (csv_path, jsonl_path):
+        got = aggregate_usage_columns(read_usage_columns(path, chunk_events=chunk_events))
+        _assert_same_totals(got, expected)
+
+
+def test_aggregation_matches_per_event_sums():
+    rng = np.random.default_rng(1)
+    events = [{"user": f"u{u}", "month": f"2026-{m:02d}", "type": "message",
+               "user_tokens": int(t)}
+              for u, m, t in zip(rng.integers(0, 300, 2000), rng.integers(1, 4, 2000),
+                                 rng.integers(1, 500, 2000))]
+    costs = cost_events_chunk(events)
+    expected = {}
+    for e, c in zip(events, costs):
+        acc = expected.setdefault((e["user"], e["month"]), [0.0, 0])
+        acc[0] += c
+        acc[1] += 1
+    got = aggregate_usage_costs(events, chunk_events=97)
+    assert got.keys() == expected.keys()
+    for key, (total, n_events) in expected.items():
+        assert got[key]["total"] == pytest.approx(total, rel=1e-12)
+        assert got[key]["n_events"] == n_events
+
+
+def test_unknown_model_raises_in_csv_columns(tmp_path):
+    csv_path, _ = _write_logs(tmp_path, [{"user": "u1", "month": "2026-10",
+                                          "type": "message", "model": "nope"}])
+    with pytest.raises(KeyError, match="nope"):
+        aggregate_usage_columns(read_usage_columns(csv_path))
@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from app.upload_file_in_kbox import cost_upload_video
+from app.video_segments import cost_upload_video_segments, cost_upload_video_segments_batch
+
+CAPTION_KWARGS = dict(width=512, height=512, t_descr=50, p_in=0.00015, p_out=0.00060,
+                      c_embed=0.00002, c_db_chunk=7.5e-6)
+
+
+def test_single_segment_matches_cost_upload_video():
+    single = cost_upload_video_segments([(120, 10)], **CAPTION_KWARGS)
+    legacy = cost_upload_video(120, 10, t_descr_total=12 * 50, **CAPTION_KWARGS)
+    assert single.cost == pytest.approx(legacy)
+
+
+@pytest.mark.parametrize("ratio", [0.0, 0.3, 0.7, 0.9])
+def test_splitting_a_segment_leaves_totals_unchanged(ratio):
+    whole = cost_upload_video_segments([(7200, 1.0, ratio)], barT_chunk=500, **CAPTION_KWARGS)
+    split = cost_upload_video_segments([(1, 1.0, ratio)] * 7200, barT_chunk=500, **CAPTION_KWARGS)
+    uneven = cost_upload_video_segments([(7, 1.0, ratio), (3593, 1.0, ratio), (3600, 1.0, ratio)],
+                                        barT_chunk=500, **CAPTION_KWARGS)
+    for other in (split, uneven):
+        assert other.frames_sampled == whole.frames_sampled
+        assert other.frames_captioned == whole.frames_captioned
+        assert other.cost == pytest.approx(whole.cost)
+
+    batch = cost_upload_video_segments_batch(
+        np.repeat([0, 1, 2], [1, 7200, 3]),
+        duration_sec=np.r_[7200.0, np.ones(7200), 7.0, 3593.0, 3600.0],
+        sampling_sec=1.0, duplicate_ratio=ratio, barT_chunk=500, **CAPTION_KWARGS)
+    np.testing.assert_array_equal(batch.frames_captioned, [whole.frames_captioned] * 3)
+    np.testing.assert_allclose(batch.cost, [whole.cost] * 3)